@@ -13,6 +13,8 @@
 #include "BankDumpCapability.h"
 
 #include "BundledAdaptation.h"
+#include "AdaptationProfiler.h"
+#include "AdaptationWorkerPool.h"
 
 #include <boost/format.hpp>
 
@@ -51,6 +53,37 @@ namespace knobkraft {
 							adaptationSource.revealToUser();
 					}
 				}
+			}}},
+			{ "ToggleProfiling", { "Start/stop profiling", [this]() {
+				// Starting a new profiling run discards the old numbers
+				auto profiler = AdaptationProfiler::instance();
+				if (!profiler->isEnabled()) {
+					profiler->clear();
+				}
+				profiler->setEnabled(!profiler->isEnabled());
+				showProfile();
+			}}},
+			{ "ShowProfile", { "Show profile", [this]() {
+				showProfile();
+			}}},
+			{ "ExportProfile", { "Export profile...", [this]() {
+				FileChooser profileChooser("Please choose a file to store the profile of all adaptations in...", File(), "*.json");
+				if (profileChooser.browseForFileToSave(true)) {
+					if (!AdaptationProfiler::instance()->exportJson(profileChooser.getResult())) {
+						AlertWindow::showMessageBox(AlertWindow::WarningIcon, "Export failed", "Could not write the profile to " + profileChooser.getResult().getFullPathName());
+					}
+				}
+			}}},
+			{ "ToggleWorkers", { "Worker processes on/off", []() {
+				auto pool = AdaptationWorkerPool::instance();
+				pool->setEnabled(!pool->isEnabled());
+				if (pool->isEnabled()) {
+					AlertWindow::showMessageBox(AlertWindow::InfoIcon, "Worker processes on", (boost::format("Bank extraction, patch names and fingerprints of all adaptations "
+						"declaring KNOBKRAFT_WORKER_SAFE are now calculated in up to %d worker processes, one per adaptation") % pool->numberOfWorkers()).str());
+				}
+				else {
+					AlertWindow::showMessageBox(AlertWindow::InfoIcon, "Worker processes off", "All adaptation code runs in the KnobKraft Orm itself again");
+				}
 			}}}
 		};
 
@@ -109,6 +142,13 @@ namespace knobkraft {
 		knobkraftWiki_.setURL(URL("https://github.com/christofmuc/KnobKraft-orm/wiki/" + pageName));
 	}
 
+	void AdaptationView::showProfile()
+	{
+		if (adaptation_) {
+			adaptationInfo_.setText("Calls into the Python code of the adaptation:\n\n" + AdaptationProfiler::instance()->summary(adaptation_->adaptationName()), false);
+		}
+	}
+
 	void AdaptationView::resized()
 	{
 		auto area = getLocalBounds();
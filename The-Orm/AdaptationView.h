@@ -24,6 +24,8 @@ namespace knobkraft {
 		virtual void resized() override;
 
 	private:
+		void showProfile();
+
 		std::shared_ptr<GenericAdaptation> adaptation_;
 
 		InfoText setupHelp_;
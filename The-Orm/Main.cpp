@@ -13,6 +13,7 @@
 #include "OrmLookAndFeel.h"
 
 #include "GenericAdaptation.h"
+#include "AdaptationWorkerPool.h"
 #include "embedded_module.h"
 
 #include <memory>
@@ -71,12 +72,15 @@ public:
     //==============================================================================
     void initialise (const String& commandLine) override
     {
-		ignoreUnused(commandLine);
-
 		// This method is where you should put your application's initialization code...
 		auto applicationDataDirName = "KnobKraftOrm";
 		Settings::setSettingsID(applicationDataDirName);
 
+		// Launched by another Orm to run adaptation code? Then there is no UI, the worker just serves requests until the Orm goes away
+		if (knobkraft::AdaptationWorkerPool::startWorkerIfRequested(commandLine)) {
+			return;
+		}
+
 #ifdef USE_SPARKLE
 #ifdef WIN32
 		// Setup Winsparkle Auto Updater
@@ -164,6 +168,12 @@ public:
 
     void shutdown() override
     {
+		if (knobkraft::AdaptationWorkerPool::isWorkerProcess()) {
+			// The worker never saves the settings, they belong to the Orm that started it
+			knobkraft::AdaptationWorkerPool::shutdownWorker();
+			return;
+		}
+
 		// Unregister
 		UIModel::instance()->windowTitle_.removeChangeListener(this);
 
@@ -171,6 +181,7 @@ public:
 		SimpleLogger::shutdown(); // That needs to be shutdown before deleting the MainWindow, because it wants to log into that!
 		
 		// No more Python from here please
+		knobkraft::AdaptationWorkerPool::shutdown();
 		knobkraft::GenericAdaptation::shutdownGenericAdaptation();
 
 		mainWindow = nullptr; // (deletes our window)
@@ -197,7 +208,11 @@ public:
     void systemRequestedQuit() override
     {
 		// Shut down database (that makes a backup)
-		// Do this before calling quit
+		// Do this before calling quit. A worker process has no window and no database
+		if (!mainWindow) {
+			quit();
+			return;
+		}
 		auto mainComp = dynamic_cast<MainComponent *>(mainWindow->getContentComponent());
 		if (mainComp) {
 			// Give it a chance to complete the Database backup
@@ -116,6 +116,9 @@ PatchView::PatchView(midikraft::PatchDatabase &database, std::vector<midikraft::
 	{ "exportPIF", { "Export into PIF", [this]() {
 		createPatchInterchangeFile();
 	} } },
+	{ "sendBank", { "Send patches as bank to synth", [this]() {
+		sendBankToSynth();
+	} } },
 	{ "showDiff", { "Show patch comparison", [this]() {
 		showPatchDiffDialog();
 	} } },
@@ -493,7 +496,21 @@ public:
 			SimpleLogger::instance()->postMessage("No patches contained in data, nothing to upload.");
 		}
 		else {
+			// The database fingerprints each patch to find the known ones, for the adaptations this is one batch call per synth
+			std::map<knobkraft::GenericAdaptation *, std::vector<std::shared_ptr<midikraft::DataFile>>> adaptationPatches;
+			for (auto const &patch : patchesLoaded_) {
+				auto adaptation = dynamic_cast<knobkraft::GenericAdaptation *>(patch.synth());
+				if (adaptation) {
+					adaptationPatches[adaptation].push_back(patch.patch());
+				}
+			}
+			for (auto const &adaptation : adaptationPatches) {
+				adaptation.first->prepareFingerprints(adaptation.second);
+			}
 			auto numberNew = database_.mergePatchesIntoDatabase(patchesLoaded_, outNewPatches, this, midikraft::PatchDatabase::UPDATE_NAME | midikraft::PatchDatabase::UPDATE_CATEGORIES | midikraft::PatchDatabase::UPDATE_FAVORITE);
+			for (auto const &adaptation : adaptationPatches) {
+				adaptation.first->forgetPreparedResults();
+			}
 			if (numberNew > 0) {
 				SimpleLogger::instance()->postMessage((boost::format("Retrieved %d new or changed patches from the synth, uploaded to database") % numberNew).str());
 				finished_(outNewPatches);
@@ -628,6 +645,39 @@ void PatchView::createPatchInterchangeFile()
 	});
 }
 
+void PatchView::sendBankToSynth()
+{
+	auto synth = UIModel::instance()->currentSynth_.smartSynth();
+	auto adaptation = std::dynamic_pointer_cast<knobkraft::GenericAdaptation>(synth);
+	if (!adaptation || !adaptation->hasBankUpload()) {
+		AlertWindow::showMessageBox(AlertWindow::InfoIcon, "Bank upload not available", "The current synth cannot receive a whole bank, please send the patches one by one by clicking on them.");
+		return;
+	}
+	auto location = midikraft::Capability::hasCapability<midikraft::MidiLocationCapability>(synth);
+	if (!location) {
+		return;
+	}
+	loadPage(0, -1, [adaptation, location](std::vector<midikraft::PatchHolder> patches) {
+		// Only the patches of this synth, and not more than fit into one bank
+		std::vector<std::shared_ptr<midikraft::DataFile>> bank;
+		size_t bankSize = (size_t) std::max(adaptation->numberOfPatches(), 0);
+		for (auto const &patch : patches) {
+			if (patch.synth() == adaptation.get() && bank.size() < bankSize) {
+				bank.push_back(patch.patch());
+			}
+		}
+		if (bank.empty()) {
+			AlertWindow::showMessageBox(AlertWindow::InfoIcon, "No patches to send", "The current filter does not show any patches of " + adaptation->getName());
+			return;
+		}
+		if (AlertWindow::showOkCancelBox(AlertWindow::WarningIcon, "Overwrite bank in synth?",
+			(boost::format("This will send the first %d patches of the current filter as one bank to the %s, overwriting the patches stored in the synth.\n\n"
+				"Do you want to continue?") % bank.size() % adaptation->getName()).str())) {
+			adaptation->sendBankToSynth(location->midiOutput(), bank);
+		}
+	});
+}
+
 void PatchView::mergeNewPatches(std::vector<midikraft::PatchHolder> patchesLoaded) {
 	MergeManyPatchFiles backgroundThread(database_, patchesLoaded, [this](std::vector<midikraft::PatchHolder> outNewPatches) {
 		// Back to UI thread
@@ -88,6 +88,7 @@ private:
 	void exportPatches();
 	void updateLastPath();
 	void createPatchInterchangeFile();
+	void sendBankToSynth();
 	void mergeNewPatches(std::vector<midikraft::PatchHolder> patchesLoaded);
 	void selectPatch(midikraft::PatchHolder &patch, bool alsoSendToSynth);
 	void showPatchDiffDialog();
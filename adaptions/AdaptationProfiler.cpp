@@ -0,0 +1,259 @@
+/*
+   Copyright (c) 2021 Christof Ruch. All rights reserved.
+
+   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+*/
+
+#include "AdaptationProfiler.h"
+
+#include <boost/format.hpp>
+
+#include <algorithm>
+
+namespace py = pybind11;
+
+namespace knobkraft {
+
+	namespace {
+		// GIL waiting time of this thread not yet booked on a call, and how often pending time has been booked
+		thread_local double tPendingGilWaitSeconds = 0.0;
+		thread_local uint64_t tGilWaitBookings = 0;
+		// The innermost call being profiled on this thread
+		thread_local ProfiledCall *tActiveCall = nullptr;
+
+		double secondsSince(std::chrono::steady_clock::time_point start) {
+			return std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+		}
+	}
+
+	AdaptationProfiler *AdaptationProfiler::instance()
+	{
+		static AdaptationProfiler sInstance;
+		return &sInstance;
+	}
+
+	bool AdaptationProfiler::isEnabled() const
+	{
+		return enabled_.load(std::memory_order_relaxed);
+	}
+
+	void AdaptationProfiler::setEnabled(bool enabled)
+	{
+		enabled_ = enabled;
+	}
+
+	void AdaptationProfiler::clear()
+	{
+		std::lock_guard<std::mutex> lock(mutex_);
+		statistics_.clear();
+	}
+
+	void AdaptationProfiler::record(std::string const &adaptation, std::string const &functionName, double seconds, double gilWaitSeconds, uint64_t bytesMarshalled)
+	{
+		std::lock_guard<std::mutex> lock(mutex_);
+		auto &entry = statistics_[adaptation][functionName];
+		entry.calls++;
+		entry.totalSeconds += seconds;
+		entry.maxSeconds = std::max(entry.maxSeconds, seconds);
+		entry.gilWaitSeconds += gilWaitSeconds;
+		entry.bytesMarshalled += bytesMarshalled;
+		entry.histogram[histogramBucket(seconds)]++;
+	}
+
+	AdaptationProfiler::TStatistics AdaptationProfiler::statistics() const
+	{
+		std::lock_guard<std::mutex> lock(mutex_);
+		return statistics_;
+	}
+
+	std::string AdaptationProfiler::summary(std::string const &adaptation) const
+	{
+		auto all = statistics();
+		std::string result = (boost::format("Profiling is %s\n\n") % (isEnabled() ? "on" : "off")).str();
+		auto found = all.find(adaptation);
+		if (found == all.end()) {
+			return result + "No calls recorded for " + adaptation + "\n";
+		}
+		for (auto const &function : found->second) {
+			auto const &s = function.second;
+			result += (boost::format("%s: %d calls, %.2f ms total, %.1f us mean, %.1f us max, %.2f ms GIL wait, %d bytes\n")
+				% function.first % s.calls % (s.totalSeconds * 1e3) % (s.totalSeconds * 1e6 / s.calls) % (s.maxSeconds * 1e6)
+				% (s.gilWaitSeconds * 1e3) % s.bytesMarshalled).str();
+			std::string histogram;
+			for (int i = 0; i < kHistogramBuckets; i++) {
+				if (s.histogram[i] > 0) {
+					// The last bucket has no upper bound, it counts everything from 2^(i-1) microseconds on
+					if (i == kHistogramBuckets - 1) {
+						histogram += (boost::format(" >=%dus:%d") % (1LL << (i - 1)) % s.histogram[i]).str();
+					}
+					else {
+						histogram += (boost::format(" <%dus:%d") % (1LL << i) % s.histogram[i]).str();
+					}
+				}
+			}
+			result += "   " + histogram + "\n";
+		}
+		return result;
+	}
+
+	std::string AdaptationProfiler::toJson() const
+	{
+		auto all = statistics();
+		var buckets;
+		for (int i = 0; i < kHistogramBuckets - 1; i++) {
+			buckets.append((int64)(1LL << i));
+		}
+		// The last bucket is open ended, written as null
+		buckets.append(var());
+		auto adaptations = new DynamicObject();
+		for (auto const &adaptation : all) {
+			auto functions = new DynamicObject();
+			for (auto const &function : adaptation.second) {
+				auto const &s = function.second;
+				var histogram;
+				for (auto count : s.histogram) {
+					histogram.append((int64)count);
+				}
+				auto entry = new DynamicObject();
+				entry->setProperty("calls", (int64)s.calls);
+				entry->setProperty("total_seconds", s.totalSeconds);
+				entry->setProperty("max_seconds", s.maxSeconds);
+				entry->setProperty("gil_wait_seconds", s.gilWaitSeconds);
+				entry->setProperty("bytes_marshalled", (int64)s.bytesMarshalled);
+				entry->setProperty("histogram", histogram);
+				functions->setProperty(String(function.first), var(entry));
+			}
+			adaptations->setProperty(String(adaptation.first), var(functions));
+		}
+		auto result = new DynamicObject();
+		result->setProperty("enabled", isEnabled());
+		result->setProperty("histogram_upper_bounds_us", buckets);
+		result->setProperty("adaptations", var(adaptations));
+		return JSON::toString(var(result)).toStdString();
+	}
+
+	bool AdaptationProfiler::exportJson(File const &file) const
+	{
+		return file.replaceWithText(toJson());
+	}
+
+	int AdaptationProfiler::histogramBucket(double seconds)
+	{
+		int bucket = 0;
+		double limit = 1e-6;
+		while (seconds >= limit && bucket < kHistogramBuckets - 1) {
+			limit *= 2.0;
+			bucket++;
+		}
+		return bucket;
+	}
+
+	uint64_t AdaptationProfiler::marshalledBytes(py::object const &object)
+	{
+		return marshalledBytesOf(object);
+	}
+
+	uint64_t AdaptationProfiler::marshalledBytesOf(py::handle object)
+	{
+		if (PyBytes_Check(object.ptr())) {
+			return (uint64_t)PyBytes_GET_SIZE(object.ptr());
+		}
+		if (PyByteArray_Check(object.ptr())) {
+			return (uint64_t)PyByteArray_GET_SIZE(object.ptr());
+		}
+		if (PyList_Check(object.ptr()) || PyTuple_Check(object.ptr())) {
+			uint64_t result = 0;
+			for (auto item : object) {
+				if (PyLong_Check(item.ptr())) {
+					// A list of ints, one per byte
+					return (uint64_t)py::len(object);
+				}
+				result += marshalledBytesOf(item);
+			}
+			return result;
+		}
+		return 0;
+	}
+
+	ProfiledCall::ProfiledCall(std::string const &adaptation, std::string const &functionName) :
+		// While loading, the adaptation has no name yet
+		enabled_(AdaptationProfiler::instance()->isEnabled() && !adaptation.empty())
+	{
+		if (enabled_) {
+			adaptation_ = adaptation;
+			functionName_ = functionName;
+			start_ = std::chrono::steady_clock::now();
+			// The GIL might have been acquired already for this call
+			gilWaitSeconds_ = tPendingGilWaitSeconds;
+			if (tPendingGilWaitSeconds > 0.0) {
+				tPendingGilWaitSeconds = 0.0;
+				tGilWaitBookings++;
+			}
+			outerCall_ = tActiveCall;
+			tActiveCall = this;
+		}
+	}
+
+	ProfiledCall::~ProfiledCall()
+	{
+		if (enabled_) {
+			tActiveCall = outerCall_;
+			AdaptationProfiler::instance()->record(adaptation_, functionName_, secondsSince(start_), gilWaitSeconds_, bytes_);
+		}
+	}
+
+	bool ProfiledCall::isEnabled() const
+	{
+		return enabled_;
+	}
+
+	void ProfiledCall::addBytes(uint64_t bytes)
+	{
+		bytes_ += bytes;
+	}
+
+	ProfiledGilAcquire::ProfiledGilAcquire() :
+		start_(AdaptationProfiler::instance()->isEnabled() ? std::chrono::steady_clock::now() : std::chrono::steady_clock::time_point())
+	{
+		// The GIL has been acquired by the member initialization
+		if (start_ != std::chrono::steady_clock::time_point()) {
+			double waited = secondsSince(start_);
+			if (tActiveCall) {
+				tActiveCall->gilWaitSeconds_ += waited;
+			}
+			else {
+				tPendingGilWaitSeconds += waited;
+				pendingSeconds_ = waited;
+				bookings_ = tGilWaitBookings;
+			}
+		}
+	}
+
+	ProfiledGilAcquire::~ProfiledGilAcquire()
+	{
+		// Not booked because no call was made, e.g. the wrapper returned early. Don't book it on an unrelated call later
+		if (pendingSeconds_ > 0.0 && bookings_ == tGilWaitBookings) {
+			tPendingGilWaitSeconds = std::max(0.0, tPendingGilWaitSeconds - pendingSeconds_);
+		}
+	}
+
+}
+
+// The module knobkraft gives adaptations access to the profiler, so authors can measure their own code next to the calls the Orm makes
+PYBIND11_EMBEDDED_MODULE(knobkraft, m) {
+	m.def("profiler_enabled", []() {
+		return knobkraft::AdaptationProfiler::instance()->isEnabled();
+	});
+	m.def("enable_profiler", [](bool enabled) {
+		knobkraft::AdaptationProfiler::instance()->setEnabled(enabled);
+	}, py::arg("enabled") = true);
+	m.def("record_call", [](std::string const &adaptation, std::string const &functionName, double seconds, uint64_t bytesMarshalled) {
+		knobkraft::AdaptationProfiler::instance()->record(adaptation, functionName, seconds, 0.0, bytesMarshalled);
+	}, py::arg("adaptation"), py::arg("function_name"), py::arg("seconds"), py::arg("bytes_marshalled") = 0);
+	m.def("profiler_statistics", []() {
+		return knobkraft::AdaptationProfiler::instance()->toJson();
+	});
+	m.def("clear_profiler", []() {
+		knobkraft::AdaptationProfiler::instance()->clear();
+	});
+}
@@ -0,0 +1,104 @@
+/*
+   Copyright (c) 2021 Christof Ruch. All rights reserved.
+
+   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+*/
+
+#pragma once
+
+#include "JuceHeader.h"
+
+#include <pybind11/embed.h>
+
+#include <array>
+#include <atomic>
+#include <chrono>
+#include <map>
+#include <mutex>
+
+namespace knobkraft {
+
+	// Statistics of the calls into the Python code, per adaptation and function. It is switched off by default,
+	// and then costs only one atomic read per call
+	class AdaptationProfiler {
+	public:
+		// Bucket 0 counts calls shorter than 1 microsecond, bucket i the calls between 2^(i-1) and 2^i microseconds,
+		// and the last bucket all calls longer than that
+		static const int kHistogramBuckets = 24;
+
+		struct FunctionStatistics {
+			uint64_t calls = 0;
+			double totalSeconds = 0.0;
+			double maxSeconds = 0.0;
+			double gilWaitSeconds = 0.0;
+			uint64_t bytesMarshalled = 0;
+			std::array<uint64_t, kHistogramBuckets> histogram{};
+		};
+		typedef std::map<std::string, std::map<std::string, FunctionStatistics>> TStatistics;
+
+		static AdaptationProfiler *instance();
+
+		bool isEnabled() const;
+		void setEnabled(bool enabled);
+		void clear();
+
+		void record(std::string const &adaptation, std::string const &functionName, double seconds, double gilWaitSeconds, uint64_t bytesMarshalled);
+		TStatistics statistics() const;
+
+		// A readable table for one adaptation, and the statistics of all adaptations as JSON
+		std::string summary(std::string const &adaptation) const;
+		std::string toJson() const;
+		bool exportJson(File const &file) const;
+
+		static int histogramBucket(double seconds);
+
+		// Number of MIDI bytes in an argument or result: bytes, bytearray and lists or tuples of ints, also nested.
+		// Needs the GIL
+		static uint64_t marshalledBytes(pybind11::object const &object);
+		template <typename T> static uint64_t marshalledBytes(T const &) { return 0; }
+
+	private:
+		static uint64_t marshalledBytesOf(pybind11::handle object);
+
+		std::atomic<bool> enabled_{ false };
+		mutable std::mutex mutex_;
+		TStatistics statistics_;
+	};
+
+	// Measures one call into Python, construct it before acquiring the GIL
+	class ProfiledCall {
+	public:
+		ProfiledCall(std::string const &adaptation, std::string const &functionName);
+		~ProfiledCall();
+
+		bool isEnabled() const;
+		void addBytes(uint64_t bytes);
+
+	private:
+		friend class ProfiledGilAcquire;
+
+		bool enabled_;
+		std::string adaptation_;
+		std::string functionName_;
+		std::chrono::steady_clock::time_point start_;
+		uint64_t bytes_ = 0;
+		double gilWaitSeconds_ = 0.0;
+		ProfiledCall *outerCall_ = nullptr;
+	};
+
+	// Drop in replacement for py::gil_scoped_acquire, measuring how long the thread had to wait for the GIL.
+	// The waiting time is booked on the ProfiledCall running on the same thread, or if there is none on the next one
+	// started while the GIL is held. If no call is made, it is dropped again at the end of the scope
+	class ProfiledGilAcquire {
+	public:
+		ProfiledGilAcquire();
+		~ProfiledGilAcquire();
+
+	private:
+		std::chrono::steady_clock::time_point start_;
+		pybind11::gil_scoped_acquire acquire_;
+		double pendingSeconds_ = 0.0;
+		uint64_t bookings_ = 0;
+	};
+
+}
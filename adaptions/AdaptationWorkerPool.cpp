@@ -0,0 +1,423 @@
+/*
+   Copyright (c) 2021 Christof Ruch. All rights reserved.
+
+   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+*/
+
+#include "AdaptationWorkerPool.h"
+
+#include "GenericAdaptation.h"
+#include "BundledAdaptation.h"
+
+#include "Logger.h"
+#include "Settings.h"
+
+#include <boost/format.hpp>
+#include <boost/algorithm/string.hpp>
+
+#include <algorithm>
+#include <iostream>
+#include <map>
+
+namespace py = pybind11;
+
+namespace knobkraft {
+
+	const char *kWorkerCommandLineUID = "knobkraft-adaptation-worker";
+	const char *kWorkerProcessesSettingsKey = "adaptation_worker_processes";
+	const char *kWorkerProtocolModule = "sequential.AdaptationWorker";
+
+	std::unique_ptr<AdaptationWorkerPool> AdaptationWorkerPool::sInstance_;
+	std::unique_ptr<AdaptationWorkerPool::WorkerProcess> AdaptationWorkerPool::sWorkerProcess_;
+
+	// The Orm side of the connection to one worker. It is used by one thread at a time, which blocks in request() until
+	// the worker has answered
+	class AdaptationWorkerPool::Worker : public ChildProcessMaster {
+	public:
+		Worker(int generation) : generation_(generation) {}
+
+		bool start() {
+			// The worker's output is not read, so don't capture it, else a chatty adaptation could fill up the pipe
+			return launchSlaveProcess(File::getSpecialLocation(File::currentExecutableFile), kWorkerCommandLineUID, 0, 0);
+		}
+
+		bool request(MemoryBlock const &message, MemoryBlock &outReply) {
+			{
+				std::lock_guard<std::mutex> lock(mutex_);
+				answered_ = false;
+			}
+			if (!sendMessageToSlave(message)) {
+				return false;
+			}
+			std::unique_lock<std::mutex> lock(mutex_);
+			answer_.wait(lock, [this]() { return answered_ || lost_; });
+			if (!answered_) {
+				return false;
+			}
+			outReply = reply_;
+			return true;
+		}
+
+		int generation() const {
+			return generation_;
+		}
+
+		void handleMessageFromSlave(MemoryBlock const &message) override {
+			std::lock_guard<std::mutex> lock(mutex_);
+			reply_ = message;
+			answered_ = true;
+			answer_.notify_all();
+		}
+
+		void handleConnectionLost() override {
+			std::lock_guard<std::mutex> lock(mutex_);
+			lost_ = true;
+			answer_.notify_all();
+		}
+
+	private:
+		int generation_;
+		std::mutex mutex_;
+		std::condition_variable answer_;
+		MemoryBlock reply_;
+		bool answered_ = false;
+		bool lost_ = false;
+	};
+
+	// The worker has no log view, its messages go to the console
+	class WorkerLogger : public SimpleLogger {
+	public:
+		void postMessage(const String& message) override {
+			std::cerr << message << std::endl;
+		}
+	};
+
+	// The worker side. The requests are executed on a thread of their own, so the connection keeps answering the pings
+	// of the Orm during long calls
+	class AdaptationWorkerPool::WorkerProcess : public ChildProcessSlave, private Thread {
+	public:
+		WorkerProcess() : Thread("AdaptationWorker") {}
+
+		~WorkerProcess() override {
+			stopThread(2000);
+			if (Py_IsInitialized()) {
+				py::gil_scoped_acquire acquire;
+				adaptations_.clear();
+			}
+		}
+
+		// Requests arriving before are queued until Python is up
+		void start() {
+			logger_ = std::make_unique<WorkerLogger>();
+			startThread();
+		}
+
+		void handleMessageFromMaster(MemoryBlock const &message) override {
+			{
+				std::lock_guard<std::mutex> lock(mutex_);
+				pending_.push_back(message);
+			}
+			notify();
+		}
+
+		void handleConnectionLost() override {
+			// The Orm is gone, so is this worker
+			MessageManager::callAsync([]() { JUCEApplicationBase::quit(); });
+		}
+
+	private:
+		void run() override {
+			while (!threadShouldExit()) {
+				MemoryBlock request;
+				{
+					std::lock_guard<std::mutex> lock(mutex_);
+					if (!pending_.empty()) {
+						request = pending_.front();
+						pending_.erase(pending_.begin());
+					}
+				}
+				if (request.getSize() == 0) {
+					wait(-1);
+					continue;
+				}
+				sendMessageToMaster(execute(request));
+			}
+		}
+
+		MemoryBlock execute(MemoryBlock const &request) {
+			py::gil_scoped_acquire acquire;
+			try {
+				auto protocol = py::module::import(kWorkerProtocolModule);
+				auto resolve = py::cpp_function([this](std::string const &moduleName, bool fromFile, std::string const &functionName) {
+					return resolveFunction(moduleName, fromFile, functionName);
+				});
+				auto response = protocol.attr("execute_request")(py::bytes(static_cast<const char *>(request.getData()), request.getSize()), resolve);
+				auto data = response.cast<std::string>();
+				return MemoryBlock(data.data(), data.size());
+			}
+			catch (py::error_already_set &ex) {
+				std::cerr << "Adaptation worker: " << ex.what() << std::endl;
+			}
+			catch (std::exception &ex) {
+				std::cerr << "Adaptation worker: " << ex.what() << std::endl;
+			}
+			// An empty answer tells the Orm to do the call itself
+			return {};
+		}
+
+		py::object resolveFunction(std::string const &moduleName, bool fromFile, std::string const &functionName) {
+			auto found = adaptations_.find(moduleName);
+			if (found == adaptations_.end()) {
+				std::shared_ptr<GenericAdaptation> adaptation;
+				if (fromFile) {
+					adaptation = std::make_shared<GenericAdaptation>(moduleName);
+				}
+				else {
+					for (auto const &bundled : BundledAdaptations::getAll()) {
+						if (bundled.pythonModuleName == moduleName) {
+							adaptation = GenericAdaptation::fromBinaryCode(bundled.pythonModuleName, bundled.adaptationSourceCode);
+						}
+					}
+				}
+				if (!adaptation) {
+					throw std::runtime_error("Adaptation module " + moduleName + " could not be loaded in the worker");
+				}
+				found = adaptations_.emplace(moduleName, adaptation).first;
+			}
+			auto function = found->second->pythonFunction(functionName);
+			if (function.is_none()) {
+				throw std::runtime_error("Adaptation module " + moduleName + " does not implement " + functionName);
+			}
+			return function;
+		}
+
+		std::unique_ptr<WorkerLogger> logger_;
+		std::mutex mutex_;
+		std::vector<MemoryBlock> pending_;
+		std::map<std::string, std::shared_ptr<GenericAdaptation>> adaptations_;
+	};
+
+	AdaptationWorkerPool::AdaptationWorkerPool() :
+		// Leave one core to the Orm itself, but have at least two, so one slow adaptation doesn't hold up the others
+		numberOfWorkers_(std::max(2, SystemStats::getNumCpus() - 1))
+	{
+		workers_.resize(numberOfWorkers_);
+		busy_.assign(numberOfWorkers_, 0);
+		enabled_ = Settings::instance().get(kWorkerProcessesSettingsKey, "0") == "1";
+	}
+
+	AdaptationWorkerPool::~AdaptationWorkerPool()
+	{
+		std::lock_guard<std::mutex> lock(mutex_);
+		workers_.clear();
+	}
+
+	AdaptationWorkerPool *AdaptationWorkerPool::instance()
+	{
+		static std::mutex sInstanceMutex;
+		std::lock_guard<std::mutex> lock(sInstanceMutex);
+		if (!sInstance_) {
+			sInstance_.reset(new AdaptationWorkerPool());
+		}
+		return sInstance_.get();
+	}
+
+	void AdaptationWorkerPool::shutdown()
+	{
+		// Terminates the idle workers, busy workers notice the Orm is gone
+		sInstance_.reset();
+	}
+
+	bool AdaptationWorkerPool::isEnabled() const
+	{
+		// A worker must never send on to further workers
+		return enabled_.load(std::memory_order_relaxed) && !sWorkerProcess_;
+	}
+
+	void AdaptationWorkerPool::setEnabled(bool enabled)
+	{
+		enabled_ = enabled;
+		launchFailed_ = false;
+		Settings::instance().set(kWorkerProcessesSettingsKey, enabled ? "1" : "0");
+		if (!enabled) {
+			restartWorkers();
+		}
+	}
+
+	int AdaptationWorkerPool::numberOfWorkers() const
+	{
+		return numberOfWorkers_;
+	}
+
+	bool AdaptationWorkerPool::runsInWorker(std::string const &functionName)
+	{
+		return functionName == kExtractPatchesFromBank;
+	}
+
+	std::vector<AdaptationWorkerPool::WorkerResult> AdaptationWorkerPool::callAll(GenericAdaptation const *adaptation, std::string const &functionName, std::vector<py::tuple> const &arguments)
+	{
+		// Needs the GIL
+		if (launchFailed_) {
+			throw WorkerUnavailable("Adaptation worker processes could not be started");
+		}
+		if (!adaptation->isWorkerSafe()) {
+			throw WorkerUnavailable("Adaptation does not define KNOBKRAFT_WORKER_SAFE");
+		}
+		auto protocol = py::module::import(kWorkerProtocolModule);
+		auto moduleName = adaptation->pythonModuleName();
+		py::list calls;
+		for (auto const &argument : arguments) {
+			calls.append(argument);
+		}
+		auto encoded = protocol.attr("encode_request")(moduleName, adaptation->isFromFile(), functionName, calls).cast<std::string>();
+		MemoryBlock request(encoded.data(), encoded.size());
+
+		MemoryBlock reply;
+		bool answered;
+		{
+			py::gil_scoped_release release;
+			answered = send(moduleName, request, reply);
+		}
+		if (!answered) {
+			throw WorkerUnavailable("Adaptation worker process did not answer");
+		}
+
+		std::vector<WorkerResult> results;
+		auto response = protocol.attr("decode_response")(py::bytes(static_cast<const char *>(reply.getData()), reply.getSize()));
+		std::string output = response[py::int_(1)].cast<std::string>();
+		boost::trim_right(output);
+		if (!output.empty()) {
+			SimpleLogger::instance()->postMessage((boost::format("Adaptation: %s") % output).str());
+		}
+		for (auto entry : response[py::int_(0)]) {
+			auto pair = entry.cast<py::tuple>();
+			if (pair[0].cast<bool>()) {
+				results.push_back({ true, pair[1], "" });
+			}
+			else {
+				results.push_back({ false, py::none(), pair[1].cast<std::string>() });
+			}
+		}
+		return results;
+	}
+
+	py::object AdaptationWorkerPool::call(GenericAdaptation const *adaptation, std::string const &functionName, py::tuple const &arguments)
+	{
+		auto results = callAll(adaptation, functionName, { arguments });
+		if (results.size() != 1) {
+			throw WorkerUnavailable("Adaptation worker process returned wrong number of results");
+		}
+		if (!results[0].ok) {
+			throw py::value_error(results[0].error);
+		}
+		return results[0].value;
+	}
+
+	void AdaptationWorkerPool::restartWorkers()
+	{
+		std::vector<std::unique_ptr<Worker>> stopping;
+		{
+			std::lock_guard<std::mutex> lock(mutex_);
+			// Busy workers are dropped when they are released
+			generation_++;
+			for (auto &worker : workers_) {
+				if (worker) {
+					stopping.push_back(std::move(worker));
+				}
+			}
+			assigned_.clear();
+			launchFailed_ = false;
+		}
+		available_.notify_all();
+	}
+
+	bool AdaptationWorkerPool::send(std::string const &moduleName, MemoryBlock const &request, MemoryBlock &outReply)
+	{
+		size_t slot;
+		auto worker = acquireWorker(moduleName, slot);
+		if (!worker) {
+			return false;
+		}
+		bool answered = worker->request(request, outReply);
+		releaseWorker(slot, std::move(worker), answered);
+		return answered && outReply.getSize() > 0;
+	}
+
+	std::unique_ptr<AdaptationWorkerPool::Worker> AdaptationWorkerPool::acquireWorker(std::string const &moduleName, size_t &outSlot)
+	{
+		// Each worker process is an interpreter with a GIL of its own. An adaptation is assigned to one worker, the one with the
+		// fewest adaptations, and all its calls go there. So it is loaded only once, and different synths don't wait for each other
+		// as long as there are no more adaptations in use than workers. After that, adaptations share a worker and wait for each other
+		std::unique_lock<std::mutex> lock(mutex_);
+		auto assigned = assigned_.find(moduleName);
+		if (assigned == assigned_.end()) {
+			std::vector<int> adaptations(workers_.size(), 0);
+			for (auto const &entry : assigned_) {
+				adaptations[entry.second]++;
+			}
+			size_t fewest = std::min_element(adaptations.begin(), adaptations.end()) - adaptations.begin();
+			assigned = assigned_.emplace(moduleName, fewest).first;
+		}
+		size_t slot = assigned->second;
+		available_.wait(lock, [this, slot]() { return launchFailed_ || !busy_[slot]; });
+		if (launchFailed_) {
+			return nullptr;
+		}
+		busy_[slot] = 1;
+		outSlot = slot;
+		if (workers_[slot]) {
+			return std::move(workers_[slot]);
+		}
+		int generation = generation_;
+		lock.unlock();
+		auto worker = std::make_unique<Worker>(generation);
+		if (worker->start()) {
+			return worker;
+		}
+		SimpleLogger::instance()->postMessage("Adaptation: Could not start worker process, calling adaptations in the Orm itself");
+		lock.lock();
+		busy_[slot] = 0;
+		launchFailed_ = true;
+		available_.notify_all();
+		return nullptr;
+	}
+
+	void AdaptationWorkerPool::releaseWorker(size_t slot, std::unique_ptr<Worker> worker, bool alive)
+	{
+		{
+			std::lock_guard<std::mutex> lock(mutex_);
+			busy_[slot] = 0;
+			if (alive && worker->generation() == generation_) {
+				workers_[slot] = std::move(worker);
+			}
+			// Else it is replaced on demand
+		}
+		// Others might wait for different workers
+		available_.notify_all();
+		// Workers not returned to the pool terminate here, outside of the lock
+	}
+
+	bool AdaptationWorkerPool::startWorkerIfRequested(String const &commandLine)
+	{
+		auto worker = std::make_unique<WorkerProcess>();
+		if (!worker->initialiseFromCommandLine(commandLine, kWorkerCommandLineUID)) {
+			return false;
+		}
+		sWorkerProcess_ = std::move(worker);
+		GenericAdaptation::startupGenericAdaptation();
+		sWorkerProcess_->start();
+		return true;
+	}
+
+	bool AdaptationWorkerPool::isWorkerProcess()
+	{
+		return sWorkerProcess_ != nullptr;
+	}
+
+	void AdaptationWorkerPool::shutdownWorker()
+	{
+		sWorkerProcess_.reset();
+		GenericAdaptation::shutdownGenericAdaptation();
+	}
+
+}
@@ -0,0 +1,97 @@
+/*
+   Copyright (c) 2021 Christof Ruch. All rights reserved.
+
+   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+*/
+
+#pragma once
+
+#include "JuceHeader.h"
+
+#include <pybind11/embed.h>
+
+#include <atomic>
+#include <condition_variable>
+#include <map>
+#include <mutex>
+
+namespace knobkraft {
+
+	class GenericAdaptation;
+
+	// Optional mode running the pure functions of the adaptations in worker processes, which are instances of the Orm
+	// started without UI. Requests and results are pickled by sequential.AdaptationWorker and sent over the pipe of
+	// the JUCE child process connection, so the Orm gets the same Python objects as from a call in its own interpreter.
+	// While waiting for the worker the GIL is released. Each worker is an interpreter with a GIL of its own. There are max(2, cores - 1)
+	// workers, not one per adaptation: each adaptation is assigned to the worker with the fewest adaptations, which gets all its calls.
+	// So the adaptations of different synths run in parallel only as long as there are at least as many workers as adaptations in use.
+	// With more adaptations, several share a worker and their calls are done one after the other, as are the calls of one adaptation
+	class AdaptationWorkerPool {
+	public:
+		// Thrown when no worker can take the call, the caller should then call the function itself
+		class WorkerUnavailable : public std::runtime_error {
+		public:
+			using std::runtime_error::runtime_error;
+		};
+
+		struct WorkerResult {
+			bool ok;
+			pybind11::object value;
+			std::string error;
+		};
+
+		static AdaptationWorkerPool *instance();
+		static void shutdown();
+		~AdaptationWorkerPool();
+
+		// Persisted in the settings, off by default
+		bool isEnabled() const;
+		void setEnabled(bool enabled);
+		int numberOfWorkers() const;
+
+		// Functions without side effects that are sent to a worker by every call when the pool is enabled and the adaptation
+		// defines KNOBKRAFT_WORKER_SAFE = True. The batch functions for names and fingerprints are sent to the worker by GenericAdaptation instead
+		static bool runsInWorker(std::string const &functionName);
+
+		// Calls the function of the adaptation once for each argument tuple, all in the worker assigned to the adaptation.
+		// Needs the GIL, which is released while waiting. Throws WorkerUnavailable
+		std::vector<WorkerResult> callAll(GenericAdaptation const *adaptation, std::string const &functionName, std::vector<pybind11::tuple> const &arguments);
+		// A single call, errors of the adaptation are raised as Python exception
+		pybind11::object call(GenericAdaptation const *adaptation, std::string const &functionName, pybind11::tuple const &arguments);
+
+		// Terminates all workers, they are started again with the next call. Needed when an adaptation is reloaded
+		void restartWorkers();
+
+		// Worker side: call this first thing in the application. Returns true if this process has been launched as a worker,
+		// it must then not create any UI and just keep running until the Orm closes the connection
+		static bool startWorkerIfRequested(String const &commandLine);
+		static bool isWorkerProcess();
+		static void shutdownWorker();
+
+	private:
+		class Worker;
+		class WorkerProcess;
+
+		AdaptationWorkerPool();
+
+		bool send(std::string const &moduleName, MemoryBlock const &request, MemoryBlock &outReply);
+		std::unique_ptr<Worker> acquireWorker(std::string const &moduleName, size_t &outSlot);
+		void releaseWorker(size_t slot, std::unique_ptr<Worker> worker, bool alive);
+
+		static std::unique_ptr<AdaptationWorkerPool> sInstance_;
+		static std::unique_ptr<WorkerProcess> sWorkerProcess_;
+
+		std::atomic<bool> enabled_{ false };
+		std::atomic<bool> launchFailed_{ false };
+		int numberOfWorkers_;
+		std::mutex mutex_;
+		std::condition_variable available_;
+		// One slot per worker, empty while the worker is busy or not started yet
+		std::vector<std::unique_ptr<Worker>> workers_;
+		std::vector<char> busy_;
+		// Python module name to its worker slot
+		std::map<std::string, size_t> assigned_;
+		int generation_ = 0;
+	};
+
+}
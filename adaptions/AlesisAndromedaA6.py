@@ -5,6 +5,9 @@
 #
 import hashlib
 
+# The A6 uses the rolling shift technique to store 8 bits in 7 bit bytes
+from sequential.BitStreamCodec import unpack, unpack_range, pack_range, unescapeSysex, escapeSysex
+
 
 def name():
     return "Alesis Andromeda A6"
@@ -89,12 +92,13 @@ def convertToProgramDump(channel, message, program_number):
 
 
 def nameFromDump(message):
+    # The name is stored at position 2 of the data block, only decode the first few bytes to get it
     if isSingleProgramDump(message):
-        data_block = unescapeSysex(message[8:-1])  # The data block starts at index 8, and does not include the 0xf7
-        return ''.join([chr(x) for x in data_block[2:2 + 16]])
+        name = unpack_range(message, 2, 16, 8, len(message) - 1)  # The data block starts at index 8, and does not include the 0xf7
+        return ''.join([chr(x) for x in name])
     if isEditBufferDump(message):
-        data_block = unescapeSysex(message[7:-1])
-        return ''.join([chr(x) for x in data_block[2:2 + 16]])
+        name = unpack_range(message, 2, 16, 7, len(message) - 1)
+        return ''.join([chr(x) for x in name])
     raise Exception("Can only extract name from master keyboard program dump")
 
 
@@ -110,16 +114,11 @@ def numberFromDump(message):
 
 def renamePatch(message, new_name):
     if isSingleProgramDump(message) or isEditBufferDump(message):
-        data_block = unescapeSysex(getDataBlock(message))
-        for i in range(16):
-            if i < len(new_name):
-                data_block[2 + i] = ord(new_name[i])
-            else:
-                data_block[2 + i] = ord(" ")
-        if isSingleProgramDump(message):
-            return message[:8] + escapeSysex(data_block) + [0xf7]
-        elif isEditBufferDump(message):
-            return message[:7] + escapeSysex(data_block) + [0xf7]
+        name = bytes(ord(new_name[i]) if i < len(new_name) else ord(" ") for i in range(16))
+        # The data block starts at index 8 for programs and 7 for edit buffers. Re-encode only the groups containing the
+        # name, the rest of the message is copied as is. The other functions of this adaptation work on lists
+        header_len = 8 if isSingleProgramDump(message) else 7
+        return list(pack_range(message, 2, name, header_len, rindex(message, 0xf7)))
     raise Exception("Can only rename single program dumps!")
 
 
@@ -141,6 +140,19 @@ def isBankDumpFinished(messages):
     return count == numberOfPatchesPerBank()
 
 
+# The incremental version of isBankDumpFinished, the Orm feeds each message only once instead of
+# handing in the growing list of all messages received so far. When the bank requested is known,
+# only the program dumps of that bank are counted
+def beginBankDump(bank):
+    return {"bank": bank, "count": 0}
+
+
+def feedBankDumpMessage(state, message):
+    if isPartOfBankDump(message) and (state["bank"] == -1 or message[6] == state["bank"]):
+        state["count"] += 1
+    return state["count"] == numberOfPatchesPerBank()
+
+
 def extractPatchesFromBank(message):
     if isSingleProgramDump(message):
         return message
@@ -149,10 +161,10 @@ def extractPatchesFromBank(message):
 
 def calculateFingerprint(message):
     if isSingleProgramDump(message) or isEditBufferDump(message):
-        data_block = unescapeSysex(getDataBlock(message))
+        data_block = bytearray(unpack(getDataBlock(message)))
         # Blank out name
-        data_block[2:2 + 16] = [0] * 16
-        return hashlib.md5(bytearray(data_block)).hexdigest()  # Calculate the fingerprint from the cleaned payload data
+        data_block[2:2 + 16] = bytes(16)
+        return hashlib.md5(data_block).hexdigest()  # Calculate the fingerprint from the cleaned payload data
     # Don't know why we should come here, but to be safe, just hash all bytes
     return hashlib.md5(bytearray(message)).hexdigest()
 
@@ -177,44 +189,6 @@ def friendlyProgramName(patchNo):
     return friendlyBankName(bank) + " %03d" % program
 
 
-def unescapeSysex(data):
-    # The A6 uses the shift technique to store 8 bits in 7 bit bytes. This is some particularly ugly code I could only
-    # get to work with the help of the tests
-    result = []
-    roll_over = 0
-    i = 0
-    while i < len(data) - 1:
-        mask1 = (0xFF << roll_over) & 0x7F
-        mask2 = 0xFF >> (7 - roll_over)
-        result.append((data[i] & mask1) >> roll_over | (data[i + 1] & mask2) << (7 - roll_over))
-        roll_over = (roll_over + 1) % 7
-        i = i + 1
-        if roll_over == 0:
-            i = i + 1
-    return result
-
-
-def escapeSysex(data):
-    result = []
-    roll_over = 7
-    previous = 0
-    i = 0
-    while i < len(data):
-        mask1 = 0xFF >> (8 - roll_over)
-        mask2 = 0xFF >> roll_over << roll_over
-        if mask1 > 0:
-            result.append(((data[i] & mask1) << (7 - roll_over)) | previous)
-            previous = (data[i] & mask2) >> roll_over
-            roll_over = roll_over - 1
-            i = i + 1
-        else:
-            result.append(previous)
-            previous = 0
-            roll_over = 7
-    result.append(previous)
-    return result
-
-
 def rindex(mylist, myvalue):
     return len(mylist) - mylist[::-1].index(myvalue) - 1
 
@@ -308,5 +282,16 @@ def all_kinds_of_tests():
     assert real_program_dump[-1] == 0xf7  # No program change message at the end
 
 
+    state = beginBankDump(0)
+    unknown_bank = beginBankDump(-1)
+    for i in range(numberOfPatchesPerBank()):
+        assert not isBankDumpFinished([second] * i)
+        assert not feedBankDumpMessage(state, [0xf0, 0xf7])
+        assert not feedBankDumpMessage(state, convertToProgramDump(0, second, numberOfPatchesPerBank() + i))
+        assert feedBankDumpMessage(state, convertToProgramDump(0, second, i)) == (i == numberOfPatchesPerBank() - 1)
+        assert feedBankDumpMessage(unknown_bank, second) == (i == numberOfPatchesPerBank() - 1)
+    assert isBankDumpFinished([second] * numberOfPatchesPerBank())
+
+
 if __name__ == "__main__":
     all_kinds_of_tests()
@@ -4,6 +4,9 @@
 #   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
 #
 
+# The packing algorithm defined on page 141 of the Deepmind user manual is the same as DSI uses
+from sequential.MSBitCodec import unescapeSysex
+
 
 behringer_id = [0x00, 0x20, 0x32]
 
@@ -104,17 +107,3 @@ def convertToProgramDump(channel, message, program_number):
         # Need to construct a new program dump from a single program dump. Keep the protocol version intact
         return message[0:5] + [channel, 0x04, message[7], bank, program] + message[10:]
     raise Exception("Neither edit buffer nor program dump can't be converted")
-
-
-def unescapeSysex(sysex):
-    # This implements the algorithm defined on page 141 of the Deepmind user manual. I think it is the same as DSI uses
-    result = []
-    dataIndex = 0
-    while dataIndex < len(sysex):
-        msbits = sysex[dataIndex]
-        dataIndex += 1
-        for i in range(7):
-            if dataIndex < len(sysex):
-                result.append(sysex[dataIndex] | ((msbits & (1 << i)) << (7 - i)))
-            dataIndex += 1
-    return result
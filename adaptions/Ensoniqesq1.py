@@ -121,16 +121,16 @@ def extractPatchesFromBank(message):
     # Why is 'patch' mixed up with 'program' here?
     if isPartOfBankDump(message):
         channel = message[2]
-        data = message[5:-1]
+        data = bytes(message[5:-1])
+        header = bytes([0xf0, 0x0f, 0x02, channel, 0x01])
         # After removing the sysex header and footer we are left with 40 programs of 204 bytes each
         data_pointer = 0
         result = []
         while data_pointer + 203 < len(data):
             # Read one more patch
-            next_patch = data[data_pointer:data_pointer + 204]
-            next_program_dump = [0xf0, 0x0f, 0x02, channel, 0x01] + next_patch + [0xf7]
+            next_program_dump = header + data[data_pointer:data_pointer + 204] + b'\xf7'
             print("Found patch " + nameFromDump(next_program_dump))
-            result += next_program_dump
+            result.append(next_program_dump)
             data_pointer += 204
         return result
 
@@ -56,7 +56,16 @@ namespace knobkraft {
 		*kCalculateFingerprint = "calculateFingerprint",
 		*kFriendlyBankName = "friendlyBankName",
 		*kFriendlyProgramName = "friendlyProgramName",
-		*kSetupHelp = "setupHelp";
+		*kSetupHelp = "setupHelp",
+		*kNameFromDumps = "nameFromDumps",
+		*kCalculateFingerprints = "calculateFingerprints",
+		*kBeginBankDump = "beginBankDump",
+		*kFeedBankDumpMessage = "feedBankDumpMessage",
+		*kEndBankDump = "endBankDump",
+		*kExtractCompletedPatches = "extractCompletedPatches",
+		*kConvertToBankDump = "convertToBankDump",
+		*kKnobKraftApi = "KNOBKRAFT_API",
+		*kKnobKraftWorkerSafe = "KNOBKRAFT_WORKER_SAFE";
 
 	std::vector<const char *> kAdapatationPythonFunctionNames = {
 		kName,
@@ -85,6 +94,13 @@ namespace knobkraft {
 		kFriendlyBankName,
 		kFriendlyProgramName,
 		kSetupHelp,
+		kNameFromDumps,
+		kCalculateFingerprints,
+		kBeginBankDump,
+		kFeedBankDumpMessage,
+		kEndBankDump,
+		kExtractCompletedPatches,
+		kConvertToBankDump,
 	};
 
 	std::vector<const char *> kMinimalRequiredFunctionNames = {
@@ -96,6 +112,7 @@ namespace knobkraft {
 	};
 
 	const char *kUserAdaptationsFolderSettingsKey = "user_adaptations_folder";
+	const size_t kMaxPreparedResults = 10000;
 
 	std::unique_ptr<py::scoped_interpreter> sGenericAdaptationPythonEmbeddedGuard;
 	std::unique_ptr<py::gil_scoped_release> sGenericAdaptationDontLockGIL;
@@ -130,6 +147,8 @@ namespace knobkraft {
 			}
 			adaptation_module = py::module::import(filepath_.c_str());
 			checkForPythonOutputAndLog();
+			readApiVersion();
+			resolveFunctions();
 			adaptationName_ = getName(); //TODO - shouldn't call a virtual method here!
 		}
 		catch (py::error_already_set &ex) {
@@ -149,7 +168,23 @@ namespace knobkraft {
 		editBufferCapabilityImpl_ = std::make_shared<GenericEditBufferCapability>(this);
 		programDumpCapabilityImpl_ = std::make_shared<GenericProgramDumpCapability>(this);
 		bankDumpCapabilityImpl_ = std::make_shared<GenericBankDumpCapability>(this);
-		adaptation_module = adaptationModule;		
+		adaptation_module = adaptationModule;
+		readApiVersion();
+		resolveFunctions();
+	}
+
+	GenericAdaptation::~GenericAdaptation()
+	{
+		if (Py_IsInitialized()) {
+			py::gil_scoped_acquire acquire;
+			functions_.clear();
+		}
+		else {
+			// Too late to decrement the reference counts, the interpreter is gone
+			for (auto &function : functions_) {
+				function.release();
+			}
+		}
 	}
 
 	std::shared_ptr<GenericAdaptation> GenericAdaptation::fromBinaryCode(std::string moduleName, std::string adaptationCode)
@@ -204,6 +239,103 @@ namespace knobkraft {
 		}
 	}
 
+	void GenericAdaptation::readApiVersion()
+	{
+		// Needs the GIL. Adaptations not defining KNOBKRAFT_API get the classic lists of ints
+		apiVersion_ = 1;
+		try {
+			if (adaptation_module && py::hasattr(adaptation_module, kKnobKraftApi)) {
+				apiVersion_ = adaptation_module.attr(kKnobKraftApi).cast<int>();
+			}
+		}
+		catch (py::error_already_set &ex) {
+			logAdaptationError(kKnobKraftApi, ex);
+			ex.restore();
+		}
+		catch (std::exception &ex) {
+			logAdaptationError(kKnobKraftApi, ex);
+		}
+	}
+
+	void GenericAdaptation::resolveFunctions()
+	{
+		// Needs the GIL. Looking up all functions once means calls don't need to search the module by name, and the
+		// capability queries the UI does all the time are answered from the bit masks without touching Python
+		jassert(kAdapatationPythonFunctionNames.size() <= 64);
+		std::vector<py::object> functions;
+		uint64_t present = 0;
+		for (size_t i = 0; i < kAdapatationPythonFunctionNames.size(); i++) {
+			auto functionName = kAdapatationPythonFunctionNames[i];
+			if (adaptation_module && py::hasattr(adaptation_module, functionName)) {
+				functions.push_back(adaptation_module.attr(functionName));
+				present |= uint64_t(1) << i;
+			}
+			else {
+				functions.push_back(py::none());
+			}
+		}
+		functions_ = std::move(functions);
+		functionsPresent_ = present;
+
+		auto hasAll = [present](uint64_t bits) { return (present & bits) == bits; };
+		uint32_t capabilities = 0;
+		if (hasAll(functionBits({ kIsEditBufferDump, kCreateEditBufferRequest, kConvertToEditBuffer }))) {
+			capabilities |= kEditBufferCapability;
+		}
+		if (hasAll(functionBits({ kIsSingleProgramDump, kCreateProgramDumpRequest, kConvertToProgramDump }))) {
+			capabilities |= kProgramDumpCapability;
+		}
+		bool bankDumpSession = hasAll(functionBits({ kBeginBankDump, kFeedBankDumpMessage }));
+		if (hasAll(functionBits({ kCreateBankDumpRequest, kIsPartOfBankDump }))
+			&& (hasAll(functionBits({ kExtractPatchesFromBank })) || (bankDumpSession && hasAll(functionBits({ kExtractCompletedPatches }))))
+			&& (hasAll(functionBits({ kIsBankDumpFinished })) || bankDumpSession)) {
+			capabilities |= kBankDumpCapability;
+		}
+		if (hasAll(functionBits({ kConvertToBankDump }))) {
+			capabilities |= kBankUploadCapability;
+		}
+		capabilities_ = capabilities;
+
+		// The workers only see the arguments of a call, so running an adaptation there must be asked for by the module
+		bool workerSafe = false;
+		try {
+			if (adaptation_module && py::hasattr(adaptation_module, kKnobKraftWorkerSafe)) {
+				workerSafe = adaptation_module.attr(kKnobKraftWorkerSafe).cast<bool>();
+			}
+		}
+		catch (py::error_already_set &ex) {
+			logAdaptationError(kKnobKraftWorkerSafe, ex);
+			ex.restore();
+		}
+		catch (std::exception &ex) {
+			logAdaptationError(kKnobKraftWorkerSafe, ex);
+		}
+		workerSafe_ = workerSafe;
+	}
+
+	int GenericAdaptation::functionIndex(std::string const &functionName)
+	{
+		for (size_t i = 0; i < kAdapatationPythonFunctionNames.size(); i++) {
+			if (functionName == kAdapatationPythonFunctionNames[i]) {
+				return (int)i;
+			}
+		}
+		return -1;
+	}
+
+	uint64_t GenericAdaptation::functionBits(std::initializer_list<const char *> functionNames)
+	{
+		uint64_t bits = 0;
+		for (auto functionName : functionNames) {
+			int index = functionIndex(functionName);
+			jassert(index >= 0);
+			if (index >= 0) {
+				bits |= uint64_t(1) << index;
+			}
+		}
+		return bits;
+	}
+
 	void GenericAdaptation::startupGenericAdaptation()
 	{
 		if (juce::SystemStats::getEnvironmentVariable("ORM_NO_PYTHON", "NOTSET") != "NOTSET") {
@@ -346,6 +478,11 @@ namespace knobkraft {
 	}
 
 	bool GenericAdaptation::pythonModuleHasFunction(std::string const &functionName) const {
+		int index = functionIndex(functionName);
+		if (index >= 0) {
+			return (functionsPresent_ & (uint64_t(1) << index)) != 0;
+		}
+		// Not one of the functions the Orm knows about, ask Python
 		py::gil_scoped_acquire acquire;
 		if (!adaptation_module) {
 			return false;
@@ -353,6 +490,28 @@ namespace knobkraft {
 		return py::hasattr(*adaptation_module, functionName.c_str());
 	}
 
+	py::object GenericAdaptation::pythonFunction(std::string const &functionName) const
+	{
+		int index = functionIndex(functionName);
+		if (index >= 0 && index < (int)functions_.size()) {
+			return functions_[index];
+		}
+		if (adaptation_module && py::hasattr(*adaptation_module, functionName.c_str())) {
+			return adaptation_module.attr(functionName.c_str());
+		}
+		return py::none();
+	}
+
+	std::string const &GenericAdaptation::adaptationName() const
+	{
+		return adaptationName_;
+	}
+
+	std::string GenericAdaptation::pythonModuleName() const
+	{
+		return adaptation_module.attr("__name__").cast<std::string>();
+	}
+
 	bool GenericAdaptation::isFromFile() const
 	{
 		return !filepath_.empty();
@@ -367,9 +526,15 @@ namespace knobkraft {
 	void GenericAdaptation::reloadPython()
 	{
 		py::gil_scoped_acquire acquire;
+		// Names and fingerprints prepared by the old code must not be handed out anymore
+		forgetPreparedResults();
 		try {
 			adaptation_module.reload();
+			readApiVersion();
+			resolveFunctions();
 			logNamespace();
+			// The workers still have the old code loaded
+			AdaptationWorkerPool::instance()->restartWorkers();
 		}
 		catch (py::error_already_set &ex) {
 			logAdaptationError(kNumberOfBanks, ex);
@@ -382,7 +547,7 @@ namespace knobkraft {
 
 	int GenericAdaptation::numberOfBanks() const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
 			py::object result = callMethod(kNumberOfBanks);
 			return result.cast<int>();
@@ -399,7 +564,7 @@ namespace knobkraft {
 
 	int GenericAdaptation::numberOfPatches() const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
 			py::object result = callMethod(kNumberOfPatchesPerBank);
 			return result.cast<int>();
@@ -416,7 +581,7 @@ namespace knobkraft {
 
 	std::string GenericAdaptation::friendlyBankName(MidiBankNumber bankNo) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		if (!pythonModuleHasFunction(kFriendlyBankName)) {
 			return (boost::format("Bank %d") % bankNo.toOneBased()).str();
 		}
@@ -454,7 +619,7 @@ namespace knobkraft {
 
 	void GenericAdaptation::sendBlockOfMessagesToSynth(std::string const& midiOutput, std::vector<MidiMessage> const& buffer)
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		if (pythonModuleHasFunction(kGeneralMessageDelay)) {
 			try {
 				auto result = callMethod(kGeneralMessageDelay);
@@ -478,7 +643,7 @@ namespace knobkraft {
 
 	std::string GenericAdaptation::friendlyProgramName(MidiProgramNumber programNo) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		if (pythonModuleHasFunction(kFriendlyProgramName)) {
 			try {
 				int zerobased = programNo.toZeroBased();
@@ -498,7 +663,7 @@ namespace knobkraft {
 
 	std::string GenericAdaptation::setupHelpText() const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		if (!pythonModuleHasFunction("setupHelp")) {
 			return Synth::setupHelpText();
 		}
@@ -519,11 +684,10 @@ namespace knobkraft {
 
 	std::vector<juce::MidiMessage> GenericAdaptation::deviceDetect(int channel)
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
 			py::object result = callMethod(kCreateDeviceDetectMessage, channel);
-			std::vector<uint8> byteData = intVectorToByteVector(result.cast<std::vector<int>>());
-			return Sysex::vectorToMessages(byteData);
+			return Sysex::vectorToMessages(pythonToByteVector(result));
 		}
 		catch (py::error_already_set &ex) {
 			logAdaptationError(kCreateDeviceDetectMessage, ex);
@@ -538,7 +702,7 @@ namespace knobkraft {
 
 	int GenericAdaptation::deviceDetectSleepMS()
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		if (!pythonModuleHasFunction(kDeviceDetectWaitMilliseconds)) {
 			return 200;
 		}
@@ -560,10 +724,10 @@ namespace knobkraft {
 
 	MidiChannel GenericAdaptation::channelIfValidDeviceResponse(const MidiMessage &message)
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
-			auto vector = messageToVector(message);
-			py::object result = callMethod(kChannelIfValidDeviceResponse, vector);
+			auto data = messageToPython(message);
+			py::object result = callMethod(kChannelIfValidDeviceResponse, data);
 			int intResult = result.cast<int>();
 			if (intResult >= 0 && intResult < 16) {
 				return MidiChannel::fromZeroBase(intResult);
@@ -584,7 +748,7 @@ namespace knobkraft {
 
 	bool GenericAdaptation::needsChannelSpecificDetection()
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		if (!pythonModuleHasFunction(kNeedsChannelSpecificDetection)) {
 			return true;
 		}
@@ -605,7 +769,7 @@ namespace knobkraft {
 
 	std::string GenericAdaptation::getName() const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
 			py::object result = callMethod(kName);
 			return result.cast<std::string>();
@@ -622,14 +786,21 @@ namespace knobkraft {
 
 	std::string GenericAdaptation::calculateFingerprint(std::shared_ptr<midikraft::DataFile> patch) const
 	{
-		py::gil_scoped_acquire acquire;
+		{
+			std::lock_guard<std::mutex> lock(preparedMutex_);
+			auto prepared = preparedFingerprints_.find(patch->data());
+			if (prepared != preparedFingerprints_.end()) {
+				return prepared->second;
+			}
+		}
+		ProfiledGilAcquire acquire;
 		// This is an optional function to allow ignoring bytes that do not define the identity of the patch
 		if (!pythonModuleHasFunction(kCalculateFingerprint)) {
 			return Synth::calculateFingerprint(patch);
 		}
 		
 		try {
-			std::vector<int> data(patch->data().data(), patch->data().data() + patch->data().size());
+			auto data = dataToPython(patch->data());
 			py::object result = callMethod(kCalculateFingerprint, data);
 				return result.cast<std::string>();
 			}			
@@ -643,6 +814,238 @@ namespace knobkraft {
 		return {};
 	}
 
+	std::vector<std::string> GenericAdaptation::nameFromDumps(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const
+	{
+		ProfiledGilAcquire acquire;
+		std::vector<std::string> inWorkers;
+		// The batch function is optional, if it is not there or fails we ask for each patch individually
+		if (pythonModuleHasFunction(kNameFromDumps)) {
+			if (callForPatchesInWorkers(kNameFromDumps, true, patches, "invalid", inWorkers)) {
+				return inWorkers;
+			}
+			try {
+				auto data = patchesToPython(patches);
+				py::object result = callMethod(kNameFromDumps, data);
+				auto names = result.cast<std::vector<std::string>>();
+				if (names.size() == patches.size()) {
+					return names;
+				}
+				SimpleLogger::instance()->postMessage((boost::format("Adaptation: %s returned wrong number of results, falling back to single calls") % kNameFromDumps).str());
+			}
+			catch (py::error_already_set &ex) {
+				logAdaptationError(kNameFromDumps, ex);
+				ex.restore();
+			}
+			catch (std::exception &ex) {
+				logAdaptationError(kNameFromDumps, ex);
+			}
+		}
+		if (pythonModuleHasFunction(kNameFromDump) && callForPatchesInWorkers(kNameFromDump, false, patches, "invalid", inWorkers)) {
+			return inWorkers;
+		}
+		std::vector<std::string> result;
+		for (auto const &patch : patches) {
+			result.push_back(patch->name());
+		}
+		return result;
+	}
+
+	std::vector<std::string> GenericAdaptation::calculateFingerprints(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const
+	{
+		ProfiledGilAcquire acquire;
+		std::vector<std::string> inWorkers;
+		if (pythonModuleHasFunction(kCalculateFingerprints)) {
+			if (callForPatchesInWorkers(kCalculateFingerprints, true, patches, "", inWorkers)) {
+				return inWorkers;
+			}
+			try {
+				auto data = patchesToPython(patches);
+				py::object result = callMethod(kCalculateFingerprints, data);
+				auto fingerprints = result.cast<std::vector<std::string>>();
+				if (fingerprints.size() == patches.size()) {
+					return fingerprints;
+				}
+				SimpleLogger::instance()->postMessage((boost::format("Adaptation: %s returned wrong number of results, falling back to single calls") % kCalculateFingerprints).str());
+			}
+			catch (py::error_already_set &ex) {
+				logAdaptationError(kCalculateFingerprints, ex);
+				ex.restore();
+			}
+			catch (std::exception &ex) {
+				logAdaptationError(kCalculateFingerprints, ex);
+			}
+		}
+		if (pythonModuleHasFunction(kCalculateFingerprint) && callForPatchesInWorkers(kCalculateFingerprint, false, patches, "", inWorkers)) {
+			return inWorkers;
+		}
+		std::vector<std::string> result;
+		for (auto const &patch : patches) {
+			result.push_back(calculateFingerprint(patch));
+		}
+		return result;
+	}
+
+	bool GenericAdaptation::hasBatchCalls(const char *batchFunctionName, size_t numberOfPatches) const
+	{
+		// Else preparing would just do the single calls a bit earlier
+		return numberOfPatches > 1 && (pythonModuleHasFunction(batchFunctionName) || (isWorkerSafe() && AdaptationWorkerPool::instance()->isEnabled()));
+	}
+
+	void GenericAdaptation::storePrepared(std::map<std::vector<uint8>, std::string> &prepared, std::vector<std::shared_ptr<midikraft::DataFile>> const &patches,
+		std::vector<std::string> const &results, std::string const &errorResult) const
+	{
+		std::lock_guard<std::mutex> lock(preparedMutex_);
+		if (prepared.size() > kMaxPreparedResults) {
+			// Nobody called forgetPreparedResults(), don't let this grow forever
+			prepared.clear();
+		}
+		for (size_t i = 0; i < patches.size() && i < results.size(); i++) {
+			if (results[i] != errorResult) {
+				prepared[patches[i]->data()] = results[i];
+			}
+		}
+	}
+
+	void GenericAdaptation::prepareNames(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const
+	{
+		if (hasBatchCalls(kNameFromDumps, patches.size())) {
+			storePrepared(preparedNames_, patches, nameFromDumps(patches), "invalid");
+		}
+	}
+
+	void GenericAdaptation::prepareFingerprints(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const
+	{
+		if (hasBatchCalls(kCalculateFingerprints, patches.size())) {
+			storePrepared(preparedFingerprints_, patches, calculateFingerprints(patches), "");
+		}
+	}
+
+	void GenericAdaptation::forgetPreparedResults() const
+	{
+		std::lock_guard<std::mutex> lock(preparedMutex_);
+		preparedNames_.clear();
+		preparedFingerprints_.clear();
+	}
+
+	bool GenericAdaptation::preparedName(std::vector<uint8> const &data, std::string &outName) const
+	{
+		std::lock_guard<std::mutex> lock(preparedMutex_);
+		auto prepared = preparedNames_.find(data);
+		if (prepared != preparedNames_.end()) {
+			outName = prepared->second;
+			return true;
+		}
+		return false;
+	}
+
+	bool GenericAdaptation::callForPatchesInWorkers(const char *functionName, bool batch, std::vector<std::shared_ptr<midikraft::DataFile>> const &patches,
+		std::string const &errorResult, std::vector<std::string> &outResults) const
+	{
+		auto pool = AdaptationWorkerPool::instance();
+		if (!isWorkerSafe() || !pool->isEnabled() || patches.size() < 2) {
+			return false;
+		}
+		ProfiledCall profile(adaptationName_, functionName);
+		try {
+			std::vector<py::tuple> arguments;
+			if (batch) {
+				arguments.push_back(py::make_tuple(patchesToPython(patches)));
+			}
+			else {
+				for (auto const &patch : patches) {
+					arguments.push_back(py::make_tuple(dataToPython(patch->data())));
+				}
+			}
+			std::vector<std::string> results;
+			for (auto const &result : pool->callAll(this, functionName, arguments)) {
+				if (!result.ok) {
+					SimpleLogger::instance()->postMessage((boost::format("Error calling %s: %s") % functionName % result.error).str());
+					if (batch) {
+						return false;
+					}
+					results.push_back(errorResult);
+				}
+				else if (batch) {
+					auto values = result.value.cast<std::vector<std::string>>();
+					results.insert(results.end(), values.begin(), values.end());
+				}
+				else {
+					results.push_back(result.value.cast<std::string>());
+				}
+			}
+			if (results.size() == patches.size()) {
+				outResults = results;
+				return true;
+			}
+		}
+		catch (AdaptationWorkerPool::WorkerUnavailable &) {
+			// Then it is done here
+		}
+		catch (py::error_already_set &ex) {
+			logAdaptationError(functionName, ex);
+			ex.restore();
+		}
+		catch (std::exception &ex) {
+			logAdaptationError(functionName, ex);
+		}
+		return false;
+	}
+
+	bool GenericAdaptation::hasBankUpload() const
+	{
+		return (capabilities_ & kBankUploadCapability) != 0;
+	}
+
+	std::vector<MidiMessage> GenericAdaptation::bankDumpFromPatches(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const
+	{
+		ProfiledGilAcquire acquire;
+		try {
+			int c = channel().toZeroBasedInt();
+			auto data = patchesToPython(patches);
+			py::object result = callMethod(kConvertToBankDump, c, data);
+			return Sysex::vectorToMessages(pythonToByteVector(result));
+		}
+		catch (py::error_already_set &ex) {
+			logAdaptationError(kConvertToBankDump, ex);
+			ex.restore();
+		}
+		catch (std::exception &ex) {
+			logAdaptationError(kConvertToBankDump, ex);
+		}
+		return {};
+	}
+
+	void GenericAdaptation::sendBankToSynth(std::string const &midiOutput, std::vector<std::shared_ptr<midikraft::DataFile>> const &patches)
+	{
+		auto messages = bankDumpFromPatches(patches);
+		if (!messages.empty()) {
+			sendBlockOfMessagesToSynth(midiOutput, messages);
+		}
+	}
+
+	std::vector<uint8> GenericAdaptation::pythonToByteVector(py::handle message)
+	{
+		// Messages can come as bytes or bytearray, which are copied directly, or as the classic list of ints
+		if (PyBytes_Check(message.ptr())) {
+			auto data = reinterpret_cast<uint8 const *>(PyBytes_AS_STRING(message.ptr()));
+			return std::vector<uint8>(data, data + PyBytes_GET_SIZE(message.ptr()));
+		}
+		if (PyByteArray_Check(message.ptr())) {
+			auto data = reinterpret_cast<uint8 const *>(PyByteArray_AS_STRING(message.ptr()));
+			return std::vector<uint8>(data, data + PyByteArray_GET_SIZE(message.ptr()));
+		}
+		return intVectorToByteVector(message.cast<std::vector<int>>());
+	}
+
+	std::vector<std::vector<int>> GenericAdaptation::patchesToVectors(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches)
+	{
+		std::vector<std::vector<int>> result;
+		for (auto const &patch : patches) {
+			result.emplace_back(patch->data().data(), patch->data().data() + patch->data().size());
+		}
+		return result;
+	}
+
 	std::vector<int> GenericAdaptation::messageToVector(MidiMessage const &message) {
 		return std::vector<int>(message.getRawData(), message.getRawData() + message.getRawDataSize());
 	}
@@ -666,12 +1069,53 @@ namespace knobkraft {
 		return MidiMessage(byteData.data(), (int)byteData.size());
 	}
 
+	int GenericAdaptation::apiVersion() const
+	{
+		return apiVersion_;
+	}
+
+	bool GenericAdaptation::isWorkerSafe() const
+	{
+		return workerSafe_;
+	}
+
+	py::object GenericAdaptation::messageToPython(MidiMessage const &message) const
+	{
+		if (apiVersion_ >= 2) {
+			return py::bytes(reinterpret_cast<const char *>(message.getRawData()), (size_t)message.getRawDataSize());
+		}
+		return py::cast(messageToVector(message));
+	}
+
+	py::object GenericAdaptation::dataToPython(std::vector<uint8> const &data) const
+	{
+		if (apiVersion_ >= 2) {
+			return py::bytes(reinterpret_cast<const char *>(data.data()), data.size());
+		}
+		return py::cast(std::vector<int>(data.begin(), data.end()));
+	}
+
+	py::object GenericAdaptation::messagesToPython(std::vector<MidiMessage> const &messages) const
+	{
+		py::list result;
+		for (auto const &message : messages) {
+			result.append(messageToPython(message));
+		}
+		return result;
+	}
+
+	py::object GenericAdaptation::patchesToPython(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const
+	{
+		py::list result;
+		for (auto const &patch : patches) {
+			result.append(dataToPython(patch->data()));
+		}
+		return result;
+	}
+
 	bool GenericAdaptation::hasCapability(midikraft::EditBufferCapability **outCapability) const
 	{
-		py::gil_scoped_acquire acquire;
-		if (pythonModuleHasFunction(kIsEditBufferDump)
-			&& pythonModuleHasFunction(kCreateEditBufferRequest)
-			&& pythonModuleHasFunction(kConvertToEditBuffer)) {
+		if (capabilities_ & kEditBufferCapability) {
 			*outCapability = dynamic_cast<midikraft::EditBufferCapability *>(editBufferCapabilityImpl_.get());
 			return true;
 		}
@@ -690,10 +1134,7 @@ namespace knobkraft {
 
 	bool GenericAdaptation::hasCapability(midikraft::ProgramDumpCabability  **outCapability) const
 	{
-		py::gil_scoped_acquire acquire;
-		if (pythonModuleHasFunction(kIsSingleProgramDump)
-			&& pythonModuleHasFunction(kCreateProgramDumpRequest)
-			&& pythonModuleHasFunction(kConvertToProgramDump)) {
+		if (capabilities_ & kProgramDumpCapability) {
 			*outCapability = dynamic_cast<midikraft::ProgramDumpCabability *>(programDumpCapabilityImpl_.get());
 			return true;
 		}
@@ -712,11 +1153,7 @@ namespace knobkraft {
 
 	bool GenericAdaptation::hasCapability(midikraft::BankDumpCapability  **outCapability) const
 	{
-		py::gil_scoped_acquire acquire;
-		if (pythonModuleHasFunction(kCreateBankDumpRequest)
-			&& pythonModuleHasFunction(kExtractPatchesFromBank)
-			&& pythonModuleHasFunction(kIsPartOfBankDump)
-			&& pythonModuleHasFunction(kIsBankDumpFinished)) {
+		if (capabilities_ & kBankDumpCapability) {
 			*outCapability = dynamic_cast<midikraft::BankDumpCapability *>(bankDumpCapabilityImpl_.get());
 			return true;
 		}
@@ -13,10 +13,16 @@
 #include "EditBufferCapability.h"
 #include "ProgramDumpCapability.h"
 #include "BankDumpCapability.h"
+#include "AdaptationProfiler.h"
+#include "AdaptationWorkerPool.h"
 
 #include <pybind11/embed.h>
 #include <boost/format.hpp>
 
+#include <atomic>
+#include <map>
+#include <mutex>
+
 namespace knobkraft {
 
 	//TODO Some forwards during refactoring
@@ -28,7 +34,10 @@ namespace knobkraft {
 	extern const char *kIsEditBufferDump, *kCreateEditBufferRequest, *kConvertToEditBuffer,
 		*kNameFromDump, *kRenamePatch, *kIsDefaultName,
 		*kIsSingleProgramDump, *kCreateProgramDumpRequest, *kConvertToProgramDump, *kNumberFromDump,
-		*kCreateBankDumpRequest, *kIsPartOfBankDump, *kIsBankDumpFinished, *kExtractPatchesFromBank;
+		*kCreateBankDumpRequest, *kIsPartOfBankDump, *kIsBankDumpFinished, *kExtractPatchesFromBank,
+		*kNameFromDumps, *kCalculateFingerprints,
+		*kBeginBankDump, *kFeedBankDumpMessage, *kEndBankDump, *kExtractCompletedPatches, *kConvertToBankDump,
+		*kKnobKraftApi, *kKnobKraftWorkerSafe;
 
 	extern std::vector<const char *> kAdapatationPythonFunctionNames;
 	extern std::vector<const char *> kMinimalRequiredFunctionNames;
@@ -43,6 +52,7 @@ namespace knobkraft {
 	public:
 		GenericAdaptation(std::string const &pythonModuleFilePath);
 		GenericAdaptation(pybind11::module adaptation_module);
+		virtual ~GenericAdaptation();
 		static std::shared_ptr<GenericAdaptation> fromBinaryCode(std::string moduleName, std::string adaptationCode);
 
 		// This needs to be implemented, and never changed, as the result is used as a primary key in the database to store the patches
@@ -51,6 +61,23 @@ namespace knobkraft {
 		// Allow the Adaptation to implement a different fingerprint logic
 		virtual std::string calculateFingerprint(std::shared_ptr<midikraft::DataFile> patch) const override;
 
+		// Batch versions for bulk operations like import. These use the optional Python functions
+		// nameFromDumps and calculateFingerprints if present, else fall back to one call per patch
+		std::vector<std::string> nameFromDumps(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const;
+		std::vector<std::string> calculateFingerprints(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const;
+		// The import asks for the name and fingerprint of each patch individually. Preparing them first with one batch call
+		// lets the single calls be answered from the results, until the import is done and calls forgetPreparedResults()
+		void prepareNames(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const;
+		void prepareFingerprints(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const;
+		void forgetPreparedResults() const;
+		bool preparedName(std::vector<uint8> const &data, std::string &outName) const;
+
+		// Bank upload, available if the adaptation implements convertToBankDump. This sends a whole list of patches
+		// as bank dump messages to the synth instead of one program dump per patch
+		bool hasBankUpload() const;
+		std::vector<MidiMessage> bankDumpFromPatches(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const;
+		void sendBankToSynth(std::string const &midiOutput, std::vector<std::shared_ptr<midikraft::DataFile>> const &patches);
+
 		// Implement hints for the UI of the Librarian
 		int numberOfBanks() const override;
 		int numberOfPatches() const override;
@@ -73,6 +100,12 @@ namespace knobkraft {
 
 		// Internal workings of the Generic Adaptation module
 		bool pythonModuleHasFunction(std::string const &functionName) const;
+		// The function of the adaptation module resolved at load time, or None if it is not implemented. Needs the GIL
+		pybind11::object pythonFunction(std::string const &functionName) const;
+		// The name as reported when loading the module, available without calling into Python
+		std::string const &adaptationName() const;
+		// The name of the Python module, which is also used to load the adaptation in a worker process. Needs the GIL
+		std::string pythonModuleName() const;
 		bool isFromFile() const;
 		std::string getSourceFilePath() const;
 		void reloadPython();
@@ -93,6 +126,18 @@ namespace knobkraft {
 		static std::vector<int> messageToVector(MidiMessage const &message);
 		static std::vector<uint8> intVectorToByteVector(std::vector<int> const &data);
 		static MidiMessage vectorToMessage(std::vector<int> const &data);
+		static std::vector<uint8> pythonToByteVector(pybind11::handle message);
+		static std::vector<std::vector<int>> patchesToVectors(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches);
+
+		// Calling convention of the adaptation. With KNOBKRAFT_API = 2 defined in the module, MIDI data is handed to Python
+		// as bytes instead of lists of ints. Results are accepted as bytes, bytearray or list of ints in any case
+		int apiVersion() const;
+		// Only adaptations defining KNOBKRAFT_WORKER_SAFE = True in the module have their pure functions called in the worker processes
+		bool isWorkerSafe() const;
+		pybind11::object messageToPython(MidiMessage const &message) const;
+		pybind11::object dataToPython(std::vector<uint8> const &data) const;
+		pybind11::object messagesToPython(std::vector<MidiMessage> const &messages) const;
+		pybind11::object patchesToPython(std::vector<std::shared_ptr<midikraft::DataFile>> const &patches) const;
 
 		// Implement runtime capabilities		
 		virtual bool hasCapability(std::shared_ptr<midikraft::EditBufferCapability> &outCapability) const override;
@@ -120,10 +165,29 @@ namespace knobkraft {
 			if (!adaptation_module) {
 				return pybind11::none();
 			}
-			pybind11::gil_scoped_acquire acquire;
-			if (pybind11::hasattr(*adaptation_module, methodName.c_str())) {
-				auto result = adaptation_module.attr(methodName.c_str())(args...);
-				checkForPythonOutputAndLog();
+			ProfiledCall profile(adaptationName_, methodName);
+			ProfiledGilAcquire acquire;
+			auto function = pythonFunction(methodName);
+			if (!function.is_none()) {
+				if (profile.isEnabled()) {
+					(void)std::initializer_list<int>{ (profile.addBytes(AdaptationProfiler::marshalledBytes(args)), 0)... };
+				}
+				pybind11::object result;
+				if (isWorkerSafe() && AdaptationWorkerPool::runsInWorker(methodName) && AdaptationWorkerPool::instance()->isEnabled()) {
+					try {
+						result = AdaptationWorkerPool::instance()->call(this, methodName, pybind11::make_tuple(args...));
+					}
+					catch (AdaptationWorkerPool::WorkerUnavailable &) {
+						// Do the call in our own interpreter then
+					}
+				}
+				if (!result) {
+					result = function(args...);
+					checkForPythonOutputAndLog();
+				}
+				if (profile.isEnabled()) {
+					profile.addBytes(AdaptationProfiler::marshalledBytes(result));
+				}
 				return result;
 			}
 			else {
@@ -134,11 +198,39 @@ namespace knobkraft {
 
 		// Helper function for adding the built-in adaptations
 		static bool createCompiledAdaptationModule(std::string const &pythonModuleName, std::string const &adaptationCode, std::vector<std::shared_ptr<midikraft::SimpleDiscoverableDevice>> &outAddToThis);
+		// Hands the patches to the worker process of this adaptation, calling a batch function once with all patches,
+		// a single patch function once per patch. Returns false if the worker can't do it. Needs the GIL
+		bool callForPatchesInWorkers(const char *functionName, bool batch, std::vector<std::shared_ptr<midikraft::DataFile>> const &patches,
+			std::string const &errorResult, std::vector<std::string> &outResults) const;
+		bool hasBatchCalls(const char *batchFunctionName, size_t numberOfPatches) const;
+		void storePrepared(std::map<std::vector<uint8>, std::string> &prepared, std::vector<std::shared_ptr<midikraft::DataFile>> const &patches,
+			std::vector<std::string> const &results, std::string const &errorResult) const;
 		void logNamespace();
+		void readApiVersion();
+		void resolveFunctions();
+		static int functionIndex(std::string const &functionName);
+		static uint64_t functionBits(std::initializer_list<const char *> functionNames);
+
+		enum AdaptationCapability : uint32_t {
+			kEditBufferCapability = 1 << 0,
+			kProgramDumpCapability = 1 << 1,
+			kBankDumpCapability = 1 << 2,
+			kBankUploadCapability = 1 << 3,
+		};
 
 		pybind11::module adaptation_module;
+		int apiVersion_ = 1;
+		// Indexed like kAdapatationPythonFunctionNames. The bit masks are read without the GIL
+		std::vector<pybind11::object> functions_;
+		std::atomic<uint64_t> functionsPresent_{ 0 };
+		std::atomic<uint32_t> capabilities_{ 0 };
+		std::atomic<bool> workerSafe_{ false };
 		std::string filepath_;
 		std::string adaptationName_;
+		// Results of the batch calls by patch data
+		mutable std::mutex preparedMutex_;
+		mutable std::map<std::vector<uint8>, std::string> preparedNames_;
+		mutable std::map<std::vector<uint8>, std::string> preparedFingerprints_;
 	};
 
 }
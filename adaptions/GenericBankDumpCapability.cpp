@@ -17,15 +17,35 @@ namespace py = pybind11;
 
 namespace knobkraft {
 
+	GenericBankDumpCapability::~GenericBankDumpCapability()
+	{
+		for (auto state : { &bankDumpState_, &extractionState_ }) {
+			if (*state) {
+				if (Py_IsInitialized()) {
+					py::gil_scoped_acquire acquire;
+					*state = py::object();
+				}
+				else {
+					// Too late to decrement the reference count, the interpreter is gone
+					state->release();
+				}
+			}
+		}
+	}
+
 	std::vector<juce::MidiMessage> GenericBankDumpCapability::requestBankDump(MidiBankNumber bankNo) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
 			int c = me_->channel().toZeroBasedInt();
 			int bank = bankNo.toZeroBased();
+			// A new request starts a new bank dump session
+			endBankDumpSession();
+			endExtractionSession();
+			bankDumpBank_ = bank;
+			extractionBank_ = bank;
 			py::object result = me_->callMethod(kCreateBankDumpRequest, c, bank);
-			std::vector<uint8> byteData = GenericAdaptation::intVectorToByteVector(result.cast<std::vector<int>>());
-			return Sysex::vectorToMessages(byteData);
+			return Sysex::vectorToMessages(GenericAdaptation::pythonToByteVector(result));
 		}
 		catch (py::error_already_set &ex) {
 			me_->logAdaptationError(kCreateBankDumpRequest, ex);
@@ -39,9 +59,9 @@ namespace knobkraft {
 
 	bool GenericBankDumpCapability::isBankDump(const MidiMessage& message) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
-			auto vector = me_->messageToVector(message);
+			auto vector = me_->messageToPython(message);
 			py::object result = me_->callMethod(kIsPartOfBankDump, vector);
 			return result.cast<bool>();
 		}
@@ -57,12 +77,46 @@ namespace knobkraft {
 
 	bool GenericBankDumpCapability::isBankDumpFinished(std::vector<MidiMessage> const &bankDump) const
 	{
-		py::gil_scoped_acquire acquire;
-		try {
-			std::vector<std::vector<int>> vector;
-			for (auto message : bankDump) {
-				vector.push_back(me_->messageToVector(message));
+		ProfiledGilAcquire acquire;
+		if (hasBankDumpSession()) {
+			if (bankDump.empty()) {
+				return false;
 			}
+			try {
+				if (!continuesBankDumpSession(bankDump)) {
+					// This is a different list of messages than the one we were fed, start over. The bank requested
+					// is only known for the first dump after requestBankDump(), e.g. for a manual dump it is -1
+					endBankDumpSession();
+					int bank = bankDumpBank_;
+					bankDumpBank_ = -1;
+					firstMessageFed_ = bankDump.front();
+					bankDumpState_ = me_->callMethod(kBeginBankDump, bank);
+				}
+				bool done = false;
+				while (!done && messagesFed_ < bankDump.size()) {
+					lastMessageFed_ = bankDump[messagesFed_++];
+					auto vector = me_->messageToPython(lastMessageFed_);
+					py::object result = me_->callMethod(kFeedBankDumpMessage, bankDumpState_, vector);
+					done = result.cast<bool>();
+				}
+				if (done) {
+					endBankDumpSession();
+				}
+				return done;
+			}
+			catch (py::error_already_set &ex) {
+				me_->logAdaptationError(kFeedBankDumpMessage, ex);
+				ex.restore();
+			}
+			catch (std::exception &ex) {
+				me_->logAdaptationError(kFeedBankDumpMessage, ex);
+			}
+			bankDumpState_ = py::object();
+			messagesFed_ = 0;
+			return false;
+		}
+		try {
+			auto vector = me_->messagesToPython(bankDump);
 			py::object result = me_->callMethod(kIsBankDumpFinished, vector);
 			return result.cast<bool>();
 		}
@@ -76,38 +130,143 @@ namespace knobkraft {
 		return false;
 	}
 
-	midikraft::TPatchVector GenericBankDumpCapability::patchesFromSysexBank(const MidiMessage& message) const
+	bool GenericBankDumpCapability::continuesBankDumpSession(std::vector<MidiMessage> const &bankDump) const
+	{
+		if (!bankDumpState_ || messagesFed_ == 0 || bankDump.size() < messagesFed_) {
+			return false;
+		}
+		// Same length or longer is not enough, a second dump of the same synth is just as long
+		auto same = [](MidiMessage const &a, MidiMessage const &b) {
+			return a.getRawDataSize() == b.getRawDataSize() && memcmp(a.getRawData(), b.getRawData(), (size_t) a.getRawDataSize()) == 0;
+		};
+		return same(bankDump.front(), firstMessageFed_) && same(bankDump[messagesFed_ - 1], lastMessageFed_);
+	}
+
+	bool GenericBankDumpCapability::hasBankDumpSession() const
+	{
+		return me_->pythonModuleHasFunction(kBeginBankDump) && me_->pythonModuleHasFunction(kFeedBankDumpMessage);
+	}
+
+	void GenericBankDumpCapability::endBankDumpSession() const
+	{
+		endSession(bankDumpState_);
+		messagesFed_ = 0;
+	}
+
+	void GenericBankDumpCapability::endSession(py::object &state) const
+	{
+		if (state && me_->pythonModuleHasFunction(kEndBankDump)) {
+			try {
+				me_->callMethod(kEndBankDump, state);
+			}
+			catch (py::error_already_set &ex) {
+				me_->logAdaptationError(kEndBankDump, ex);
+				ex.restore();
+			}
+			catch (std::exception &ex) {
+				me_->logAdaptationError(kEndBankDump, ex);
+			}
+		}
+		state = py::object();
+	}
+
+	bool GenericBankDumpCapability::hasExtractionSession() const
 	{
-		py::gil_scoped_acquire acquire;
+		return hasBankDumpSession() && me_->pythonModuleHasFunction(kExtractCompletedPatches);
+	}
+
+	midikraft::TPatchVector GenericBankDumpCapability::patchesFromExtractionSession(const MidiMessage& message) const
+	{
+		// The messages of a bank dump are handed in one by one and in order, each returns the patches it completed.
+		// The session ends with the last message of the dump, or with the next bank dump request
 		try {
-			std::vector<int> vector = me_->messageToVector(message);
-			py::object result = me_->callMethod(kExtractPatchesFromBank, vector);
-			midikraft::TPatchVector patchesFound;
-			std::vector<uint8> byteData = GenericAdaptation::intVectorToByteVector(result.cast<std::vector<int>>());
-			auto messages = Sysex::vectorToMessages(byteData);
-			int no = 0;
-			for (auto programDump : messages) {
-				std::vector<uint8> data(programDump.getRawData(), programDump.getRawData() + programDump.getRawDataSize());
-				auto patch = me_->patchFromPatchData(data, MidiProgramNumber::fromZeroBase(no++)); //TODO the no is ignored
-				if (patch) {
-					patchesFound.push_back(patch);
-				}
-				else {
-					SimpleLogger::instance()->postMessage((boost::format("Adaptation: Could not create patch from data returned from %s") % kExtractPatchesFromBank).str());
-				}
+			if (!extractionState_) {
+				int bank = extractionBank_;
+				extractionBank_ = -1;
+				extractionState_ = me_->callMethod(kBeginBankDump, bank);
 			}
-			return patchesFound;
+			auto vector = me_->messageToPython(message);
+			bool done = me_->callMethod(kFeedBankDumpMessage, extractionState_, vector).cast<bool>();
+			auto patches = patchesFromPython(me_->callMethod(kExtractCompletedPatches, extractionState_), kExtractCompletedPatches);
+			if (done) {
+				endExtractionSession();
+			}
+			return patches;
 		}
 		catch (py::error_already_set &ex) {
-			me_->logAdaptationError(kExtractPatchesFromBank, ex);
+			me_->logAdaptationError(kExtractCompletedPatches, ex);
 			ex.restore();
 		}
 		catch (std::exception &ex) {
-			me_->logAdaptationError(kExtractPatchesFromBank, ex);
+			me_->logAdaptationError(kExtractCompletedPatches, ex);
 		}
+		endExtractionSession();
 		return {};
 	}
 
+	void GenericBankDumpCapability::endExtractionSession() const
+	{
+		endSession(extractionState_);
+	}
+
+	midikraft::TPatchVector GenericBankDumpCapability::patchesFromSysexBank(const MidiMessage& message) const
+	{
+		ProfiledGilAcquire acquire;
+		midikraft::TPatchVector patchesFound;
+		if (hasExtractionSession()) {
+			patchesFound = patchesFromExtractionSession(message);
+		}
+		else {
+			try {
+				auto vector = me_->messageToPython(message);
+				patchesFound = patchesFromPython(me_->callMethod(kExtractPatchesFromBank, vector), kExtractPatchesFromBank);
+			}
+			catch (py::error_already_set &ex) {
+				me_->logAdaptationError(kExtractPatchesFromBank, ex);
+				ex.restore();
+			}
+			catch (std::exception &ex) {
+				me_->logAdaptationError(kExtractPatchesFromBank, ex);
+			}
+		}
+		// The librarian names the patches next, and the database fingerprints them when merging
+		me_->prepareNames(patchesFound);
+		me_->prepareFingerprints(patchesFound);
+		return patchesFound;
+	}
+
+	midikraft::TPatchVector GenericBankDumpCapability::patchesFromPython(py::object const &result, const char *functionName) const
+	{
+		midikraft::TPatchVector patchesFound;
+		auto addPatch = [this, &patchesFound, functionName](std::vector<uint8> const &data, int programNo) {
+			auto patch = me_->patchFromPatchData(data, MidiProgramNumber::fromZeroBase(programNo)); //TODO the no is ignored
+			if (patch) {
+				patchesFound.push_back(patch);
+			}
+			else {
+				SimpleLogger::instance()->postMessage((boost::format("Adaptation: Could not create patch from data returned from %s") % functionName).str());
+			}
+		};
+		int no = 0;
+		if (PyBytes_Check(result.ptr()) || PyByteArray_Check(result.ptr())
+			|| (py::isinstance<py::list>(result) && (py::len(result) == 0 || py::isinstance<py::int_>(result.cast<py::list>()[0])))) {
+			// Classic format, all messages concatenated into one list of ints or bytes object that needs to be split again
+			std::vector<uint8> byteData = GenericAdaptation::pythonToByteVector(result);
+			auto messages = Sysex::vectorToMessages(byteData);
+			for (auto programDump : messages) {
+				std::vector<uint8> data(programDump.getRawData(), programDump.getRawData() + programDump.getRawDataSize());
+				addPatch(data, no++);
+			}
+		}
+		else {
+			// A list or generator of individual messages, in the order of the bank
+			for (auto item : result) {
+				addPatch(GenericAdaptation::pythonToByteVector(item), no++);
+			}
+		}
+		return patchesFound;
+	}
+
 }
 
 
@@ -15,6 +15,7 @@ namespace knobkraft {
 	class GenericBankDumpCapability : public midikraft::BankDumpCapability {
 	public:
 		GenericBankDumpCapability(GenericAdaptation *me) : me_(me) {}
+		virtual ~GenericBankDumpCapability();
 
 		std::vector<MidiMessage> requestBankDump(MidiBankNumber bankNo) const override;
 		bool isBankDump(const MidiMessage& message) const override;
@@ -22,7 +23,30 @@ namespace knobkraft {
 		midikraft::TPatchVector patchesFromSysexBank(const MidiMessage& message) const override;
 
 	private:
+		bool hasBankDumpSession() const;
+		bool continuesBankDumpSession(std::vector<MidiMessage> const &bankDump) const;
+		void endBankDumpSession() const;
+		bool hasExtractionSession() const;
+		midikraft::TPatchVector patchesFromExtractionSession(const MidiMessage& message) const;
+		void endExtractionSession() const;
+		void endSession(pybind11::object &state) const;
+		midikraft::TPatchVector patchesFromPython(pybind11::object const &result, const char *functionName) const;
+
 		GenericAdaptation *me_;
+
+		// State of the optional incremental protocol beginBankDump/feedBankDumpMessage/endBankDump.
+		// Only the messages not yet fed are handed to Python on each isBankDumpFinished() call. The first and the last
+		// message fed tell if the next call continues the same dump
+		mutable pybind11::object bankDumpState_;
+		mutable size_t messagesFed_ = 0;
+		mutable MidiMessage firstMessageFed_;
+		mutable MidiMessage lastMessageFed_;
+		mutable int bankDumpBank_ = -1;
+
+		// A second session of the same protocol for adaptations that extract the patches with extractCompletedPatches(state)
+		// instead of message by message, because a patch can span several messages
+		mutable pybind11::object extractionState_;
+		mutable int extractionBank_ = -1;
 	};
 
 }
@@ -24,12 +24,13 @@ namespace knobkraft {
 
 	juce::MidiMessage GenericEditBufferCapability::requestEditBufferDump() const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
 			int c = me_->channel().toZeroBasedInt();
 			py::object result = me_->callMethod(kCreateEditBufferRequest, c);
 			// These should be only one midi message...
-			return { GenericAdaptation::vectorToMessage(result.cast<std::vector<int>>()) };
+			auto byteData = GenericAdaptation::pythonToByteVector(result);
+			return MidiMessage(byteData.data(), (int)byteData.size());
 		}
 		catch (py::error_already_set &ex) {
 			me_->logAdaptationError(kCreateEditBufferRequest, ex);
@@ -43,9 +44,9 @@ namespace knobkraft {
 
 	bool GenericEditBufferCapability::isEditBufferDump(const MidiMessage& message) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
-			auto vectorForm = me_->messageToVector(message);
+			auto vectorForm = me_->messageToPython(message);
 			py::object result = me_->callMethod(kIsEditBufferDump, vectorForm);
 			return result.cast<bool>();
 		}
@@ -69,13 +70,12 @@ namespace knobkraft {
 
 	std::vector<juce::MidiMessage> GenericEditBufferCapability::patchToSysex(std::shared_ptr<midikraft::DataFile> patch) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
-			auto data = patch->data();
+			auto data = me_->dataToPython(patch->data());
 			int c = me_->channel().toZeroBasedInt();
 			py::object result = me_->callMethod(kConvertToEditBuffer, c, data);
-			std::vector<uint8> byteData = GenericAdaptation::intVectorToByteVector(result.cast<std::vector<int>>());
-			return Sysex::vectorToMessages(byteData);
+			return Sysex::vectorToMessages(GenericAdaptation::pythonToByteVector(result));
 		}
 		catch (py::error_already_set &ex) {
 			me_->logAdaptationError(kConvertToEditBuffer, ex);
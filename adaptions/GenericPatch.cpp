@@ -23,19 +23,21 @@ namespace knobkraft {
 
 	bool GenericPatch::pythonModuleHasFunction(std::string const &functionName) const
 	{
-		py::gil_scoped_acquire acquire;
-		if (!adaptation_) {
-			return false;
-		}
-		return py::hasattr(*adaptation_, functionName.c_str());
+		return me_->pythonModuleHasFunction(functionName);
 	}
 
 	std::string GenericPatch::name() const
 	{
-		py::gil_scoped_acquire acquire;
+		std::string prepared;
+		if (me_->preparedName(data(), prepared)) {
+			return prepared;
+		}
+		ProfiledCall profile(me_->adaptationName(), kNameFromDump);
+		ProfiledGilAcquire acquire;
 		try {
-			std::vector<int> v(data().data(), data().data() + data().size());
-			auto result = adaptation_.attr(kNameFromDump)(v);
+			profile.addBytes(data().size());
+			auto v = me_->dataToPython(data());
+			auto result = me_->pythonFunction(kNameFromDump)(v);
 			checkForPythonOutputAndLog();
 			return result.cast<std::string>();
 		}
@@ -50,6 +52,11 @@ namespace knobkraft {
 		return "invalid";
 	}
 
+	pybind11::object GenericPatch::dataForPython() const
+	{
+		return me_->dataToPython(data());
+	}
+
 	void GenericPatch::logAdaptationError(const char *methodName, std::exception &ex) const
 	{
 		// This hoop is required to properly process Python created exceptions
@@ -63,18 +70,16 @@ namespace knobkraft {
 
 	void GenericStoredPatchNameCapability::setName(std::string const &name)
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		if (!me_.expired()) {
 			// set name is an optional method - if it is not implemented, the name in the patch is never changed, the name displayed in the Librarian is
 			if (!me_.lock()->pythonModuleHasFunction(kRenamePatch)) return;
 
 			// Very well, then try to change the name in the patch data
 			try {
-				std::vector<int> v(me_.lock()->data().data(), me_.lock()->data().data() + me_.lock()->data().size());
+				auto v = me_.lock()->dataForPython();
 				py::object result = me_.lock()->callMethod(kRenamePatch, v, name);
-				auto intVector = result.cast<std::vector<int>>();
-				std::vector<uint8> byteData = GenericAdaptation::intVectorToByteVector(intVector);
-				me_.lock()->setData(byteData);
+				me_.lock()->setData(GenericAdaptation::pythonToByteVector(result));
  			}
 			catch (py::error_already_set &ex) {
 				if (!me_.expired())
@@ -93,7 +98,7 @@ namespace knobkraft {
 
 	bool GenericDefaultNameCapability::isDefaultName(std::string const &patchName) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		if (!me_.expired()) {
 			auto patch = me_.lock();
 			try {
@@ -57,14 +57,22 @@ namespace knobkraft {
 
 		template <typename ... Args>
 		pybind11::object callMethod(std::string const &methodName, Args& ... args) const {
-			pybind11::gil_scoped_acquire acquire;
+			ProfiledCall profile(me_->adaptationName(), methodName);
+			ProfiledGilAcquire acquire;
 			if (!adaptation_) {
 				return pybind11::none();
 			}
-			if (pybind11::hasattr(*adaptation_, methodName.c_str())) {
+			auto function = me_->pythonFunction(methodName);
+			if (!function.is_none()) {
 				try {
-					auto result = adaptation_.attr(methodName.c_str())(args...);
+					if (profile.isEnabled()) {
+						(void)std::initializer_list<int>{ (profile.addBytes(AdaptationProfiler::marshalledBytes(args)), 0)... };
+					}
+					auto result = function(args...);
 					checkForPythonOutputAndLog();
+					if (profile.isEnabled()) {
+						profile.addBytes(AdaptationProfiler::marshalledBytes(result));
+					}
 					return result;
 				}
 				catch (pybind11::error_already_set &ex) {
@@ -88,6 +96,9 @@ namespace knobkraft {
 
 		std::string name() const override;
 
+		// The patch data in the calling convention of the adaptation
+		pybind11::object dataForPython() const;
+
 		// For error handling
 		void logAdaptationError(const char *methodName, std::exception &e) const;
 
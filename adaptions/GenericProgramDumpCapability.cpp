@@ -28,12 +28,11 @@ namespace knobkraft {
 
 	std::vector<juce::MidiMessage> GenericProgramDumpCapability::requestPatch(int patchNo) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
 			int c = me_->channel().toZeroBasedInt();
 			py::object result = me_->callMethod(kCreateProgramDumpRequest, c, patchNo);
-			std::vector<uint8> byteData = GenericAdaptation::intVectorToByteVector(result.cast<std::vector<int>>());
-			return Sysex::vectorToMessages(byteData);
+			return Sysex::vectorToMessages(GenericAdaptation::pythonToByteVector(result));
 		}
 		catch (py::error_already_set &ex) {
 			me_->logAdaptationError(kCreateProgramDumpRequest, ex);
@@ -47,9 +46,9 @@ namespace knobkraft {
 
 	bool GenericProgramDumpCapability::isSingleProgramDump(const MidiMessage& message) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try {
-			auto vector = me_->messageToVector(message);
+			auto vector = me_->messageToPython(message);
 			py::object result = me_->callMethod(kIsSingleProgramDump, vector);
 			return result.cast<bool>();
 		}
@@ -65,10 +64,10 @@ namespace knobkraft {
 
 	MidiProgramNumber GenericProgramDumpCapability::getProgramNumber(const MidiMessage &message) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		if (me_->pythonModuleHasFunction("numberFromDump")) {
 			try {
-				auto vector = me_->messageToVector(message);
+				auto vector = me_->messageToPython(message);
 				py::object result = me_->callMethod(kNumberFromDump, vector);
 				return MidiProgramNumber::fromZeroBase(result.cast<int>());
 			}
@@ -85,15 +84,14 @@ namespace knobkraft {
 
 	std::vector<juce::MidiMessage> GenericProgramDumpCapability::patchToProgramDumpSysex(std::shared_ptr<midikraft::DataFile> patch, MidiProgramNumber programNumber) const
 	{
-		py::gil_scoped_acquire acquire;
+		ProfiledGilAcquire acquire;
 		try
 		{
-			auto data = patch->data();
+			auto data = me_->dataToPython(patch->data());
 			int c = me_->channel().toZeroBasedInt();
 			int programNo = programNumber.toZeroBased();
 			py::object result = me_->callMethod(kConvertToProgramDump, c, data, programNo);
-			std::vector<uint8> byteData = GenericAdaptation::intVectorToByteVector(result.cast<std::vector<int>>());
-			return Sysex::vectorToMessages(byteData);
+			return Sysex::vectorToMessages(GenericAdaptation::pythonToByteVector(result));
 		}
 		catch (py::error_already_set &ex) {
 			me_->logAdaptationError(kConvertToProgramDump, ex);
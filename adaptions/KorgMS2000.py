@@ -15,6 +15,8 @@
 # 2. Midi Clock is Internal ; it must be set as external, for the same reason."
 # "be sure to enable System Exclusive on Global Mode"
 
+from sequential.MSBitCodec import unescapeSysex, escapeSysex, split_packed, unpacked_length
+
 
 def name():
     return "Korg MS2000"
@@ -154,51 +156,15 @@ def isBankDumpFinished(messages):
 def extractPatchesFromBank(message):
     if isPartOfBankDump(message):
         channel = message[2] & 0x0f
-        data = unescapeSysex(message[5:-1])
+        packed = bytes(message[5:-1])
+        header = bytes([0xf0, 0x42, 0x30 | (channel & 0x0f), 0x58, 0x40])
         # There are different files out there with different number of patches (64 or 128), plus the global data
-        data_pointer = 0
-        result = []
-        while data_pointer + 254 < len(data):
-            # Read one more patch
-            next_patch = data[data_pointer:data_pointer + 254]
-            next_program_dump = [0xf0, 0x42, 0x30 | (channel & 0x0f), 0x58, 0x40] + escapeSysex(next_patch) + [0xf7]
-            #print("Found patch " + nameFromDump(next_program_dump))
-            result = result + next_program_dump
-            data_pointer = data_pointer + 254
-        return result
+        # The global data follows the last patch
+        patches = split_packed(packed, 254, (unpacked_length(len(packed)) - 1) // 254)
+        return [header + patch + b'\xf7' for patch in patches]
     raise Exception("This code can only read a single message of type 'ALL DATA DUMP'")
 
 
-def unescapeSysex(sysex):
-    result = []
-    dataIndex = 0
-    while dataIndex < len(sysex):
-        # The first byte contains the highest (most significant = MS) bit of the next seven data bytes
-        ms_bits = sysex[dataIndex]
-        dataIndex += 1
-        for i in range(7):
-            if dataIndex < len(sysex):
-                result.append(sysex[dataIndex] | ((ms_bits & (1 << i)) << (7 - i)))
-            dataIndex += 1
-    return result
-
-
-def escapeSysex(data):
-    result = []
-    dataIndex = 0
-    while dataIndex < len(data):
-        ms_bits = 0
-        for i in range(7):
-            if dataIndex + i < len(data):
-                ms_bits = ms_bits | ((data[dataIndex + i] & 0x80) >> (7 - i))
-        result.append(ms_bits)
-        for i in range(7):
-            if dataIndex + i < len(data):
-                result.append(data[dataIndex + i] & 0x7f)
-        dataIndex += 7
-    return result
-
-
 ########################################################################################################################
 #
 # The following functions are not called by the KnobKraft Orm (yet), but I use them to convert ALL DATA DUMPS file from
@@ -4,6 +4,8 @@
 #   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
 #
 
+from sequential.NibbleCodec import unpack
+
 
 def name():
     return "Matrix 6/6R"
@@ -98,7 +100,7 @@ def convertToProgramDump(channel, message, program_number):
 
 
 def denibble(message, start_index):
-    denibbled_data_content = [message[x] | (message[x + 1] << 4) for x in range(start_index, len(message) - 2, 2)]
+    denibbled_data_content = unpack(message, start_index, len(message) - 2)
     expected_checksum = message[-2]
     checksum = sum(denibbled_data_content) & 0x7f
     if checksum != expected_checksum:
@@ -7,6 +7,8 @@
 # Note that for real life usage the native C++ implementation of the Matrix1000 is more powerful and should be used
 # This is an example adaption to show how a fully working adaption can look like
 
+from sequential.NibbleCodec import unpack, nibble
+
 
 def name():
     return "Matrix 1000 Adaptation"
@@ -83,7 +85,7 @@ def nameFromDump(message):
     if isSingleProgramDump(message) or isEditBufferDump(message):
         # To extract the name from the Matrix 1000 program dump, we
         # need to correctly de-nibble and then force the first 8 bytes into ASCII
-        patchData = denibble(message, 5, len(message) - 2)
+        patchData = unpack(message, 5, len(message) - 2)
         # The Matrix 6 stores only 6 bit of ASCII, folding the letters into the range 0 to 31
         return ''.join([chr(x if x >= 32 else x + 0x40) for x in patchData[0:8]])
     raise Exception("Neither edit buffer nor program dump")
@@ -123,24 +125,12 @@ def friendlyBankName(bank_number):
 
 def rebuildChecksum(message):
     if isSingleProgramDump(message) or isEditBufferDump(message):
-        data = denibble(message, 5, len(message) - 2)
+        data = unpack(message, 5, len(message) - 2)
         checksum = sum(data) & 0x7f
         return message[:-2] + [checksum, 0xf7]
     raise Exception("rebuildChecksum only implemented for single patch data yet")
 
 
-def denibble(message, start, stop):
-    return [message[x] | (message[x + 1] << 4) for x in range(start, stop, 2)]
-
-
-def nibble(message):
-    result = []
-    for b in message:
-        result.append(b & 0x0f)
-        result.append((b & 0xf0) >> 4)
-    return result
-
-
 import binascii
 
 
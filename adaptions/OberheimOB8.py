@@ -141,18 +141,6 @@ def getData(message):
     raise Exception("Non program dump given to getData, program error")
 
 
-def denibble(message, start, stop):
-    return [message[x] | (message[x + 1] << 4) for x in range(start, stop, 2)]
-
-
-def nibble(message):
-    result = []
-    for b in message:
-        result.append(b & 0x0f)
-        result.append((b & 0xf0) >> 4)
-    return result
-
-
 # End of implementation for KnobKraft. Tests follow
 
 def run_tests():
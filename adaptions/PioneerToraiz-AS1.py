@@ -4,6 +4,8 @@
 #   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
 #
 
+from sequential.MSBitCodec import unescapeSysex
+
 
 def name():
     return "Pioneer Toraiz AS-1"
@@ -127,16 +129,3 @@ def convertToProgramDump(channel, message, program_number):
     elif isSingleProgramDump(message):
         return message[0:10] + [bank, program] + message[12:]
     raise Exception("Neither edit buffer nor program dump - can't be converted")
-
-
-def unescapeSysex(sysex):
-    result = []
-    dataIndex = 0
-    while dataIndex < len(sysex):
-        msbits = sysex[dataIndex]
-        dataIndex += 1
-        for i in range(7):
-            if dataIndex < len(sysex):
-                result.append(sysex[dataIndex] | ((msbits & (1 << i)) << (7 - i)))
-            dataIndex += 1
-    return result
@@ -3,6 +3,8 @@
 #
 #   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
 #
+from sequential.PayloadCache import PayloadCache, message_digest
+from sequential.SysexStream import split_sysex
 
 # The Roland D-50 implements the Roland Exclusive Format Type IV, and thus is a good Roland example
 
@@ -16,6 +18,15 @@ character_set = [' '] + [chr(x) for x in range(ord('A'), ord('Z') + 1)] + \
                 [chr(x) for x in range(ord('a'), ord('z') + 1)] + \
                 [chr(x) for x in range(ord('1'), ord('9') + 1)] + ['0', '-']
 
+#
+# Layout of the patch memory as seen in a bank dump. The addresses are 7 bit per byte, converted into a continuous
+# index with address_to_index
+#
+patches_per_bank = 64
+blocks_per_patch = 7  # Upper partial 1 and 2, upper common, lower partial 1 and 2, lower common, patch
+block_size = 0x40
+patch_size = blocks_per_patch * block_size
+
 
 def name():
     return "Roland D-50"
@@ -37,36 +48,174 @@ def channelIfValidDeviceResponse(message):
 
 
 def nameFromDump(message):
-    patch_parts = splitSysex(message)
-    command, address, data = parseRolandMessage(patch_parts[6])
-    if command == command_dt1 and address == [0x00, 0x03, 0x00]:
-        return "".join([character_set[x] for x in data[:18]])
+    patch = parsedPatch(message)
+    name = patch.data(patch_name_address, patch_name_length)
+    if name is not None:
+        return "".join([character_set[x] for x in name])
     raise Exception("Error in Roland D-50 data structure - did not find Patch data block")
 
 
+def numberOfBanks():
+    return 1
+
+
+def numberOfPatchesPerBank():
+    return patches_per_bank
+
+
+def createBankDumpRequest(channel, bank):
+    # Request the whole patch memory, the D-50 answers with a series of DT1 messages
+    return buildRolandMessage(channel, command_rq1, index_to_address(patch_memory_base),
+                              index_to_address(patches_per_bank * patch_size))
+
+
+def isPartOfBankDump(message):
+    # The D-50 sends the tone and reverb data after the patches, those messages are not needed
+    header = dt1Header(message)
+    return header is not None and patch_memory_base <= header[0] < patch_memory_end
+
+
+def isBankDumpFinished(messages):
+    for message in messages:
+        header = dt1Header(message)
+        if header is not None and header[0] < patch_memory_end <= header[0] + header[1]:
+            return True
+    return False
+
+
+# The bank dump is a series of DT1 messages, each a part of the memory image of the synth, and a patch can span two
+# messages. So the image is assembled in the state of a bank dump session, and after each message the patches it
+# completed are extracted
+def beginBankDump(bank):
+    return BankImage()
+
+
+def feedBankDumpMessage(state, message):
+    state.store(message)
+    return state.complete()
+
+
+def extractCompletedPatches(state):
+    return state.completed_patches()
+
+
 def loadD50BankDump(messages):
     # The Bank dumps of the D-50 basically are just a lists of messages with the whole memory content of the synth
     # We need to put them together, and then can read the individual data items from the RAM
-    synth_ram = [0xff] * (address_to_index([0x04, 0x0c, 0x08]) + 376)
+    image = BankImage()
     for message in messages:
-        command, address, data = parseRolandMessage(message)
-        if command == command_dt1:
-            memory_base_index = address_to_index(address)
-            synth_ram[memory_base_index:memory_base_index + len(data)] = data
-
-    # Now pull 64 patches out of the RAM and create individual edit buffer messages
-    result = []
-    for p in range(64):
-        patch = []
-        patch_base = address_to_index([0x2, 0x00, 0x00]) + p * (7 * 0x40)
-        for subsection in range(7):
-            target_base = subsection * 0x40
-            source_base = patch_base + target_base
-            patch = patch + buildRolandMessage(0, command_dt1,
-                                               index_to_address(target_base),
-                                               synth_ram[source_base:source_base + 0x40])
-        result.append(patch)
-    return result
+        image.store(message)
+    return [list(patch) for _, patch in image.patches(range(patches_per_bank))]
+
+
+class BankImage:
+    """The patch memory of the D-50, assembled from the DT1 messages of a bank dump"""
+
+    def __init__(self):
+        self.ram = bytearray(b'\xff' * (patches_per_bank * patch_size))
+        self.__view = memoryview(self.ram)
+        # Bytes received without gaps from the start of the patch memory, and patches already handed out
+        self.__received = 0
+        self.__extracted = 0
+
+    def store(self, message):
+        data = message if isinstance(message, (bytes, bytearray)) else bytes(message)
+        header = dt1Header(data)
+        if header is None:
+            return
+        if roland_checksum(data[5:-2]) != data[-2]:
+            # Without this block the image has a gap and the patches after it would never be complete
+            raise Exception("Checksum error in Roland D-50 bank dump, expected", data[-2], "but got",
+                            roland_checksum(data[5:-2]))
+        index, length = header
+        offset = index - patch_memory_base
+        if offset == 0:
+            # A new bank dump starts
+            self.__received = 0
+            self.__extracted = 0
+        start = max(offset, 0)
+        end = min(offset + length, len(self.ram))
+        if start >= end:
+            return
+        self.__view[start:end] = memoryview(data)[8 + start - offset:8 + end - offset]
+        if start <= self.__received:
+            self.__received = max(self.__received, end)
+
+    def complete(self):
+        return self.__received == len(self.ram)
+
+    def completed_patches(self):
+        completed = range(self.__extracted, self.__received // patch_size)
+        self.__extracted = max(self.__extracted, completed.stop)
+        return self.patches(completed)
+
+    def patches(self, program_numbers):
+        """Generator yielding (program number, patch as bytes) with the patch as edit buffer DT1 messages"""
+        for program in program_numbers:
+            patch = bytearray(patch_template)
+            patch_base = program * patch_size
+            for block in range(blocks_per_patch):
+                source = self.__view[patch_base + block * block_size:patch_base + (block + 1) * block_size]
+                start = block * block_message_size + 8
+                patch[start:start + block_size] = source
+                patch[start + block_size] = -(block_address_sums[block] + sum(source)) & 0x7f
+            yield program, bytes(patch)
+
+
+class D50Patch:
+    """A patch as received from the synth or extracted from a bank, a number of DT1 messages concatenated. The
+    messages are parsed and checked once, after that the data can be looked up by address"""
+
+    def __init__(self, message):
+        self.message = message if isinstance(message, (bytes, bytearray)) else bytes(message)
+        self.__view = memoryview(self.message)
+        # Address index of each block -> (start, end) of its data in the message
+        self.blocks = {}
+        message = self.message
+        start = message.find(b'\xf0')
+        while start != -1:
+            end = message.find(b'\xf7', start)
+            if end == -1:
+                break
+            # With a valid Roland checksum, address, data and checksum add up to 0 in the lower 7 bits
+            if end - start < 10 or message[start + 1] != roland_id or message[start + 3] != model_id \
+                    or message[start + 4] != command_dt1 or sum(message[start + 5:end]) & 0x7f:
+                raise Exception("Error in Roland D-50 data structure - patch contains an invalid DT1 message")
+            self.blocks[address_to_index(message[start + 5:start + 8])] = (start + 8, end - 1)
+            start = message.find(b'\xf0', end)
+
+    def block(self, address):
+        """The data of the block starting at the address, as a memoryview into the message"""
+        start, end = self.blocks[address_to_index(address) if isinstance(address, list) else address]
+        return self.__view[start:end]
+
+    def data(self, address, length):
+        """length bytes of data starting at any address within one block, or None if no block contains them"""
+        index = address_to_index(address) if isinstance(address, list) else address
+        for block_address, (start, end) in self.blocks.items():
+            if block_address <= index and index + length <= block_address + end - start:
+                offset = start + index - block_address
+                return self.__view[offset:offset + length]
+        return None
+
+
+def parsedPatch(message):
+    # The grid asks for the names of the same patches again and again, parse them only once
+    data = message if isinstance(message, (bytes, bytearray)) else bytes(message)
+    key = message_digest(data)
+    patch = patch_cache.get(key)
+    if patch is None:
+        patch = D50Patch(data)
+        patch_cache.put(key, patch)
+    return patch
+
+
+def dt1Header(message):
+    """Returns (address as index, data length) if the message is a D-50 DT1 message, else None. The checksum is not
+    checked here"""
+    if len(message) > 9 and isOwnSysex(message) and message[4] == command_dt1:
+        return address_to_index(message[5:8]), len(message) - 10
+    return None
 
 
 def isOwnSysex(message):
@@ -91,7 +240,7 @@ def parseRolandMessage(message):
 
 
 def roland_checksum(data_block):
-    return sum([-x for x in data_block]) & 0x7f
+    return -sum(data_block) & 0x7f
 
 
 def address_to_index(address):
@@ -102,23 +251,19 @@ def index_to_address(index):
     return [index >> 14, (index & 0x3f80) >> 7, index & 0x7f]
 
 
-def splitSysex(byte_list):
-    result = []
-    index = 0
-    while index < len(byte_list):
-        sysex = []
-        if byte_list[index] == 0xf0:
-            # Sysex start
-            while byte_list[index] != 0xf7 and index < len(byte_list):
-                sysex.append(byte_list[index])
-                index += 1
-            sysex.append(0xf7)
-            index += 1
-            result.append(sysex)
-        else:
-            print("Skipping invalid byte", byte_list[index])
-            index += 1
-    return result
+patch_memory_base = address_to_index([0x02, 0x00, 0x00])
+patch_memory_end = patch_memory_base + patches_per_bank * patch_size
+
+# A patch extracted from a bank is sent as seven DT1 messages to the edit buffer addresses. Only the data and the
+# checksums need to be filled into this template
+block_message_size = 8 + block_size + 2
+patch_template = b''.join(bytes(buildRolandMessage(0, command_dt1, index_to_address(block * block_size),
+                                                   [0] * block_size)) for block in range(blocks_per_patch))
+block_address_sums = [sum(index_to_address(block * block_size)) for block in range(blocks_per_patch)]
+
+patch_name_address = address_to_index([0x00, 0x03, 0x00])
+patch_name_length = 18
+patch_cache = PayloadCache(256)
 
 
 if __name__ == "__main__":
@@ -127,10 +272,97 @@ if __name__ == "__main__":
     assert (g_command == command_rq1)
     assert (g_address == [0x00, 0x01, 0x00])
     assert (g_data == [0x00, 0x00, 0x40])
+    assert createBankDumpRequest(0, 0)[5:11] == [0x02, 0x00, 0x00, 0x01, 0x60, 0x00]
+
+    def reference_load(messages):
+        synth_ram = [0xff] * (address_to_index([0x04, 0x0c, 0x08]) + 376)
+        for message in messages:
+            command, address, data = parseRolandMessage(message)
+            if command == command_dt1:
+                memory_base_index = address_to_index(address)
+                synth_ram[memory_base_index:memory_base_index + len(data)] = data
+        result = []
+        for p in range(64):
+            patch = []
+            patch_base = address_to_index([0x2, 0x00, 0x00]) + p * (7 * 0x40)
+            for subsection in range(7):
+                target_base = subsection * 0x40
+                source_base = patch_base + target_base
+                patch = patch + buildRolandMessage(0, command_dt1, index_to_address(target_base),
+                                                   synth_ram[source_base:source_base + 0x40])
+            result.append(patch)
+        return result
+
+    # A bank dump as the D-50 sends it: 256 bytes per DT1 message, the patches followed by the tone and reverb data
+    import random
+    import timeit
+    g_names = []
+    g_ram = []
+    for g_p in range(patches_per_bank):
+        g_patch = [random.randrange(0x40) for _ in range(patch_size)]
+        g_names.append("".join(character_set[x] for x in g_patch[6 * block_size:6 * block_size + 18]))
+        g_ram.extend(g_patch)
+    g_ram.extend(random.randrange(0x80) for _ in range(address_to_index([0x04, 0x0c, 0x08]) + 376 - patch_memory_end))
+    sysex_messages = [buildRolandMessage(3, command_dt1, index_to_address(patch_memory_base + i), g_ram[i:i + 256])
+                      for i in range(0, len(g_ram), 256)]
+    assert all(isPartOfBankDump(m) for m in sysex_messages[:112])
+    assert not any(isPartOfBankDump(m) for m in sysex_messages[112:])
+    assert not isPartOfBankDump(detectMessage)
+    assert not isBankDumpFinished(sysex_messages[:111])
+    assert isBankDumpFinished(sysex_messages[:112])
+
+    patches = loadD50BankDump(sysex_messages)
+    assert patches == reference_load(sysex_messages)
+    assert [nameFromDump(g_p) for g_p in patches] == g_names
+    g_patch = parsedPatch(patches[5])
+    assert sorted(g_patch.blocks) == [block * block_size for block in range(blocks_per_patch)]
+    assert list(g_patch.block([0x00, 0x01, 0x00])) == g_ram[5 * patch_size + 0x80:5 * patch_size + 0xc0]
+    assert list(g_patch.data([0x00, 0x01, 0x02], 4)) == g_ram[5 * patch_size + 0x82:5 * patch_size + 0x86]
+    assert g_patch.data([0x00, 0x01, 0x3e], 4) is None
+    assert parsedPatch(bytes(patches[5])) is g_patch
+    g_renamed = list(patches[5])
+    g_renamed[6 * block_message_size + 8] = (g_renamed[6 * block_message_size + 8] + 1) & 0x3f
+    g_renamed[7 * block_message_size - 2] = roland_checksum(g_renamed[6 * block_message_size + 5:-2])
+    assert nameFromDump(g_renamed) != nameFromDump(patches[5])
+
+    # Streaming: each message returns the patches it completed, an interrupted dump does not affect the next one
+    interrupted = beginBankDump(0)
+    for g_message in sysex_messages[:50]:
+        assert not feedBankDumpMessage(interrupted, g_message)
+    assert len(list(extractCompletedPatches(interrupted))) == 50 * 256 // patch_size
+    g_state = beginBankDump(0)
+    streamed = []
+    for g_index, g_message in enumerate(sysex_messages[:112]):
+        assert feedBankDumpMessage(g_state, g_message) == (g_index == 111)
+        streamed.extend(extractCompletedPatches(g_state))
+        if g_index == 0:
+            assert streamed == []
+        if g_index == 1:
+            assert len(streamed) == 1
+    assert [g_p for g_p, _ in streamed] == list(range(patches_per_bank))
+    assert [list(g_patch) for _, g_patch in streamed] == patches
+    assert list(extractCompletedPatches(g_state)) == []
+    # A block with a bad checksum is an error, not a silent gap in the image
+    g_broken = list(sysex_messages[3])
+    g_broken[-2] = (g_broken[-2] + 1) & 0x7f
+    assert isPartOfBankDump(g_broken)
+    g_error = None
+    try:
+        feedBankDumpMessage(beginBankDump(0), g_broken)
+    except Exception as e:
+        g_error = e
+    assert g_error is not None and "Checksum error" in str(g_error)
+
+    before = timeit.timeit(lambda: reference_load(sysex_messages), number=10)
+    after = timeit.timeit(lambda: loadD50BankDump(sysex_messages), number=10)
+    print("load bank: %.1f ms -> %.1f ms" % (before * 100, after * 100))
 
-    with open(R"D:\Christof\Music\RolandD50\BB1_SYX\BobbyBluz_1.syx", "rb") as bankDump:
-        g_sysex = bankDump.read()
-        sysex_messages = splitSysex(g_sysex)
-        patches = loadD50BankDump(sysex_messages)
-        for g_p in patches:
-            print("Found patch", nameFromDump(g_p))
+    import os
+    g_filename = R"D:\Christof\Music\RolandD50\BB1_SYX\BobbyBluz_1.syx"
+    if os.path.exists(g_filename):
+        with open(g_filename, "rb") as bankDump:
+            g_sysex = bankDump.read()
+            sysex_messages = split_sysex(g_sysex)
+            patches = loadD50BankDump(sysex_messages)
+            for g_p in patches:
+                print("Found patch", nameFromDump(g_p))
@@ -3,47 +3,13 @@
 #
 #   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
 #
-from ctypes import *
-
-
-class OPERATOR_PACKED(Structure):
-    _pack_ = 1
-    _fields_ = [
-        ("first_section", c_uint8 * 11),
-        ("scale_left_curve", c_uint8, 2),
-        ("scale_right_curve", c_uint8, 2),
-        ("unused1", c_uint8, 4),
-        ("rate_scale", c_uint8, 3),
-        ("detune", c_uint8, 4),
-        ("unused2", c_uint8, 1),
-        ("amp_mod_sensivity", c_uint8, 2),
-        ("key_vel_sensivity", c_uint8, 3),
-        ("unused3", c_uint8, 3),
-        ("output_level", c_uint8),
-        ("osc_mode", c_uint8, 1),
-        ("freq_coarse", c_uint8, 5),
-        ("unused4", c_uint8, 2),
-        ("freq_fine", c_uint8),
-    ]
-
-
-class VOICE_PACKED(Structure):
-    _pack_ = 1
-    _fields_ = [
-        ("operators", OPERATOR_PACKED * 6),
-        ("envs", c_uint8 * 8),
-        ("algorithm", c_uint8, 5),
-        ("unused1", c_uint8, 3),
-        ("feedback", c_uint8, 3),
-        ("osc_key_sync", c_uint8, 1),
-        ("unused1", c_uint8, 4),
-        ("lfo", c_uint8 * 4),
-        ("lfo_sync", c_uint8, 1),
-        ("lfo_wave", c_uint8, 3),
-        ("lfo_pitch_mod_sens", c_uint8, 4),
-        ("transpose", c_uint8),
-        ("name", c_uint8 * 10)
-    ]
+from sequential.DX7Codec import checksum, single_voice_dumps, split_single_voice_dumps, bank_dump, VOICE_SIZE
+from sequential.SysexStream import iter_bank_patches
+
+# The Orm hands all MIDI messages to this adaptation as bytes instead of lists of ints
+KNOBKRAFT_API = 2
+# The bank and patch functions only work on their arguments, so the Orm may call them in its worker processes
+KNOBKRAFT_WORKER_SAFE = True
 
 
 def name():
@@ -84,7 +50,7 @@ def createEditBufferRequest(channel):
 
 def isEditBufferDump(message):
     # It's not really edit buffer dumps, but single voice dumps
-    return len(message) > 5 and message[:6] == [0xf0, 0x43, 0x00, 0x00, 0x01, 0x1b]
+    return len(message) > 5 and bytes(message[:6]) == b'\xf0\x43\x00\x00\x01\x1b'
 
 
 def convertToEditBuffer(channel, message):
@@ -99,7 +65,7 @@ def createBankDumpRequest(channel, bank):
 
 
 def isPartOfBankDump(message):
-    return len(message) > 5 and message[:6] == [0xf0, 0x43, 0x00, 0x09, 0x20, 0x00]
+    return len(message) > 5 and bytes(message[:6]) == b'\xf0\x43\x00\x09\x20\x00'
 
 
 def isBankDumpFinished(messages):
@@ -108,17 +74,13 @@ def isBankDumpFinished(messages):
 
 
 def extractPatchesFromBank(message):
-    patches = []
     if isPartOfBankDump(message):
         data_block = message[6:-2]
         # Check for hardcoded length of bank dump
         if len(data_block) == (0x20 << 7 | 0x00):
             if checksum(data_block) == message[-2]:
-                # Checksum correct
-                for i in range(32):
-                    voice = packedVoiceToSingleVoice(data_block[i * 128: (i + 1) * 128])
-                    patches += singlePatchFromVoice(voice)
-                return patches
+                # Checksum correct, unpack all 32 voices in one go
+                return split_single_voice_dumps(single_voice_dumps(data_block))
             print("Checksum error encountered in DX7 bulk dump")
             return []
         print("Got DX7 bulk dump of invalid length - data length is %d but was expected to be %d" % (
@@ -126,13 +88,24 @@ def extractPatchesFromBank(message):
     return []
 
 
+def convertToBankDump(channel, messages):
+    # Send up to 32 voices as one 32 voice bulk dump instead of one by one. The synth replaces its internal memory
+    # with it, missing voices are filled up with the init voice
+    voices = []
+    for message in messages:
+        if not isEditBufferDump(message) or len(message) != VOICE_SIZE + 8:
+            raise Exception("Can only put single voice dumps into a bank dump")
+        voices.append(bytes(message[6:6 + VOICE_SIZE]))
+    return list(bank_dump(voices, channel))
+
+
 def nameFromDump(message):
     if isEditBufferDump(
             message):
         data_block = message[6:-2]
         if len(data_block) == 155:
             # The last 10 bytes of the data block of the common message are the name
-            return "".join([chr(x) for x in data_block[-10:]])
+            return data_block[-10:].decode("latin-1")
     raise Exception("Can only extract a name from a single program dump")
 
 
@@ -143,67 +116,19 @@ def setupHelp():
         "To send a patch to the DX7 for audition, make sure the INTERNAL MEMORY PROTECT is set to off."
 
 
-def packedVoiceToSingleVoice(packed):
-    # This is the ugly function that needs to unpack 155 bytes from the 128 byte packed data format
-    source = VOICE_PACKED.from_buffer_copy(bytearray(packed))
-    dest = []
-    for op in source.operators:
-        dest += op.first_section
-        dest.append(op.scale_left_curve)
-        dest.append(op.scale_right_curve)
-        dest.append(op.rate_scale)
-        dest.append(op.amp_mod_sensivity)
-        dest.append(op.key_vel_sensivity)
-        dest.append(op.output_level)
-        dest.append(op.osc_mode)
-        dest.append(op.freq_coarse)
-        dest.append(op.freq_fine)
-        dest.append(op.detune)
-    dest += source.envs
-    dest.append(source.algorithm)
-    dest.append(source.feedback)
-    dest.append(source.osc_key_sync)
-    dest += source.lfo
-    dest.append(source.lfo_sync)
-    dest.append(source.lfo_wave)
-    dest.append(source.lfo_pitch_mod_sens)
-    dest.append(source.transpose)
-    dest += source.name
-    return dest
-
-
-def singlePatchFromVoice(voice):
-    return [0xf0, 0x43, 0x00, 0x00, 0x01, 0x1b] + voice + [checksum(voice), 0xf7]
-
-
-def checksum(data_block):
-    check_sum = 0
-    for d in data_block:
-        check_sum -= d
-    return check_sum & 0x7f
-
-
-def splitSysexMessage(messages):
-    result = []
-    start = 0
-    read = 0
-    while read < len(messages):
-        if messages[read] == 0xf0:
-            start = read
-        elif messages[read] == 0xf7:
-            result.append(messages[start:read + 1])
-        read = read + 1
-    return result
-
-
 def run_tests():
     with open(R"testData/yamahaDX7-ROM2B.SYX", "rb") as sysex:
-        data = list(sysex.read())
+        data = sysex.read()
         assert isPartOfBankDump(data)
-        patches = splitSysexMessage(extractPatchesFromBank(data))
+        # The Orm hands the patches back as bytes, just like the bank dump
+        patches = [bytes(patch) for _, patch in iter_bank_patches(extractPatchesFromBank(data))]
         assert len(patches) == 32
         for p in patches:
             print(nameFromDump(p))
+        # Sending them back as a bank gives the original bank dump
+        assert convertToBankDump(0, patches) == list(data)
+        bank = bytes(convertToBankDump(0, patches[:3]))
+        assert nameFromDump(bytes(list(iter_bank_patches(extractPatchesFromBank(bank)))[3][1])) == "INIT VOICE"
 
 
 if __name__ == "__main__":
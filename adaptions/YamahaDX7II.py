@@ -3,48 +3,9 @@
 #
 #   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
 #
-from ctypes import *
-import binascii
-
-
-class OPERATOR_PACKED(Structure):
-    _pack_ = 1
-    _fields_ = [
-        ("first_section", c_uint8 * 11),
-        ("scale_left_curve", c_uint8, 2),
-        ("scale_right_curve", c_uint8, 2),
-        ("unused1", c_uint8, 4),
-        ("rate_scale", c_uint8, 3),
-        ("detune", c_uint8, 4),
-        ("unused2", c_uint8, 1),
-        ("amp_mod_sensivity", c_uint8, 2),
-        ("key_vel_sensivity", c_uint8, 3),
-        ("unused3", c_uint8, 3),
-        ("output_level", c_uint8),
-        ("osc_mode", c_uint8, 1),
-        ("freq_coarse", c_uint8, 5),
-        ("unused4", c_uint8, 2),
-        ("freq_fine", c_uint8),
-    ]
-
-
-class VOICE_PACKED(Structure):
-    _pack_ = 1
-    _fields_ = [
-        ("operators", OPERATOR_PACKED * 6),
-        ("envs", c_uint8 * 8),
-        ("algorithm", c_uint8, 5),
-        ("unused1", c_uint8, 3),
-        ("feedback", c_uint8, 3),
-        ("osc_key_sync", c_uint8, 1),
-        ("unused1", c_uint8, 4),
-        ("lfo", c_uint8 * 4),
-        ("lfo_sync", c_uint8, 1),
-        ("lfo_wave", c_uint8, 3),
-        ("lfo_pitch_mod_sens", c_uint8, 4),
-        ("transpose", c_uint8),
-        ("name", c_uint8 * 10)
-    ]
+from sequential.DX7Codec import checksum, single_voice_dumps, split_single_voice_dumps, bank_dump, VOICE_SIZE, \
+    iter_universal_bulk_dump
+from sequential.SysexStream import split_sysex, iter_bank_patches
 
 
 def name():
@@ -68,10 +29,8 @@ def deviceDetectWaitMilliseconds():
 
 def channelIfValidDeviceResponse(message):
     if isUniversalBulkDump(message):
-        classification, data_format = getClassFromUniversalBulkDump(message)
+        classification, data_format, system_data = next(iter_universal_bulk_dump(message), (None, None, None))
         if classification == "LM  " and data_format == "8973S ":
-            blocks = getDataBlocksFromUniversalBulkDump(message)
-            system_data = blocks[0][10:]
             # Ok, here we should have 85 bytes of system setup parameter data. I can guess that the manual
             # of the DX7s specifies these bytes, as 21 parameters are given and there is "64 bytes more".
             # If that is true, the "MIDI system common message RX channel (device No.) is at index 14
@@ -130,33 +89,36 @@ def isBankDumpFinished(messages):
 
 
 def extractPatchesFromBank(message):
-    patches = []
     if isOwnSysexOfSubstatusAndGroup(message, 0x00, 9):
         data_block = message[6:-2]
         # Check for hardcoded length of bank dump
         if len(data_block) == (0x20 << 7 | 0x00):
             if checksum(data_block) == message[-2]:
-                # Checksum correct
-                for i in range(32):
-                    voice = packedVoiceToSingleVoice(data_block[i * 128: (i + 1) * 128])
-                    patches += singlePatchFromVoice(voice)
-                return patches
+                # Checksum correct, unpack all 32 voices in one go
+                return split_single_voice_dumps(single_voice_dumps(data_block))
             print("Checksum error encountered in DX7 bulk dump")
             return []
         print("Got DX7 bulk dump of invalid length - data length is %d but was expected to be %d" % (
             len(data_block), (0x20 << 7)))
-    elif isPartOfBankDump(message):
-        if isUniversalBulkDump(message):
-            blocks = getDataBlocksFromUniversalBulkDump(message)
-            print("Ignoring DX7II sysex message of class %s and format %s" % getClassFromUniversalBulkDump(message))
-        elif isParameterChange(message):
-            print("Ignoring DX7II parameter change message: g:%d h:%s p:%s v:%s" % getParameterChanged(message))
-        elif isOwnSysexOfSubstatusAndGroup(message, 0x00, 6):
-            print("Ignoring DX7II packed 32 supplement message")
-        else:
-            print("Ignoring " + repr(binascii.b2a_hex(bytearray(message))))
-    else:
+    elif isUniversalBulkDump(message):
+        # System setup, performances and other data contain no voices. Just make sure the data is not corrupted
+        for _ in iter_universal_bulk_dump(message):
+            pass
+    elif not isPartOfBankDump(message):
         raise Exception("Program error - Got message which is not part of bank dump in extract patches from bank")
+    # Parameter changes and the packed 32 supplement are ignored as well
+    return []
+
+
+def convertToBankDump(channel, messages):
+    # Send up to 32 voices as one 32 voice bulk dump instead of one by one. The synth replaces its internal memory
+    # with it, missing voices are filled up with the init voice
+    voices = []
+    for message in messages:
+        if not isEditBufferDump(message) or len(message) != VOICE_SIZE + 8:
+            raise Exception("Can only put single voice dumps into a bank dump")
+        voices.append(bytes(message[6:6 + VOICE_SIZE]))
+    return list(bank_dump(voices, channel))
 
 
 def nameFromDump(message):
@@ -177,39 +139,6 @@ def setupHelp():
            "It is just not implemented in the adaptation. Feel free to edit!"
 
 
-def packedVoiceToSingleVoice(packed):
-    # This is the ugly function that needs to unpack 155 bytes from the 128 byte packed data format
-    source = VOICE_PACKED.from_buffer_copy(bytearray(packed))
-    dest = []
-    for op in source.operators:
-        dest += op.first_section
-        dest.append(op.scale_left_curve)
-        dest.append(op.scale_right_curve)
-        dest.append(op.rate_scale)
-        dest.append(op.amp_mod_sensivity)
-        dest.append(op.key_vel_sensivity)
-        dest.append(op.output_level)
-        dest.append(op.osc_mode)
-        dest.append(op.freq_coarse)
-        dest.append(op.freq_fine)
-        dest.append(op.detune)
-    dest += source.envs
-    dest.append(source.algorithm)
-    dest.append(source.feedback)
-    dest.append(source.osc_key_sync)
-    dest += source.lfo
-    dest.append(source.lfo_sync)
-    dest.append(source.lfo_wave)
-    dest.append(source.lfo_pitch_mod_sens)
-    dest.append(source.transpose)
-    dest += source.name
-    return dest
-
-
-def singlePatchFromVoice(voice):
-    return [0xf0, 0x43, 0x00, 0x00, 0x01, 0x1b] + voice + [checksum(voice), 0xf7]
-
-
 def isUniversalBulkDump(message):
     return isOwnSysexOfSubstatusAndGroup(message, 0x00, 0x7e)
 
@@ -220,27 +149,6 @@ def getClassFromUniversalBulkDump(message):
     raise Exception("Need universal bulk dump message here")
 
 
-def getDataBlocksFromUniversalBulkDump(message):
-    if isUniversalBulkDump(message):
-        # The Universal Bulk Dump can contain repeats of data blocks. This is important to know to parse it
-        # and calculate the length and checksum correctly...
-        blocks = []
-        read_ptr = 4
-        while read_ptr < len(message) and message[read_ptr] != 0xf7:
-            data_len = (message[read_ptr] << 7) | message[read_ptr + 1]
-            read_ptr += 2
-            data_block = message[read_ptr:read_ptr + data_len]
-            read_ptr += data_len
-            if len(data_block) != data_len:
-                raise Exception("Corrupted data - data block in universal bulk dump doesn't contain enough data")
-            expected_chk = message[read_ptr]
-            read_ptr += 1
-            if expected_chk != checksum(data_block):
-                raise Exception("Corrupted data - invalid checksum in universal bulk dump.")
-            blocks.append(data_block)
-        return blocks
-
-
 def isParameterChange(message):
     return (len(message) > 5 and message[0] == 0xf0
             and message[1] == 0x43  # Yamaha
@@ -278,42 +186,23 @@ def createUniversalDumpRequest(channel, classification_name, data_format_name):
                                                                                             data_format_name] + [0xf7]
 
 
-def checksum(data_block):
-    check_sum = 0
-    for d in data_block:
-        check_sum -= d
-    return check_sum & 0x7f
-
-
-def splitSysexMessage(messages):
-    result = []
-    start = 0
-    read = 0
-    while read < len(messages):
-        if messages[read] == 0xf0:
-            start = read
-        elif messages[read] == 0xf7:
-            result.append(messages[start:read + 1])
-        read = read + 1
-    return result
-
-
 def run_tests():
     with open(R"testData/yamahaDX7II-STUDIOREINE BANK.syx", "rb") as sysex:
         data = list(sysex.read())
-        messages = splitSysexMessage(data)
+        messages = split_sysex(data)
         for message in messages:
             assert isPartOfBankDump(message)
             patchData = extractPatchesFromBank(message)
-            if patchData is not None:
-                patches = splitSysexMessage(patchData)
+            if patchData:
+                patches = [patch for _, patch in iter_bank_patches(patchData)]
+                assert convertToBankDump(0, patches) == message
                 for p in patches:
                     print(nameFromDump(p))
             if isUniversalBulkDump(message):
                 classification, data_format = getClassFromUniversalBulkDump(message)
                 if classification == "LM  " and data_format == "8973S ":
-                    blocks = getDataBlocksFromUniversalBulkDump(message)
-                    system_data = blocks[0][10:]
+                    system_data = next(iter_universal_bulk_dump(message))[2]
+                    assert channelIfValidDeviceResponse(message) == 0
                     print("MIDI transmit channel", system_data[0])
                     print("MIDI receive channel 1", system_data[2])
                     print("MIDI receive channel 2", system_data[3])
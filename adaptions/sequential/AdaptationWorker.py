@@ -0,0 +1,184 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+
+#
+# Running adaptation functions out of process. The KnobKraft Orm can start worker processes (see the Adaptation tab), and
+# then calls the pure functions of an adaptation - fingerprints, names, bank extraction - in these workers instead of its
+# own interpreter, so several of them can run at the same time on all cores.
+#
+# This module is the protocol both sides use: A request names the adaptation module and function, and carries a list of
+# argument tuples, the function is called once for each of them. Requests and responses are pickled, so bytes stay bytes
+# and lists of ints stay lists of ints, and the caller sees exactly what an in-process call would have returned.
+#
+# Outside of the Orm, the WorkerPool does the same with Python processes, e.g. to run the tests of an adaptation over
+# large sets of sysex files:
+#
+#     with WorkerPool() as pool:
+#         fingerprints = pool.map("RolandD50", "calculateFingerprint", [(patch,) for patch in patches])
+#
+import concurrent.futures
+import contextlib
+import importlib
+import inspect
+import io
+import os
+import pickle
+import sys
+
+PROTOCOL = 4
+
+
+class AdaptationWorkerError(Exception):
+    pass
+
+
+def portable(value):
+    """Turn a result into something that can be pickled and means the same to the caller: generators and other
+    iterators are collected into lists, memoryviews copied into bytes"""
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    if isinstance(value, list):
+        return [portable(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(portable(item) for item in value)
+    if inspect.isgenerator(value) or isinstance(value, (map, filter, zip)):
+        return [portable(item) for item in value]
+    return value
+
+
+def encode_request(module_name, from_file, function_name, arguments):
+    """A request to call the function of the adaptation module once for each argument tuple in arguments.
+    from_file tells if the module is imported by name or is a built-in adaptation of the Orm"""
+    return pickle.dumps((module_name, from_file, function_name, [tuple(portable(a)) for a in arguments]), PROTOCOL)
+
+
+def execute_request(request, resolve):
+    """Run a request in the worker. resolve(module_name, from_file, function_name) returns the function to call.
+    Returns the response, holding for every call either the result or the error, plus what the adaptation printed"""
+    module_name, from_file, function_name, arguments = pickle.loads(request)
+    output = io.StringIO()
+    results = []
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            function = resolve(module_name, from_file, function_name)
+        except Exception as e:
+            return pickle.dumps(([(False, _describe(e))] * len(arguments), output.getvalue()), PROTOCOL)
+        for args in arguments:
+            try:
+                results.append((True, portable(function(*args))))
+            except Exception as e:
+                results.append((False, _describe(e)))
+    try:
+        return pickle.dumps((results, output.getvalue()), PROTOCOL)
+    except Exception as e:
+        return pickle.dumps(([(False, "Result cannot be sent back: " + _describe(e))] * len(arguments),
+                             output.getvalue()), PROTOCOL)
+
+
+def decode_response(response):
+    """Returns the list of (ok, result or error message) pairs, one per call, and the output of the adaptation"""
+    return pickle.loads(response)
+
+
+def result_value(entry):
+    ok, value = entry
+    if not ok:
+        raise AdaptationWorkerError(value)
+    return value
+
+
+def import_resolver(module_name, from_file, function_name):
+    # Standalone there are no built-in adaptations, everything is imported
+    module = importlib.import_module(module_name)
+    if not hasattr(module, function_name):
+        raise AdaptationWorkerError("Adaptation %s does not implement %s" % (module_name, function_name))
+    return getattr(module, function_name)
+
+
+def _describe(exception):
+    return "%s: %s" % (type(exception).__name__, exception)
+
+
+def _serve(request):
+    return execute_request(request, import_resolver)
+
+
+def _setup_worker(path):
+    sys.path[:] = path
+
+
+class WorkerPool:
+
+    def __init__(self, workers=None):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.__executor = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_setup_worker,
+                                                                 initargs=(list(sys.path),))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.__executor.shutdown()
+
+    def call(self, module_name, function_name, *args):
+        return self.map(module_name, function_name, [args])[0]
+
+    def map(self, module_name, function_name, arguments):
+        """Call the function once per argument tuple, split into one request per worker.
+        Raises AdaptationWorkerError for the first call that failed"""
+        arguments = list(arguments)
+        chunk = max(1, -(-len(arguments) // self.workers))
+        requests = [encode_request(module_name, True, function_name, arguments[i:i + chunk])
+                    for i in range(0, len(arguments), chunk)]
+        results = []
+        for response in self.__executor.map(_serve, requests):
+            entries, output = decode_response(response)
+            if output:
+                print(output, end="")
+            results.extend(result_value(entry) for entry in entries)
+        return results
+
+
+if __name__ == "__main__":
+    def numbered(message):
+        for i in range(3):
+            yield i, memoryview(bytes(message))[i:i + 2]
+
+    functions = {"numbered": numbered, "same": lambda data: data, "broken": lambda data: 1 / 0}
+    request = encode_request("Test", False, "numbered", [(b"\xf0\x01\x02\xf7",), ([0xf0, 0xf7],)])
+    entries, output = decode_response(execute_request(request, lambda m, f, name: functions[name]))
+    assert [result_value(e) for e in entries] == [[(0, b"\xf0\x01"), (1, b"\x01\x02"), (2, b"\x02\xf7")],
+                                                  [(0, b"\xf0\xf7"), (1, b"\xf7"), (2, b"")]]
+    request = encode_request("Test", False, "same", [([0xf0, 0xf7],), (bytearray(b"\xf0"),)])
+    entries, output = decode_response(execute_request(request, lambda m, f, name: functions[name]))
+    assert [result_value(e) for e in entries] == [[0xf0, 0xf7], bytearray(b"\xf0")]
+    assert type(result_value(entries[1])) is bytearray
+    request = encode_request("Test", False, "broken", [([1],), ([2],)])
+    entries, output = decode_response(execute_request(request, lambda m, f, name: functions[name]))
+    assert [ok for ok, _ in entries] == [False, False]
+    assert entries[0][1].startswith("ZeroDivisionError")
+    entries, output = decode_response(execute_request(request, import_resolver))
+    assert entries[0][1].startswith("ModuleNotFoundError")
+
+    # Results from worker processes must be identical to calling the adaptation directly
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    os.chdir(sys.path[0])
+    import time
+    from sequential.SysexStream import load_sysex
+    adaptation = importlib.import_module("YamahaDX7")
+    bank = [bytes(m) for m in load_sysex("testData/yamahaDX7-ROM2B.SYX")]
+    with WorkerPool() as pool:
+        assert pool.call("YamahaDX7", "extractPatchesFromBank", bank[0]) == \
+               portable(adaptation.extractPatchesFromBank(bank[0]))
+        patches = [patch for patch in portable(adaptation.extractPatchesFromBank(bank[0]))] * 100
+        names = pool.map("YamahaDX7", "nameFromDump", [(patch,) for patch in patches])
+        assert names == [adaptation.nameFromDump(patch) for patch in patches]
+        start = time.perf_counter()
+        pool.map("YamahaDX7", "nameFromDump", [(patch,) for patch in patches])
+        print("%d names in %d workers: %.2f ms" % (len(patches), pool.workers, (time.perf_counter() - start) * 1e3))
@@ -0,0 +1,240 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+
+#
+# Micro benchmark for the adaptation layer, driven by the sysex files in testData.
+#
+# Run from the adaptions directory:
+#
+#     python -m sequential.Benchmark                           # print results as JSON
+#     python -m sequential.Benchmark --output baseline.json    # store a baseline
+#     python -m sequential.Benchmark --baseline baseline.json  # compare, exit code 1 on regressions
+#
+# The numbers are calls per second and input bytes per second over all suitable messages of the test files,
+# so they include everything the adaptation does with the list of ints the C++ side hands in, or the bytes
+# objects for adaptations defining KNOBKRAFT_API = 2. Messages a function fails on are not timed, but counted as
+# "skipped" together with the first error, and more skipped calls than in the baseline count as regression.
+#
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+import time
+
+from .SysexStream import load_sysex, iter_bank_patches
+
+ADAPTATION_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DATA_DIRECTORY = os.path.join(ADAPTATION_DIRECTORY, "testData")
+
+# Which adaptation can read which test file
+TEST_FILES = {
+    "Sequential Prophet X.py": ["PX_Programs_v2.0.syx"],
+    "DSI Prophet 12.py": ["P12_Programs_v1.1c.syx"],
+    "Sequential Prophet 6.py": ["P6_Programs_v1.01.syx"],
+    "Sequential Prophet 5 Rev4.py": ["P5_Factory_Programs_v1.02.syx"],
+    "DSI Pro 2.py": ["Pro_2_Programs_v1.0a.syx"],
+    "Sequential Pro 3.py": ["P3_Factory_Sounds_v1.01.syx"],
+    "DSI Prophet 08.py": ["Prophet_08_Programs_v1.0.syx"],
+    "DSI_Tetra.py": ["Tetra_ProgramsCombos_1.0.syx"],
+    "DSI_Mopho.py": ["Mopho_Programs_v1.0.syx"],
+    "DSI_Mopho_X4.py": ["Mopho_x4_AllBanks_V1.01.syx"],
+    "YamahaDX7.py": ["yamahaDX7-ROM2B.SYX"],
+    "YamahaDX7II.py": ["yamahaDX7II-STUDIOREINE BANK.syx"],
+    "ElectraOne.py": ["elektraOne-demo-preset.syx"],
+}
+
+BENCHMARKED_FUNCTIONS = ["nameFromDump", "calculateFingerprint", "renamePatch", "convertToEditBuffer",
+                         "convertToProgramDump", "extractPatchesFromBank"]
+
+
+def load_adaptation(filename):
+    module_name = "benchmark_" + os.path.splitext(filename)[0].replace(" ", "_")
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ADAPTATION_DIRECTORY, filename))
+    module = importlib.util.module_from_spec(spec)
+    # The GenericSequential based adaptations install themselves into sys.modules[__name__]
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _has(adaptation, function_name):
+    return hasattr(adaptation, function_name)
+
+
+def _is_patch(adaptation, message):
+    return (_has(adaptation, "isSingleProgramDump") and adaptation.isSingleProgramDump(message)) or \
+           (_has(adaptation, "isEditBufferDump") and adaptation.isEditBufferDump(message))
+
+
+def host_message(adaptation, message):
+    """The message in the form the C++ side hands it to the adaptation"""
+    if getattr(adaptation, "KNOBKRAFT_API", 1) >= 2:
+        return bytes(message)
+    return list(message)
+
+
+def collect_messages(adaptation, test_files):
+    """Returns the patches and the bank dump messages found in the test files"""
+    patches = []
+    banks = []
+    for test_file in test_files:
+        for message in load_sysex(os.path.join(TEST_DATA_DIRECTORY, test_file)):
+            message = host_message(adaptation, message)
+            if _has(adaptation, "isPartOfBankDump") and adaptation.isPartOfBankDump(message):
+                banks.append(message)
+                extracted = adaptation.extractPatchesFromBank(message)
+                if extracted:
+                    extracted = (host_message(adaptation, p) for _, p in iter_bank_patches(extracted))
+                    patches.extend(p for p in extracted if _is_patch(adaptation, p))
+            elif _is_patch(adaptation, message):
+                patches.append(message)
+    return patches, banks
+
+
+def _arguments(function_name, patches, banks):
+    # The message argument comes first, the other arguments are filled in for the call
+    if function_name == "renamePatch":
+        return [(m, (m, "Benchmark")) for m in patches]
+    if function_name == "convertToEditBuffer":
+        return [(m, (0, m)) for m in patches]
+    if function_name == "convertToProgramDump":
+        return [(m, (0, m, 1)) for m in patches]
+    if function_name == "extractPatchesFromBank":
+        return [(m, (m,)) for m in banks]
+    return [(m, (m,)) for m in patches]
+
+
+def _callable_with(function, arguments):
+    # Not every message is valid for every function, e.g. a DX7II bank contains performance data.
+    # Those are skipped, but counted so a function that suddenly fails does not go unnoticed
+    valid = []
+    skipped = 0
+    first_error = None
+    for message, args in arguments:
+        try:
+            function(*args)
+            valid.append((message, args))
+        except Exception as e:
+            skipped += 1
+            if first_error is None:
+                first_error = "%s: %s" % (type(e).__name__, e)
+    return valid, skipped, first_error
+
+
+def _consuming(function):
+    # extractPatchesFromBank may return a generator, which does its work only when iterated
+    def call(*args):
+        result = function(*args)
+        if result is not None and not isinstance(result, (list, tuple, bytes, bytearray)):
+            result = list(result)
+        return result
+    return call
+
+
+def time_function(function, arguments, min_time):
+    """Call the function with all arguments, repeated until min_time seconds have passed"""
+    calls = 0
+    elapsed = 0.0
+    data_bytes = 0
+    while elapsed < min_time:
+        start = time.perf_counter()
+        for _, args in arguments:
+            function(*args)
+        elapsed += time.perf_counter() - start
+        calls += len(arguments)
+        data_bytes += sum(len(message) for message, _ in arguments)
+    return {"calls": calls, "ops_per_sec": calls / elapsed, "bytes_per_sec": data_bytes / elapsed}
+
+
+def run_benchmarks(min_time=0.2, selected=None):
+    results = {}
+    for filename, test_files in TEST_FILES.items():
+        if selected and not any(s.lower() in filename.lower() for s in selected):
+            continue
+        adaptation = load_adaptation(filename)
+        patches, banks = collect_messages(adaptation, test_files)
+        timings = {}
+        for function_name in BENCHMARKED_FUNCTIONS:
+            if not _has(adaptation, function_name):
+                continue
+            function = getattr(adaptation, function_name)
+            if function_name == "extractPatchesFromBank":
+                function = _consuming(function)
+            arguments, skipped, first_error = _callable_with(function, _arguments(function_name, patches, banks))
+            if arguments:
+                timings[function_name] = time_function(function, arguments, min_time)
+            elif skipped:
+                timings[function_name] = {"calls": 0}
+            else:
+                continue
+            timings[function_name]["skipped"] = skipped
+            if first_error is not None:
+                timings[function_name]["error"] = first_error
+        results[adaptation.name()] = timings
+    return results
+
+
+def compare(baseline, results, tolerance):
+    """Returns a list of (adaptation, function, what happened) for everything that got slower than the tolerance
+    allows, fails on more messages than before, or was in the baseline and is not measured anymore"""
+    regressions = []
+    for adaptation, before_timings in baseline.items():
+        timings = results.get(adaptation)
+        if timings is None:
+            regressions.append((adaptation, None, "not benchmarked anymore"))
+            continue
+        for function_name, before in before_timings.items():
+            timing = timings.get(function_name)
+            if timing is None or "ops_per_sec" not in timing:
+                if "ops_per_sec" in before:
+                    error = (timing or {}).get("error")
+                    regressions.append((adaptation, function_name, "not measured anymore" + (": " + error if error else "")))
+                continue
+            if "ops_per_sec" in before and timing["ops_per_sec"] < before["ops_per_sec"] * (1.0 - tolerance):
+                regressions.append((adaptation, function_name, "%.0f -> %.0f calls/s" % (before["ops_per_sec"],
+                                                                                          timing["ops_per_sec"])))
+            if timing.get("skipped", 0) > before.get("skipped", 0):
+                regressions.append((adaptation, function_name, "skipped %d -> %d messages: %s" % (
+                    before.get("skipped", 0), timing["skipped"], timing.get("error"))))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the adaptations with the files in testData")
+    parser.add_argument("--output", help="write the results to this JSON file instead of stdout")
+    parser.add_argument("--baseline", help="compare against the results stored in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds to run each function at least")
+    parser.add_argument("adaptations", nargs="*", help="only run adaptations with file names containing these")
+    args = parser.parse_args(argv)
+
+    # Some adaptations print diagnostics, keep them out of the JSON on stdout
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = run_benchmarks(args.min_time, args.adaptations)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if args.adaptations:
+            # Only compare what was run
+            baseline = {adaptation: timings for adaptation, timings in baseline.items() if adaptation in results}
+        regressions = compare(baseline, results, args.tolerance)
+        for adaptation, function_name, what in regressions:
+            print("Regression in %s%s: %s" % (adaptation, " " + function_name if function_name else "", what),
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
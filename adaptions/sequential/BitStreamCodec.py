@@ -0,0 +1,208 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+
+#
+# Codec for the "rolling shift" format used e.g. by the Alesis Andromeda A6:
+# The 8 bit data is treated as one little endian bit stream, which is cut into 7 bit sysex bytes. So 7 data bytes
+# become 8 sysex bytes, the first sysex byte holds the lower 7 bits of the first data byte, the second one the
+# remaining bit of the first data byte plus the lower 6 bits of the second data byte and so on.
+#
+# Like the MSBitCodec, the groups of 7/8 bytes are processed column-wise with precomputed translation tables instead of
+# computing shift masks for every single byte. If NumPy is installed, large blocks are vectorized with it.
+#
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Blocks smaller than this are faster without the NumPy setup overhead
+NUMPY_THRESHOLD = 8192
+
+# Decoding: data byte j of a group is (sysex[j] >> j) | (sysex[j + 1] << (7 - j)), cut to 8 bits
+_DECODE_LOW = tuple(bytes((x & 0x7f) >> j for x in range(256)) for j in range(7))
+_DECODE_HIGH = tuple(bytes(((x & 0x7f) << (7 - j)) & 0xff for x in range(256)) for j in range(7))
+
+# Encoding: sysex byte k of a group is (data[k - 1] >> (8 - k)) | (data[k] << k), cut to 7 bits
+_ENCODE_LOW = tuple(bytes((x >> (8 - k)) & 0x7f for x in range(256)) for k in range(8))
+_ENCODE_HIGH = tuple(bytes((x << k) & 0x7f for x in range(256)) for k in range(8))
+
+if numpy is not None:
+    _SHIFTS = numpy.arange(7, dtype=numpy.uint8)
+
+
+def _as_bytes(data):
+    if isinstance(data, (bytes, bytearray)):
+        return data
+    return bytes(data)
+
+
+def _or_bytes(a, b):
+    # Both operands have the same length
+    return (int.from_bytes(a, 'big') | int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+
+def unpack(data):
+    """Decode 7 bit rolling shift data (list, bytes or memoryview) into the 8 bit payload, returned as bytes"""
+    src = _as_bytes(data)
+    length = len(src) * 7 // 8
+    if numpy is not None and len(src) >= NUMPY_THRESHOLD:
+        return _unpack_numpy(src, length)
+    result = bytearray(length)
+    for j in range(7):
+        high = src[j + 1::8]
+        low = src[j::8][:len(high)]
+        if high:
+            result[j::7] = _or_bytes(low.translate(_DECODE_LOW[j]), high.translate(_DECODE_HIGH[j]))
+    return bytes(result)
+
+
+def pack(data):
+    """Encode 8 bit data (list, bytes or memoryview) into the 7 bit rolling shift format, returned as bytes"""
+    src = _as_bytes(data)
+    if len(src) == 0:
+        # The original implementation always flushed a last byte, even for empty input
+        return b'\x00'
+    length = (len(src) * 8 + 6) // 7
+    if numpy is not None and len(src) >= NUMPY_THRESHOLD:
+        return _pack_numpy(src, length)
+    result = bytearray(length)
+    result[0::8] = src[0::7].translate(_ENCODE_HIGH[0])
+    for k in range(1, 8):
+        low = src[k - 1::7].translate(_ENCODE_LOW[k])
+        high = src[k::7].translate(_ENCODE_HIGH[k])
+        result[k::8] = _or_bytes(low, high + bytes(len(low) - len(high)))
+    return bytes(result)
+
+
+def _unpack_numpy(src, length):
+    groups = (len(src) + 7) // 8
+    blocks = numpy.zeros((groups, 8), dtype=numpy.uint8)
+    blocks.reshape(-1)[:len(src)] = numpy.frombuffer(src, dtype=numpy.uint8)
+    blocks &= 0x7f
+    result = (blocks[:, :7] >> _SHIFTS) | (blocks[:, 1:] << (7 - _SHIFTS))
+    return result.reshape(-1)[:length].tobytes()
+
+
+def _pack_numpy(src, length):
+    groups = (len(src) + 6) // 7
+    blocks = numpy.zeros((groups, 7), dtype=numpy.uint8)
+    blocks.reshape(-1)[:len(src)] = numpy.frombuffer(src, dtype=numpy.uint8)
+    result = numpy.zeros((groups, 8), dtype=numpy.uint8)
+    result[:, :7] = (blocks << _SHIFTS) & 0x7f
+    result[:, 1:] |= blocks >> (7 - _SHIFTS)
+    return result.reshape(-1)[:length].tobytes()
+
+
+#
+# Random access: Both directions work in groups of 7 data bytes <-> 8 sysex bytes, so a range of the payload can be
+# decoded or replaced by touching only the groups covering it, e.g. to read or change a patch name
+#
+def unpack_range(data, start, length, offset=0, stop=None):
+    """Decode only the payload bytes start to start + length from the packed data in data[offset:stop], e.g. the data
+    block of a sysex message. Only the groups covering the range are sliced out of data"""
+    if stop is None:
+        stop = len(data)
+    first, last = start // 7, (start + length + 6) // 7
+    position = start - first * 7
+    return unpack(data[offset + first * 8:min(offset + last * 8, stop)])[position:position + length]
+
+
+def pack_range(data, start, replacement, offset=0, stop=None):
+    """Return a copy of data as bytearray, with the payload bytes from start on of the packed data in data[offset:stop]
+    replaced by the replacement bytes. Only the groups covering the replaced range are re-encoded, all other bytes,
+    e.g. the header and the 0xf7 of a sysex message, are copied unchanged"""
+    result = bytearray(data)
+    if stop is None:
+        stop = len(result)
+    first, last = start // 7, (start + len(replacement) + 6) // 7
+    begin, end = offset + first * 8, min(offset + last * 8, stop)
+    group = bytearray(unpack(result[begin:end]))
+    position = start - first * 7
+    group[position:position + len(replacement)] = replacement
+    result[begin:end] = pack(group)
+    return result
+
+
+#
+# List compatible API, drop in replacement for the unescapeSysex/escapeSysex functions found in the adaptations
+#
+def unescapeSysex(sysex):
+    return list(unpack(sysex))
+
+
+def escapeSysex(data):
+    return list(pack(data))
+
+
+if __name__ == "__main__":
+    # This is the implementation the Andromeda A6 adaptation used originally, we must stay byte compatible
+    def reference_unescape(data):
+        result = []
+        roll_over = 0
+        i = 0
+        while i < len(data) - 1:
+            mask1 = (0xFF << roll_over) & 0x7F
+            mask2 = 0xFF >> (7 - roll_over)
+            result.append((data[i] & mask1) >> roll_over | (data[i + 1] & mask2) << (7 - roll_over))
+            roll_over = (roll_over + 1) % 7
+            i = i + 1
+            if roll_over == 0:
+                i = i + 1
+        return result
+
+    def reference_escape(data):
+        result = []
+        roll_over = 7
+        previous = 0
+        i = 0
+        while i < len(data):
+            mask1 = 0xFF >> (8 - roll_over)
+            mask2 = 0xFF >> roll_over << roll_over
+            if mask1 > 0:
+                result.append(((data[i] & mask1) << (7 - roll_over)) | previous)
+                previous = (data[i] & mask2) >> roll_over
+                roll_over = roll_over - 1
+                i = i + 1
+            else:
+                result.append(previous)
+                previous = 0
+                roll_over = 7
+        result.append(previous)
+        return result
+
+    import random
+    for size in list(range(20)) + [2341, 8192, 9000]:
+        test_data = [random.randrange(256) for _ in range(size)]
+        escaped = escapeSysex(test_data)
+        assert escaped == reference_escape(test_data)
+        assert unescapeSysex(escaped) == test_data
+        assert unescapeSysex(escaped) == reference_unescape(escaped)
+        test_sysex = [random.randrange(128) for _ in range(size)]
+        assert unescapeSysex(test_sysex) == reference_unescape(test_sysex)
+        assert unpack(memoryview(bytes(test_sysex))) == bytes(reference_unescape(test_sysex))
+
+    test_data = bytes(random.randrange(256) for _ in range(500))
+    packed = pack(test_data)
+    for start, length in [(0, 7), (3, 20), (418, 20), (480, 20), (499, 1), (100, 0)]:
+        assert unpack_range(packed, start, length) == test_data[start:start + length]
+        assert unpack_range(memoryview(packed), start, length) == test_data[start:start + length]
+        replacement = bytes(random.randrange(256) for _ in range(length))
+        expected = test_data[:start] + replacement + test_data[start + length:]
+        assert pack_range(packed, start, replacement) == pack(expected)
+        assert pack_range(list(packed), start, replacement) == pack(expected)
+        message = [0xf0, 0x01, 0x2a, 0x03] + list(packed) + [0xf7]
+        assert unpack_range(message, start, length, 4, len(message) - 1) == test_data[start:start + length]
+        assert pack_range(message, start, replacement, 4, len(message) - 1) == bytes(message[:4]) + pack(expected) + b'\xf7'
+
+    import timeit
+    test_data = [random.randrange(256) for _ in range(2341)]
+    escaped = reference_escape(test_data)
+    before = timeit.timeit(lambda: reference_unescape(escaped), number=100)
+    after = timeit.timeit(lambda: unescapeSysex(escaped), number=100)
+    print("unescape A6 program: %.2f ms -> %.2f ms" % (before * 10, after * 10))
+    before = timeit.timeit(lambda: reference_escape(test_data), number=100)
+    after = timeit.timeit(lambda: escapeSysex(test_data), number=100)
+    print("escape A6 program: %.2f ms -> %.2f ms" % (before * 10, after * 10))
@@ -0,0 +1,327 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+
+#
+# Shared codec for the Yamaha DX7 voice formats, used by the DX7 and DX7II adaptations: The 32 voice bulk dump
+# (format 9) stores each voice packed into 128 bytes, while a single voice dump (format 0) has 155 bytes.
+#
+# Every unpacked byte is one bit field of one packed byte. Instead of decoding voice by voice, the bits are moved for
+# all voices of a block at once, one column of the output per step: the source column is a strided slice of the
+# packed data, a translation table does the shift and mask. If NumPy is installed, all columns are gathered in one go,
+# which is faster already for a single voice.
+#
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+VOICE_SIZE = 155
+PACKED_VOICE_SIZE = 128
+VOICES_PER_BANK = 32
+
+SINGLE_VOICE_HEADER = bytes([0xf0, 0x43, 0x00, 0x00, 0x01, 0x1b])
+SINGLE_VOICE_DUMP_SIZE = len(SINGLE_VOICE_HEADER) + VOICE_SIZE + 2
+BANK_HEADER = bytes([0xf0, 0x43, 0x00, 0x09, 0x20, 0x00])
+
+# The INIT VOICE of the DX7, used to fill up banks with less than 32 voices
+_INIT_OPERATOR = [99, 99, 99, 99, 99, 99, 99, 0, 39, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 7]
+INIT_VOICE = bytes(_INIT_OPERATOR * 5 + _INIT_OPERATOR[:16] + [99] + _INIT_OPERATOR[17:]
+                   + [99, 99, 99, 99, 50, 50, 50, 50, 0, 0, 1, 35, 0, 0, 0, 1, 0, 3, 24]) + b'INIT VOICE'
+
+
+def _voice_layout():
+    # For each of the 155 bytes of a single voice: (offset of the packed byte, shift, mask), the operators start with
+    # operator 6 in both formats
+    layout = []
+    for operator in range(6):
+        base = operator * 17
+        layout.extend((base + i, 0, 0xff) for i in range(11))  # Rates, levels, break point, scaling depths
+        layout.extend([(base + 11, 0, 0x03),  # Left curve
+                       (base + 11, 2, 0x03),  # Right curve
+                       (base + 12, 0, 0x07),  # Rate scaling
+                       (base + 13, 0, 0x03),  # Amplitude modulation sensitivity
+                       (base + 13, 2, 0x07),  # Key velocity sensitivity
+                       (base + 14, 0, 0xff),  # Output level
+                       (base + 15, 0, 0x01),  # Oscillator mode
+                       (base + 15, 1, 0x1f),  # Frequency coarse
+                       (base + 16, 0, 0xff),  # Frequency fine
+                       (base + 12, 3, 0x0f)])  # Detune
+    layout.extend((102 + i, 0, 0xff) for i in range(8))  # Pitch envelope
+    layout.extend([(110, 0, 0x1f),  # Algorithm
+                   (111, 0, 0x07),  # Feedback
+                   (111, 3, 0x01)])  # Oscillator key sync
+    layout.extend((112 + i, 0, 0xff) for i in range(4))  # LFO speed, delay, pitch and amplitude modulation depth
+    layout.extend([(116, 0, 0x01),  # LFO sync
+                   (116, 1, 0x07),  # LFO wave
+                   (116, 4, 0x0f),  # Pitch modulation sensitivity
+                   (117, 0, 0xff)])  # Transpose
+    layout.extend((118 + i, 0, 0xff) for i in range(10))  # Name
+    return layout
+
+
+_LAYOUT = _voice_layout()
+assert len(_LAYOUT) == VOICE_SIZE
+
+_UNPACK_TABLES = tuple(bytes((x >> shift) & mask for x in range(256)) for _, shift, mask in _LAYOUT)
+
+# The reverse direction: for each of the 155 bytes, its bits shifted into place in the packed byte
+_PACK_TABLES = tuple(bytes(((x & mask) << shift) & 0xff for x in range(256)) for _, shift, mask in _LAYOUT)
+_PACK_SOURCES = tuple(tuple(column for column, (source, _, _) in enumerate(_LAYOUT) if source == packed_offset)
+                      for packed_offset in range(PACKED_VOICE_SIZE))
+
+if numpy is not None:
+    _SOURCE = numpy.array([source for source, _, _ in _LAYOUT], dtype=numpy.intp)
+    _SHIFT = numpy.array([shift for _, shift, _ in _LAYOUT], dtype=numpy.uint8)
+    _MASK = numpy.array([mask for _, _, mask in _LAYOUT], dtype=numpy.uint8)
+
+
+def _as_buffer(data):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+    return bytes(data)
+
+
+def checksum(data):
+    """The Yamaha bulk dump checksum, the two's complement of the sum of the data, lower 7 bits"""
+    return -sum(_as_buffer(data)) & 0x7f
+
+
+def single_voice_dumps(packed, channel=0):
+    """Unpack any number of voices (128 bytes each, e.g. the data block of a 32 voice bulk dump, or many of them
+    concatenated) into single voice dump messages including their checksums. Returns one bytearray with all
+    messages concatenated, each SINGLE_VOICE_DUMP_SIZE bytes long"""
+    src = _as_buffer(packed)
+    if len(src) % PACKED_VOICE_SIZE != 0:
+        raise Exception("Packed voice data must be a multiple of %d bytes long" % PACKED_VOICE_SIZE)
+    voices = len(src) // PACKED_VOICE_SIZE
+    header = bytearray(SINGLE_VOICE_HEADER)
+    header[2] = channel & 0x0f
+    if numpy is not None:
+        return _single_voice_dumps_numpy(src, voices, bytes(header))
+    result = bytearray((bytes(header) + bytes(VOICE_SIZE) + b'\x00\xf7') * voices)
+    start = len(header)
+    for column, (source, _, _) in enumerate(_LAYOUT):
+        result[start + column::SINGLE_VOICE_DUMP_SIZE] = src[source::PACKED_VOICE_SIZE].translate(_UNPACK_TABLES[column])
+    for voice in range(voices):
+        data_start = voice * SINGLE_VOICE_DUMP_SIZE + start
+        result[data_start + VOICE_SIZE] = -sum(result[data_start:data_start + VOICE_SIZE]) & 0x7f
+    return result
+
+
+def _single_voice_dumps_numpy(src, voices, header):
+    packed = numpy.frombuffer(src, dtype=numpy.uint8).reshape(voices, PACKED_VOICE_SIZE)
+    result = numpy.empty((voices, SINGLE_VOICE_DUMP_SIZE), dtype=numpy.uint8)
+    result[:, :len(header)] = numpy.frombuffer(header, dtype=numpy.uint8)
+    unpacked = result[:, len(header):len(header) + VOICE_SIZE]
+    numpy.bitwise_and(packed[:, _SOURCE] >> _SHIFT, _MASK, out=unpacked)
+    result[:, -2] = (-unpacked.sum(axis=1, dtype=numpy.int64)) & 0x7f
+    result[:, -1] = 0xf7
+    return bytearray(result.tobytes())
+
+
+def split_single_voice_dumps(dumps):
+    """Split the result of single_voice_dumps into a list of messages as bytes"""
+    return [bytes(dumps[i:i + SINGLE_VOICE_DUMP_SIZE]) for i in range(0, len(dumps), SINGLE_VOICE_DUMP_SIZE)]
+
+
+def pack_voices(voices):
+    """The reverse of the unpacking, pack any number of 155 byte voices (concatenated) into 128 bytes each"""
+    src = _as_buffer(voices)
+    if len(src) % VOICE_SIZE != 0:
+        raise Exception("Voice data must be a multiple of %d bytes long" % VOICE_SIZE)
+    count = len(src) // VOICE_SIZE
+    result = bytearray(count * PACKED_VOICE_SIZE)
+    if count == 0:
+        return result
+    for packed_offset, columns in enumerate(_PACK_SOURCES):
+        # Or the bit fields of all voices together, using big integers as bit vectors
+        packed = 0
+        for column in columns:
+            packed |= int.from_bytes(src[column::VOICE_SIZE].translate(_PACK_TABLES[column]), 'big')
+        result[packed_offset::PACKED_VOICE_SIZE] = packed.to_bytes(count, 'big')
+    return result
+
+
+def bank_dump(voices, channel=0):
+    """Create a 32 voice bulk dump message (format 9) from a list of up to 32 voices of 155 bytes each. Missing voices
+    are filled up with the INIT VOICE. Returns the message as bytearray"""
+    if len(voices) > VOICES_PER_BANK:
+        raise Exception("A bank can hold only %d voices, got %d" % (VOICES_PER_BANK, len(voices)))
+    data = pack_voices(b''.join(_as_buffer(voice) for voice in voices) + INIT_VOICE * (VOICES_PER_BANK - len(voices)))
+    result = bytearray(BANK_HEADER)
+    result[2] = channel & 0x0f
+    result += data
+    result.append(checksum(data))
+    result.append(0xf7)
+    return result
+
+
+#
+# The universal bulk dump of the DX7II and DX7s (F0 43 0n 7E ...) carries one or more data blocks, each with its
+# length, a 10 character header naming its classification and data format, and a checksum
+#
+def iter_universal_bulk_dump(message):
+    """Generator yielding (classification, data format, data) for each block of a universal bulk dump, with data a
+    memoryview of the block after its header. All checksums are verified before the first block is yielded, an
+    exception is raised for truncated data or a wrong checksum"""
+    data = _as_buffer(message)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    blocks = []
+    position = 4
+    while position + 1 < len(data) and data[position] != 0xf7:
+        start = position + 2
+        end = start + ((data[position] << 7) | data[position + 1])
+        if end >= len(data):
+            raise Exception("Corrupted data - data block in universal bulk dump doesn't contain enough data")
+        blocks.append((start, end))
+        position = end + 1
+    for (start, end), block_sum in zip(blocks, _block_sums(data, blocks)):
+        # With a correct checksum, data and checksum add up to 0 in the lower 7 bits
+        if (block_sum + data[end]) & 0x7f:
+            raise Exception("Corrupted data - invalid checksum in universal bulk dump.")
+    view = memoryview(data)
+    for start, end in blocks:
+        yield data[start:start + 4].decode("latin-1"), data[start + 4:start + 10].decode("latin-1"), view[start + 10:end]
+
+
+def _block_sums(data, blocks):
+    if numpy is not None and blocks:
+        # One pass over the message, each block sum is then the difference of two prefix sums
+        prefix = numpy.concatenate(([0], numpy.cumsum(numpy.frombuffer(data, dtype=numpy.uint8), dtype=numpy.int64)))
+        return [int(prefix[end] - prefix[start]) for start, end in blocks]
+    return [sum(data[start:end]) for start, end in blocks]
+
+
+if __name__ == "__main__":
+    from ctypes import Structure, c_uint8
+
+    class OPERATOR_PACKED(Structure):
+        _pack_ = 1
+        _fields_ = [
+            ("first_section", c_uint8 * 11),
+            ("scale_left_curve", c_uint8, 2),
+            ("scale_right_curve", c_uint8, 2),
+            ("unused1", c_uint8, 4),
+            ("rate_scale", c_uint8, 3),
+            ("detune", c_uint8, 4),
+            ("unused2", c_uint8, 1),
+            ("amp_mod_sensivity", c_uint8, 2),
+            ("key_vel_sensivity", c_uint8, 3),
+            ("unused3", c_uint8, 3),
+            ("output_level", c_uint8),
+            ("osc_mode", c_uint8, 1),
+            ("freq_coarse", c_uint8, 5),
+            ("unused4", c_uint8, 2),
+            ("freq_fine", c_uint8),
+        ]
+
+    class VOICE_PACKED(Structure):
+        _pack_ = 1
+        _fields_ = [
+            ("operators", OPERATOR_PACKED * 6),
+            ("envs", c_uint8 * 8),
+            ("algorithm", c_uint8, 5),
+            ("unused1", c_uint8, 3),
+            ("feedback", c_uint8, 3),
+            ("osc_key_sync", c_uint8, 1),
+            ("unused1", c_uint8, 4),
+            ("lfo", c_uint8 * 4),
+            ("lfo_sync", c_uint8, 1),
+            ("lfo_wave", c_uint8, 3),
+            ("lfo_pitch_mod_sens", c_uint8, 4),
+            ("transpose", c_uint8),
+            ("name", c_uint8 * 10)
+        ]
+
+    def reference_unpack(packed):
+        source = VOICE_PACKED.from_buffer_copy(bytearray(packed))
+        dest = []
+        for op in source.operators:
+            dest += op.first_section
+            dest += [op.scale_left_curve, op.scale_right_curve, op.rate_scale, op.amp_mod_sensivity,
+                     op.key_vel_sensivity, op.output_level, op.osc_mode, op.freq_coarse, op.freq_fine, op.detune]
+        dest += source.envs
+        dest += [source.algorithm, source.feedback, source.osc_key_sync]
+        dest += source.lfo
+        dest += [source.lfo_sync, source.lfo_wave, source.lfo_pitch_mod_sens, source.transpose]
+        dest += source.name
+        return dest
+
+    def reference_dumps(packed):
+        result = []
+        for i in range(len(packed) // PACKED_VOICE_SIZE):
+            voice = reference_unpack(packed[i * PACKED_VOICE_SIZE:(i + 1) * PACKED_VOICE_SIZE])
+            result.append(list(SINGLE_VOICE_HEADER) + voice + [checksum(voice), 0xf7])
+        return result
+
+    import random
+    with_numpy = numpy
+    for voices in [0, 1, 32, 1024]:
+        test_data = bytes(random.randrange(256) for _ in range(voices * PACKED_VOICE_SIZE))
+        expected = reference_dumps(test_data)
+        # Both with and without NumPy
+        for numpy in {with_numpy, None}:
+            assert [list(m) for m in split_single_voice_dumps(single_voice_dumps(test_data))] == expected
+            assert [list(m) for m in split_single_voice_dumps(single_voice_dumps(list(test_data)))] == expected
+        numpy = with_numpy
+    assert single_voice_dumps(bytes(PACKED_VOICE_SIZE), channel=5)[2] == 5
+
+    # Packing is the reverse, apart from the unused bits which are lost
+    assert len(INIT_VOICE) == VOICE_SIZE
+    for voices in [0, 1, 32, 100]:
+        test_data = bytes(random.randrange(128) for _ in range(voices * PACKED_VOICE_SIZE))
+        unpacked = b''.join(m[6:6 + VOICE_SIZE] for m in split_single_voice_dumps(single_voice_dumps(test_data)))
+        assert single_voice_dumps(pack_voices(unpacked)) == single_voice_dumps(test_data)
+        assert pack_voices(list(unpacked)) == pack_voices(unpacked)
+    bank = bank_dump([INIT_VOICE], channel=2)
+    assert len(bank) == len(BANK_HEADER) + VOICES_PER_BANK * PACKED_VOICE_SIZE + 2
+    assert bank[2] == 2 and bank[-1] == 0xf7 and (sum(bank[6:-1]) & 0x7f) == 0
+    assert all(m[6:6 + VOICE_SIZE] == INIT_VOICE for m in split_single_voice_dumps(single_voice_dumps(bank[6:-2])))
+
+    def reference_blocks(message):
+        blocks = []
+        read_ptr = 4
+        while read_ptr < len(message) and message[read_ptr] != 0xf7:
+            data_len = (message[read_ptr] << 7) | message[read_ptr + 1]
+            read_ptr += 2
+            data_block = message[read_ptr:read_ptr + data_len]
+            read_ptr += data_len
+            assert len(data_block) == data_len
+            assert message[read_ptr] == checksum(data_block)
+            read_ptr += 1
+            blocks.append(data_block)
+        return blocks
+
+    def universal_bulk_dump(blocks):
+        message = [0xf0, 0x43, 0x00, 0x7e]
+        for block in blocks:
+            message += [len(block) >> 7, len(block) & 0x7f] + list(block) + [checksum(block)]
+        return message + [0xf7]
+
+    test_blocks = [b'LM  8973S ' + bytes(random.randrange(128) for _ in range(85)),
+                   b'LM  8973PM' + bytes(random.randrange(128) for _ in range(1630)), b'LM  8973PM']
+    test_message = universal_bulk_dump(test_blocks)
+    expected = [(bytes(b[:4]).decode(), bytes(b[4:10]).decode(), b[10:]) for b in reference_blocks(test_message)]
+    for numpy in {with_numpy, None}:
+        assert [(c, f, list(b)) for c, f, b in iter_universal_bulk_dump(test_message)] == expected
+        assert [(c, f, list(b)) for c, f, b in iter_universal_bulk_dump(bytes(test_message))] == expected
+        for broken in [test_message[:-3] + [0xf7], test_message[:100] + [test_message[100] ^ 1] + test_message[101:]]:
+            try:
+                list(iter_universal_bulk_dump(broken))
+                assert False
+            except Exception as e:
+                assert str(e).startswith("Corrupted data")
+    numpy = with_numpy
+
+    import timeit
+    bank = bytes(random.randrange(128) for _ in range(VOICES_PER_BANK * PACKED_VOICE_SIZE))
+    before = timeit.timeit(lambda: reference_dumps(bank), number=20)
+    after = timeit.timeit(lambda: single_voice_dumps(bank), number=20)
+    print("unpack bank: %.2f ms -> %.2f ms" % (before * 50, after * 50))
+    archive = bank * 1000
+    after = timeit.timeit(lambda: single_voice_dumps(archive), number=1)
+    print("unpack 1000 banks: %.1f ms" % (after * 1000))
@@ -4,6 +4,10 @@
 #   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
 #
 import hashlib
+from collections import namedtuple
+
+from . import MSBitCodec
+from .PayloadCache import PayloadCache, DecodedMessage, message_digest
 
 
 # Documenting the Sequential/DSI device_IDs here for all sequential modules
@@ -23,6 +27,24 @@ import hashlib
 # Prophet 5  - 0b00110010 0x32 (this is the Rev 4 of course)
 # Take 5     -            0x35 (they left 2 empty - maybe the desktop Prophet 5 and...?)
 
+EDIT_BUFFER = "edit_buffer"
+PROGRAM_DUMP = "program_dump"
+
+# Result of GenericSequential.classify(). Bank and program are None for edit buffers
+Classification = namedtuple("Classification", ["kind", "header_len", "bank", "program"])
+
+
+def _merge_zones(zones):
+    # Sort the (position, length) blank out zones and merge overlapping ones into (start, end, zero block) triples
+    merged = []
+    for position, length in sorted(zone for zone in zones if zone[1] > 0):
+        if merged and position <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], position + length)
+        else:
+            merged.append([position, position + length])
+    return [(start, end, bytes(end - start)) for start, end in merged]
+
+
 class GenericSequential:
 
     def __init__(self, name, device_id, banks, patches_per_bank,
@@ -30,7 +52,8 @@ class GenericSequential:
                  name_position=0,
                  file_version=None,
                  id_list=None,
-                 blank_out_zones=None):
+                 blank_out_zones=None,
+                 cache_size=256):
         self.__id = device_id
         self.__name = name
         if id_list is None:
@@ -46,6 +69,11 @@ class GenericSequential:
             self.__blank_out_zones = [(name_position, name_len)]
         else:
             self.__blank_out_zones = blank_out_zones + [(name_position, name_len)]
+        self.__fingerprint_zones = _merge_zones(self.__blank_out_zones)
+        # Precalculate the message layout for classify(), the Evolver style messages carry the file version at index 3
+        self.__ids = frozenset(self.__id_list)
+        self.__command_index = 3 if file_version is None else 4
+        self.__cache = PayloadCache(cache_size)
 
     def name(self):
         return self.__name
@@ -92,12 +120,8 @@ class GenericSequential:
             return [0xf0, 0x01, self.__id, self.__file_version, 0b00000110, 0xf7]
 
     def isEditBufferDump(self, message):
-        return (len(message) > 3
-                and message[0] == 0xf0
-                and message[1] == 0x01  # Sequential
-                and message[2] in self.__id_list
-                and (self.__file_version is None and message[3] == 0b00000011  # Edit Buffer Data
-                     or message[3] == self.__file_version and message[4] == 0b00000011))  # Edit Buffer Data
+        classification = self.classify(message)
+        return classification is not None and classification.kind == EDIT_BUFFER
 
     def numberOfBanks(self):
         return self.__banks
@@ -116,96 +140,141 @@ class GenericSequential:
             return [0xf0, 0x01, self.__id, self.__file_version, 0b00000101, bank, program, 0xf7]
 
     def isSingleProgramDump(self, message):
-        return (len(message) > 3
+        classification = self.classify(message)
+        return classification is not None and classification.kind == PROGRAM_DUMP
+
+    def classify(self, message):
+        # Check the header of the message only once, returning what kind of message it is and where the data starts.
+        # Returns None if the message is neither an edit buffer nor a program dump of this synth
+        command_index = self.__command_index
+        if (len(message) > command_index
                 and message[0] == 0xf0
                 and message[1] == 0x01  # Sequential
-                and message[2] in self.__id_list
-                and (self.__file_version is None and message[3] == 0b00000010  # Program Data
-                     or message[3] == self.__file_version and message[4] == 0b00000010))  # Program Data
+                and message[2] in self.__ids
+                and (self.__file_version is None or message[3] == self.__file_version)):
+            command = message[command_index]
+            if command == 0b00000011:  # Edit Buffer Data
+                return Classification(EDIT_BUFFER, command_index + 1, None, None)
+            elif command == 0b00000010:  # Program Data
+                if len(message) > command_index + 2:
+                    return Classification(PROGRAM_DUMP, command_index + 3,
+                                          message[command_index + 1], message[command_index + 2])
+                return Classification(PROGRAM_DUMP, command_index + 3, None, None)
+        return None
 
     def nameFromDump(self, message):
-        dataBlock = self.getDataBlock(message)
-        if len(dataBlock) > 0:
-            patchData = self.unescapeSysex(dataBlock)
-            layer_a_name = ''.join(
-                [chr(x) for x in patchData[self.__name_position:self.__name_position + self.__name_len]]).strip()
+        decoded = self.__cache.get(message_digest(message))
+        if decoded is not None:
+            # Decoded already, e.g. for the fingerprint
+            return self.__nameFromPayload(decoded.payload)
+        header_len = self.headerLen(message)
+        stop = len(message) - 1
+        if stop > header_len:
+            # Only unescape the few MS bit groups containing the name, not the whole patch
+            patchData = MSBitCodec.unpack_range(message, self.__name_position, self.__name_len, header_len, stop)
+            layer_a_name = ''.join([chr(x) for x in patchData]).strip()
             return layer_a_name
         return "Invalid"
 
+    def __nameFromPayload(self, payload):
+        if len(payload) > 0:
+            return ''.join([chr(x) for x in payload[self.__name_position:self.__name_position + self.__name_len]]).strip()
+        return "Invalid"
+
     def convertToEditBuffer(self, channel, message):
-        if self.isEditBufferDump(message):
-            return message
-        elif self.isSingleProgramDump(message):
+        classification = self.classify(message)
+        if classification is not None:
+            if classification.kind == EDIT_BUFFER:
+                return message
             # Have to strip out bank and program, and set command to edit buffer dump
-            return message[0:3 + self.extraOffset()] + [0b00000011] + message[6 + self.extraOffset():]
+            return message[0:self.__command_index] + [0b00000011] + message[classification.header_len:]
         raise Exception("Neither edit buffer nor program dump - can't be converted")
 
     def convertToProgramDump(self, channel, message, program_number):
         bank = program_number // self.numberOfPatchesPerBank()
         program = program_number % self.numberOfPatchesPerBank()
-        if self.isEditBufferDump(message):
-            return message[0:3 + self.extraOffset()] + [0b00000010] + [bank, program] + message[4 + self.extraOffset():]
-        elif self.isSingleProgramDump(message):
-            return message[0:3 + self.extraOffset()] + [0b00000010] + [bank, program] + message[6 + self.extraOffset():]
+        classification = self.classify(message)
+        if classification is not None:
+            return message[0:self.__command_index] + [0b00000010] + [bank, program] \
+                   + message[classification.header_len:]
         raise Exception("Neither edit buffer nor program dump - can't be converted")
 
     def calculateFingerprint(self, message):
-        raw = self.getDataBlock(message)
-        data = self.unescapeSysex(raw)
-        # Blank out all blank out zones, normally this is the name (or layer names)
-        for zone in self.__blank_out_zones:
-            data[zone[0]:zone[0] + zone[1]] = [0] * zone[1]
-        return hashlib.md5(bytearray(data)).hexdigest()  # Calculate the fingerprint from the cleaned payload data
+        return self.__fingerprintFromPayload(self.decode(message).payload)
+
+    def __fingerprintFromPayload(self, payload):
+        if self.__fingerprint_zones and self.__fingerprint_zones[-1][1] > len(payload):
+            # Blank out zone outside of the data, use the old way to make sure we get the same fingerprint as before
+            data = bytearray(payload)
+            for zone in self.__blank_out_zones:
+                data[zone[0]:zone[0] + zone[1]] = bytes(zone[1])
+            return hashlib.md5(data).hexdigest()
+        # Feed the payload into the hash piece by piece, replacing the blank out zones (normally the name or layer
+        # names) with zeros. This gives the same digest as blanking out a copy of the data, without making that copy
+        view = memoryview(payload)
+        md5 = hashlib.md5()
+        position = 0
+        for start, end, zeros in self.__fingerprint_zones:
+            md5.update(view[position:start])
+            md5.update(zeros)
+            position = end
+        md5.update(view[position:])
+        return md5.hexdigest()  # Calculate the fingerprint from the cleaned payload data
 
     def renamePatch(self, message, new_name):
         header_len = self.headerLen(message)
-        data = self.unescapeSysex(message[header_len:-1])
-        for i in range(self.__name_len):
-            data[self.__name_position + i] = ord(new_name[i]) if i < len(new_name) else ord(' ')
-        return message[:header_len] + self.escapeSysex(data) + [0xf7]
+        name = bytes(ord(new_name[i]) if i < len(new_name) else ord(' ') for i in range(self.__name_len))
+        # Re-escape only the MS bit groups covering the name and splice them into a copy of the message
+        return MSBitCodec.pack_range(message, self.__name_position, name, header_len, len(message) - 1)
+
+    def decode(self, message):
+        # Classify and unescape the whole message only once, the host tends to call several functions on the same
+        # message. Name and rename of a message not decoded yet only touch the MS bit groups of the name instead
+        key = message_digest(message)
+        decoded = self.__cache.get(key)
+        if decoded is None:
+            classification = self.classify(message)
+            if classification is None:
+                raise Exception("Can only work on edit buffer or single program dumps")
+            header_len = classification.header_len
+            decoded = DecodedMessage(classification.kind, header_len, MSBitCodec.unpack(message[header_len:-1]))
+            self.__cache.put(key, decoded)
+        return decoded
+
+    def cacheStatistics(self):
+        return self.__cache.statistics()
+
+    #
+    # Batch variants of the functions above. The host can hand in a whole list of messages, paying for the transition
+    # into Python only once
+    #
+    def nameFromDumps(self, messages):
+        # Decode the messages completely into the shared cache, as the host asks for the fingerprints of the same
+        # messages next. Those are then answered from the cache, and so are the single calls for these messages
+        return [self.__nameFromPayload(self.decode(message).payload) for message in messages]
+
+    def calculateFingerprints(self, messages):
+        return [self.__fingerprintFromPayload(self.decode(message).payload) for message in messages]
 
     def getDataBlock(self, message):
         return message[self.headerLen(message):-1]
 
     def headerLen(self, message):
-        if self.isEditBufferDump(message):
-            return 4 + self.extraOffset()
-        elif self.isSingleProgramDump(message):
-            return 6 + self.extraOffset()
-        else:
+        classification = self.classify(message)
+        if classification is None:
             raise Exception("Can only work on edit buffer or single program dumps")
+        return classification.header_len
 
     def extraOffset(self):
         return 0 if self.__file_version is None else 1
 
     @staticmethod
     def unescapeSysex(sysex):
-        result = []
-        dataIndex = 0
-        while dataIndex < len(sysex):
-            msbits = sysex[dataIndex]
-            dataIndex += 1
-            for i in range(7):
-                if dataIndex < len(sysex):
-                    result.append(sysex[dataIndex] | ((msbits & (1 << i)) << (7 - i)))
-                dataIndex += 1
-        return result
+        return MSBitCodec.unescapeSysex(sysex)
 
     @staticmethod
     def escapeSysex(data):
-        result = []
-        dataIndex = 0
-        while dataIndex < len(data):
-            ms_bits = 0
-            for i in range(7):
-                if dataIndex + i < len(data):
-                    ms_bits = ms_bits | ((data[dataIndex + i] & 0x80) >> (7 - i))
-            result.append(ms_bits)
-            for i in range(7):
-                if dataIndex + i < len(data):
-                    result.append(data[dataIndex + i] & 0x7f)
-            dataIndex += 7
-        return result
+        return MSBitCodec.escapeSysex(data)
 
     def install(self, module):
         # This is required because the original KnobKraft modules are not objects, but rather a module namespace with
@@ -227,4 +296,7 @@ class GenericSequential:
         setattr(module, 'convertToProgramDump', self.convertToProgramDump)
         setattr(module, 'calculateFingerprint', self.calculateFingerprint)
         setattr(module, 'renamePatch', self.renamePatch)
+        setattr(module, 'nameFromDumps', self.nameFromDumps)
+        setattr(module, 'calculateFingerprints', self.calculateFingerprints)
+        return self
 
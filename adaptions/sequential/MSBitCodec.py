@@ -0,0 +1,227 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+
+#
+# Shared codec for the "packed MS bit" format used by Sequential/DSI, Korg, Pioneer and Behringer:
+# Each group of 7 data bytes is preceded by one byte holding the most significant bits of the following 7 bytes,
+# bit 0 for the first byte of the group, bit 1 for the second and so on.
+#
+# Instead of looping over each byte in Python, whole buffers are processed with precomputed tables and
+# big integer bit operations, which are executed in C. If NumPy is installed, large blocks are vectorized with it.
+#
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Blocks smaller than this are faster without the NumPy setup overhead
+NUMPY_THRESHOLD = 8192
+
+# For every possible MS byte, the 7 high bits it contributes to its group, ready to be concatenated
+_HIGH_BITS = tuple(bytes(0x80 if ms & (1 << i) else 0 for i in range(7)) for ms in range(256))
+
+# For every position i in a group of 7, translation tables mapping a data byte to its contribution to the MS byte
+_MS_CONTRIBUTION = tuple(bytes(((x & 0x80) >> 7) << i for x in range(256)) for i in range(7))
+
+_LOW_BITS = bytes(x & 0x7f for x in range(256))
+
+if numpy is not None:
+    _SHIFTS = numpy.arange(7, dtype=numpy.uint8)
+
+
+def _as_buffer(data):
+    # Lists of ints as handed in by the C++ side are converted once, everything else is used as is
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+    return bytes(data)
+
+
+def unpack(data):
+    """Decode packed MS bit data (list, bytes or memoryview) into the 8 bit payload, returned as bytes"""
+    src = _as_buffer(data)
+    if numpy is not None and len(src) >= NUMPY_THRESHOLD:
+        return _unpack_numpy(src)
+    low = bytearray(src)
+    del low[0::8]
+    length = len(low)
+    if length == 0:
+        return b''
+    high = b''.join(map(_HIGH_BITS.__getitem__, src[0::8]))[:length]
+    return (int.from_bytes(low, 'big') | int.from_bytes(high, 'big')).to_bytes(length, 'big')
+
+
+def pack(data):
+    """Encode 8 bit data (list, bytes or memoryview) into packed MS bit format, returned as bytes"""
+    src = _as_buffer(data)
+    if isinstance(src, memoryview):
+        src = src.tobytes()
+    length = len(src)
+    if length == 0:
+        return b''
+    if numpy is not None and length >= NUMPY_THRESHOLD:
+        return _pack_numpy(src)
+    groups = (length + 6) // 7
+    ms_bits = 0
+    for i in range(7):
+        column = src[i::7].translate(_MS_CONTRIBUTION[i])
+        ms_bits |= int.from_bytes(column + bytes(groups - len(column)), 'big')
+    result = bytearray(length + groups)
+    result[0::8] = ms_bits.to_bytes(groups, 'big')
+    low = src.translate(_LOW_BITS)
+    for i in range(7):
+        result[i + 1::8] = low[i::7]
+    return bytes(result)
+
+
+def _unpack_numpy(src):
+    groups = (len(src) + 7) // 8
+    padded = numpy.zeros(groups * 8, dtype=numpy.uint8)
+    padded[:len(src)] = numpy.frombuffer(src, dtype=numpy.uint8)
+    blocks = padded.reshape(groups, 8)
+    high = ((blocks[:, :1] >> _SHIFTS) & 1) << 7
+    return (blocks[:, 1:] | high).reshape(-1)[:len(src) - groups].tobytes()
+
+
+def _pack_numpy(src):
+    length = len(src)
+    groups = (length + 6) // 7
+    padded = numpy.zeros(groups * 7, dtype=numpy.uint8)
+    padded[:length] = numpy.frombuffer(src, dtype=numpy.uint8)
+    blocks = padded.reshape(groups, 7)
+    result = numpy.empty((groups, 8), dtype=numpy.uint8)
+    result[:, 0] = numpy.bitwise_or.reduce((blocks >> 7) << _SHIFTS, axis=1)
+    result[:, 1:] = blocks & 0x7f
+    return result.reshape(-1)[:length + groups].tobytes()
+
+
+#
+# Random access: Both directions work in groups of 7 data bytes <-> 8 sysex bytes, so a range of the payload can be
+# decoded or replaced by touching only the groups covering it, e.g. to read or change a patch name
+#
+def unpack_range(data, start, length, offset=0, stop=None):
+    """Decode only the payload bytes start to start + length from the packed data in data[offset:stop], e.g. the data
+    block of a sysex message. Only the groups covering the range are sliced out of data"""
+    if stop is None:
+        stop = len(data)
+    first, last = start // 7, (start + length + 6) // 7
+    position = start - first * 7
+    return unpack(data[offset + first * 8:min(offset + last * 8, stop)])[position:position + length]
+
+
+def pack_range(data, start, replacement, offset=0, stop=None):
+    """Return a copy of data as bytearray, with the payload bytes from start on of the packed data in data[offset:stop]
+    replaced by the replacement bytes. Only the groups covering the replaced range are re-encoded, all other bytes,
+    e.g. the header and the 0xf7 of a sysex message, are copied unchanged"""
+    result = bytearray(data)
+    if stop is None:
+        stop = len(result)
+    first, last = start // 7, (start + len(replacement) + 6) // 7
+    begin, end = offset + first * 8, min(offset + last * 8, stop)
+    group = bytearray(unpack(result[begin:end]))
+    position = start - first * 7
+    group[position:position + len(replacement)] = replacement
+    result[begin:end] = pack(group)
+    return result
+
+
+def unpacked_length(packed_length):
+    """Number of payload bytes encoded in packed_length bytes of packed MS bit data"""
+    return packed_length - (packed_length + 7) // 8
+
+
+def split_packed(data, record_size, count):
+    """Transcode the first count records of record_size payload bytes each into their own packed MS bit encoding,
+    as e.g. needed to turn an all data dump into individual program dumps. Returns a list of bytes.
+    The data is decoded once, and all records padded to whole groups are encoded in one go, so the packed records
+    just need to be sliced out of the result"""
+    groups = (record_size + 6) // 7
+    padding = bytes(groups * 7 - record_size)
+    payload = unpack(_as_buffer(data)[:(count * record_size + 6) // 7 * 8])
+    records = range(0, count * record_size, record_size)
+    packed = pack(padding.join(payload[start:start + record_size] for start in records))
+    stride = groups * 8
+    return [packed[start:start + record_size + groups] for start in range(0, count * stride, stride)]
+
+
+#
+# List compatible API, drop in replacement for the unescapeSysex/escapeSysex functions found in the adaptations
+#
+def unescapeSysex(sysex):
+    return list(unpack(sysex))
+
+
+def escapeSysex(data):
+    return list(pack(data))
+
+
+if __name__ == "__main__":
+    def reference_unescape(sysex):
+        result = []
+        dataIndex = 0
+        while dataIndex < len(sysex):
+            msbits = sysex[dataIndex]
+            dataIndex += 1
+            for i in range(7):
+                if dataIndex < len(sysex):
+                    result.append(sysex[dataIndex] | ((msbits & (1 << i)) << (7 - i)))
+                dataIndex += 1
+        return result
+
+    def reference_escape(data):
+        result = []
+        dataIndex = 0
+        while dataIndex < len(data):
+            ms_bits = 0
+            for i in range(7):
+                if dataIndex + i < len(data):
+                    ms_bits = ms_bits | ((data[dataIndex + i] & 0x80) >> (7 - i))
+            result.append(ms_bits)
+            for i in range(7):
+                if dataIndex + i < len(data):
+                    result.append(data[dataIndex + i] & 0x7f)
+            dataIndex += 7
+        return result
+
+    import random
+    for size in list(range(20)) + [254, 4096, 8192, 9000]:
+        test_data = [random.randrange(256) for _ in range(size)]
+        escaped = escapeSysex(test_data)
+        assert escaped == reference_escape(test_data)
+        assert unescapeSysex(escaped) == test_data
+        assert unescapeSysex(escaped) == reference_unescape(escaped)
+        assert unpack(memoryview(bytes(escaped))) == bytes(test_data)
+        assert pack(memoryview(bytes(test_data))) == bytes(escaped)
+
+    test_data = bytes(random.randrange(256) for _ in range(500))
+    packed = pack(test_data)
+    for start, length in [(0, 7), (3, 20), (418, 20), (480, 20), (499, 1), (100, 0)]:
+        assert unpack_range(packed, start, length) == test_data[start:start + length]
+        assert unpack_range(memoryview(packed), start, length) == test_data[start:start + length]
+        replacement = bytes(random.randrange(256) for _ in range(length))
+        expected = test_data[:start] + replacement + test_data[start + length:]
+        assert pack_range(packed, start, replacement) == pack(expected)
+        assert pack_range(list(packed), start, replacement) == pack(expected)
+        message = [0xf0, 0x01, 0x2a, 0x03] + list(packed) + [0xf7]
+        assert unpack_range(message, start, length, 4, len(message) - 1) == test_data[start:start + length]
+        assert pack_range(message, start, replacement, 4, len(message) - 1) == bytes(message[:4]) + pack(expected) + b'\xf7'
+
+    for record_size in (7, 172, 254):
+        test_data = bytes(random.randrange(256) for _ in range(record_size * 20 + 3))
+        packed = pack(test_data)
+        assert unpacked_length(len(packed)) == len(test_data)
+        records = split_packed(list(packed), record_size, 20)
+        assert records == [pack(test_data[i:i + record_size]) for i in range(0, record_size * 20, record_size)]
+        assert split_packed(memoryview(packed), record_size, 20) == records
+
+    import timeit
+    test_data = [random.randrange(256) for _ in range(4096)]
+    escaped = reference_escape(test_data)
+    before = timeit.timeit(lambda: reference_unescape(escaped), number=100)
+    after = timeit.timeit(lambda: unescapeSysex(escaped), number=100)
+    print("unescape 4 KB: %.2f ms -> %.2f ms" % (before * 10, after * 10))
+    before = timeit.timeit(lambda: reference_escape(test_data), number=100)
+    after = timeit.timeit(lambda: escapeSysex(test_data), number=100)
+    print("escape 4 KB: %.2f ms -> %.2f ms" % (before * 10, after * 10))
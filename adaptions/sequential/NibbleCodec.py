@@ -0,0 +1,94 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+
+#
+# Codec for nibbled sysex data as used by Oberheim (Matrix 6, Matrix 1000, OB-8) and many other vintage synths:
+# Every data byte is transmitted as two sysex bytes, the low nibble first, then the high nibble.
+#
+# The nibble pairs are split with strided slices and recombined with a translation table and a big integer OR,
+# so no Python code runs per byte.
+#
+_SHIFT_UP = bytes((x << 4) & 0xff for x in range(256))
+_LOW_NIBBLE = bytes(x & 0x0f for x in range(256))
+_HIGH_NIBBLE = bytes(x >> 4 for x in range(256))
+
+
+def _as_buffer(data):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+    return bytes(data)
+
+
+def _split(src, start, stop):
+    # Returns the low and high nibbles of the pairs starting at the positions start, start + 2, ... < stop
+    if stop is None:
+        stop = len(src)
+    low = src[start:stop:2]
+    high = src[start + 1:start + 1 + 2 * len(low):2]
+    if isinstance(src, memoryview):
+        return low.tobytes(), high.tobytes()
+    return low, high
+
+
+def unpack(data, start=0, stop=None):
+    """Denibble the pairs in data[start:stop] (list, bytes or memoryview) and return the bytes"""
+    low, high = _split(_as_buffer(data), start, stop)
+    length = len(low)
+    if length == 0:
+        return b''
+    shifted = high.translate(_SHIFT_UP)
+    return (int.from_bytes(low, 'big') | int.from_bytes(shifted, 'big')).to_bytes(length, 'big')
+
+
+def pack(data):
+    """Nibble the data (list, bytes or memoryview), returns bytes with twice the length"""
+    src = _as_buffer(data)
+    if isinstance(src, memoryview):
+        src = src.tobytes()
+    result = bytearray(len(src) * 2)
+    result[0::2] = src.translate(_LOW_NIBBLE)
+    result[1::2] = src.translate(_HIGH_NIBBLE)
+    return bytes(result)
+
+
+#
+# List compatible API, drop in replacement for the denibble/nibble functions found in the adaptations
+#
+def denibble(message, start=0, stop=None):
+    return list(unpack(message, start, stop))
+
+
+def nibble(message):
+    return list(pack(message))
+
+
+if __name__ == "__main__":
+    def reference_denibble(message, start, stop):
+        return [message[x] | (message[x + 1] << 4) for x in range(start, stop, 2)]
+
+    def reference_nibble(message):
+        result = []
+        for b in message:
+            result.append(b & 0x0f)
+            result.append((b & 0xf0) >> 4)
+        return result
+
+    import random
+    for size in list(range(20)) + [134, 8192, 9000]:
+        test_data = [random.randrange(256) for _ in range(size)]
+        nibbled = nibble(test_data)
+        assert nibbled == reference_nibble(test_data)
+        assert denibble(nibbled) == test_data
+        message = [0xf0, 0x10, 0x06, 0x01, 0x00] + nibbled + [0x00, 0xf7]
+        assert denibble(message, 5, len(message) - 2) == reference_denibble(message, 5, len(message) - 2)
+        assert unpack(memoryview(bytes(message)), 5, len(message) - 2) == bytes(test_data)
+
+    import timeit
+    test_data = [random.randrange(256) for _ in range(134)]
+    message = [0xf0, 0x10, 0x06, 0x01, 0x00] + reference_nibble(test_data) + [0x00, 0xf7]
+    before = timeit.timeit(lambda: reference_denibble(message, 5, len(message) - 2), number=1000)
+    after = timeit.timeit(lambda: denibble(message, 5, len(message) - 2), number=1000)
+    print("denibble Matrix patch: %.1f us -> %.1f us" % (before * 1000, after * 1000))
@@ -0,0 +1,53 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+import hashlib
+from collections import OrderedDict, namedtuple
+
+# What we know about a message after classifying and decoding it once
+DecodedMessage = namedtuple("DecodedMessage", ["kind", "header_len", "payload"])
+
+CacheStatistics = namedtuple("CacheStatistics", ["hits", "misses", "size", "max_size"])
+
+
+def message_digest(message):
+    # The C++ side hands in lists of ints, these need to become bytes before they can be hashed
+    if not isinstance(message, (bytes, bytearray, memoryview)):
+        message = bytes(message)
+    return hashlib.sha1(message).digest()
+
+
+class PayloadCache:
+    """Bounded LRU cache keyed by message digest. During an import the host calls nameFromDump,
+    calculateFingerprint and friends in a row on the same message, this makes sure we decode it only once."""
+
+    def __init__(self, max_size=256):
+        self.__max_size = max_size
+        self.__entries = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+
+    def get(self, key):
+        entry = self.__entries.get(key)
+        if entry is None:
+            self.__misses += 1
+            return None
+        self.__hits += 1
+        self.__entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.__entries[key] = entry
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.__max_size:
+            self.__entries.popitem(last=False)
+
+    def clear(self):
+        self.__entries.clear()
+        self.__hits = 0
+        self.__misses = 0
+
+    def statistics(self):
+        return CacheStatistics(self.__hits, self.__misses, len(self.__entries), self.__max_size)
@@ -0,0 +1,137 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+
+#
+# Profiling of code within an adaptation. Inside the KnobKraft Orm, the measurements go into the Orm's adaptation
+# profiler (module knobkraft), which is switched on and off in the Adaptation tab and lists them next to the calls the
+# Orm makes into the adaptation. Standalone, e.g. when running the tests of an adaptation, they are collected here in the
+# same format:
+#
+#     profiler = Profiler(name())
+#
+#     @profiler.profiled
+#     def extractPatchesFromBank(message):
+#         with profiler.measure("unpack voices", len(message)):
+#             ...
+#
+import contextlib
+import functools
+import json
+import time
+
+try:
+    import knobkraft
+except ImportError:
+    knobkraft = None
+
+# Same buckets as the Orm uses: bucket 0 counts calls below 1 microsecond, bucket i the calls between 2^(i-1) and 2^i
+# microseconds, the last bucket everything longer. Its upper bound is published as None
+HISTOGRAM_BUCKETS = 24
+
+
+def histogram_bucket(seconds):
+    bucket = 0
+    limit = 1e-6
+    while seconds >= limit and bucket < HISTOGRAM_BUCKETS - 1:
+        limit *= 2.0
+        bucket += 1
+    return bucket
+
+
+class Profiler:
+
+    def __init__(self, adaptation_name):
+        self.adaptation_name = adaptation_name
+        self.__enabled = False
+        self.__statistics = {}
+
+    def enabled(self):
+        if knobkraft is not None:
+            return knobkraft.profiler_enabled()
+        return self.__enabled
+
+    def enable(self, enabled=True):
+        if knobkraft is not None:
+            knobkraft.enable_profiler(enabled)
+        self.__enabled = enabled
+
+    def record(self, function_name, seconds, bytes_marshalled=0):
+        if knobkraft is not None:
+            knobkraft.record_call(self.adaptation_name, function_name, seconds, bytes_marshalled)
+            return
+        entry = self.__statistics.get(function_name)
+        if entry is None:
+            entry = {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0, "gil_wait_seconds": 0.0,
+                     "bytes_marshalled": 0, "histogram": [0] * HISTOGRAM_BUCKETS}
+            self.__statistics[function_name] = entry
+        entry["calls"] += 1
+        entry["total_seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+        entry["bytes_marshalled"] += bytes_marshalled
+        entry["histogram"][histogram_bucket(seconds)] += 1
+
+    @contextlib.contextmanager
+    def measure(self, function_name, bytes_marshalled=0):
+        if not self.enabled():
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(function_name, time.perf_counter() - start, bytes_marshalled)
+
+    def profiled(self, function):
+        """Decorator measuring every call of the function under its name"""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.measure(function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def statistics(self):
+        """All statistics as JSON string, inside the Orm those of all adaptations"""
+        if knobkraft is not None:
+            return knobkraft.profiler_statistics()
+        return json.dumps({"enabled": self.__enabled,
+                           "histogram_upper_bounds_us": [1 << i for i in range(HISTOGRAM_BUCKETS - 1)] + [None],
+                           "adaptations": {self.adaptation_name: self.__statistics}})
+
+    def clear(self):
+        if knobkraft is not None:
+            knobkraft.clear_profiler()
+        self.__statistics = {}
+
+
+if __name__ == "__main__":
+    assert histogram_bucket(0.0) == 0
+    assert histogram_bucket(0.5e-6) == 0
+    assert histogram_bucket(1e-6) == 1
+    assert histogram_bucket(3e-6) == 2
+    assert histogram_bucket(1000.0) == HISTOGRAM_BUCKETS - 1
+
+    profiler = Profiler("Test")
+
+    @profiler.profiled
+    def work(n):
+        return sum(range(n))
+
+    assert work(10) == 45
+    assert json.loads(profiler.statistics())["adaptations"]["Test"] == {}
+    profiler.enable()
+    for _ in range(3):
+        work(1000)
+    with profiler.measure("block", 100):
+        work(10)
+    bounds = json.loads(profiler.statistics())["histogram_upper_bounds_us"]
+    assert len(bounds) == HISTOGRAM_BUCKETS and bounds[-2] == 1 << (HISTOGRAM_BUCKETS - 2) and bounds[-1] is None
+    statistics = json.loads(profiler.statistics())["adaptations"]["Test"]
+    assert statistics["work"]["calls"] == 4
+    assert sum(statistics["work"]["histogram"]) == 4
+    assert statistics["block"]["bytes_marshalled"] == 100
+    assert statistics["block"]["total_seconds"] >= statistics["block"]["max_seconds"] > 0
+    profiler.clear()
+    assert json.loads(profiler.statistics())["adaptations"]["Test"] == {}
@@ -0,0 +1,134 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+import mmap
+import os
+
+#
+# Shared sysex splitting. The message boundaries are found with bytes.find(), which runs in C, and the messages
+# are handed out as memoryview slices of the source, so nothing is copied until the caller asks for it.
+#
+# Bytes outside of F0 ... F7 are skipped. If a new F0 appears before the F7 of the current message, the
+# current message is truncated and dropped, and we start over with the new one.
+#
+
+
+def iter_messages(data):
+    """Generator yielding one memoryview per sysex message found in data (bytes, bytearray, mmap or memoryview)"""
+    view = memoryview(data)
+    searchable = _searchable(data)
+    start = searchable.find(b'\xf0')
+    while start != -1:
+        end = searchable.find(b'\xf7', start + 1)
+        if end == -1:
+            return
+        restart = searchable.rfind(b'\xf0', start + 1, end)
+        if restart != -1:
+            start = restart
+        yield view[start:end + 1]
+        start = searchable.find(b'\xf0', end + 1)
+
+
+def _searchable(data):
+    # A memoryview has no find(). If it covers all of the object it was made from, we can search that one,
+    # else a copy is needed because the offset of the view into its object is unknown
+    if not isinstance(data, memoryview):
+        return data
+    if hasattr(data.obj, 'find') and data.contiguous and data.nbytes == len(data.obj):
+        return data.obj
+    return data.tobytes()
+
+
+def read_sysex(filename):
+    """Generator yielding the messages of a .syx file as memoryviews into a memory map of the file. Only the
+    pages touched are read, so arbitrarily large files can be scanned with constant memory. The views are only
+    valid while the generator is alive, copy them with bytes() or list() if you need to keep them"""
+    with open(filename, mode="rb") as sysex_file:
+        if os.fstat(sysex_file.fileno()).st_size == 0:
+            return
+        mapped = mmap.mmap(sysex_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield from iter_messages(mapped)
+        finally:
+            try:
+                mapped.close()
+            except BufferError:
+                # The caller still holds some of the views, the map is freed together with them
+                pass
+
+
+#
+# List API for the adaptations, which get and return lists of ints
+#
+def split_sysex(data):
+    """Split a list of ints (or bytes) containing multiple sysex messages into a list of messages, each a list of ints"""
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data)
+    return [list(message) for message in iter_messages(data)]
+
+
+def load_sysex(filename):
+    """Read all messages of a .syx file as lists of ints"""
+    return [list(message) for message in read_sysex(filename)]
+
+
+def iter_bank_patches(result):
+    """Generator over what extractPatchesFromBank returned, yielding (position in the bank, message as list of ints).
+    This is either the classic flat list of ints with all messages concatenated, or an iterable of messages"""
+    if isinstance(result, (bytes, bytearray)) or (isinstance(result, list) and (not result or isinstance(result[0], int))):
+        for program, message in enumerate(iter_messages(bytes(result))):
+            yield program, list(message)
+        return
+    for program, item in enumerate(result):
+        yield program, list(item)
+
+
+if __name__ == "__main__":
+    assert split_sysex([]) == []
+    assert split_sysex([0xf0, 0x01, 0xf7]) == [[0xf0, 0x01, 0xf7]]
+    # Leading, trailing and in between garbage is skipped
+    assert split_sysex([0x00, 0x7f, 0xf0, 0x01, 0xf7, 0x02, 0xf0, 0x03, 0x04, 0xf7, 0xf0, 0x05]) == \
+        [[0xf0, 0x01, 0xf7], [0xf0, 0x03, 0x04, 0xf7]]
+    # A message interrupted by a new F0 is dropped
+    assert split_sysex(bytes([0xf0, 0x01, 0xf0, 0x02, 0xf7])) == [[0xf0, 0x02, 0xf7]]
+    messages = list(iter_messages(memoryview(bytes([0x10, 0xf0, 0x01, 0xf7, 0xf0, 0x02, 0xf7]))[1:]))
+    assert [bytes(m) for m in messages] == [b'\xf0\x01\xf7', b'\xf0\x02\xf7']
+    expected = [(0, [0xf0, 0x01, 0xf7]), (1, [0xf0, 0x02, 0xf7])]
+    assert list(iter_bank_patches([0xf0, 0x01, 0xf7, 0xf0, 0x02, 0xf7])) == expected
+    assert list(iter_bank_patches([b'\xf0\x01\xf7', [0xf0, 0x02, 0xf7]])) == expected
+    assert list(iter_bank_patches(iter([b'\xf0\x01\xf7', bytearray(b'\xf0\x02\xf7')]))) == expected
+    assert list(iter_bank_patches([])) == []
+
+    import tempfile
+    import timeit
+    test_data = b''.join(bytes([0xf0, 0x01, 0x20] + [i & 0x7f] * 500 + [0xf7]) for i in range(2000))
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "test.syx")
+        with open(filename, "wb") as test_file:
+            test_file.write(test_data)
+        assert sum(1 for _ in read_sysex(filename)) == 2000
+        kept = [m for m in read_sysex(filename)]
+        assert bytes(kept[1999]) == test_data[-504:]
+        del kept
+        with open(os.path.join(directory, "empty.syx"), "wb"):
+            pass
+        assert load_sysex(os.path.join(directory, "empty.syx")) == []
+
+        def reference_load_sysex():
+            with open(filename, mode="rb") as midi_messages:
+                content = midi_messages.read()
+                result = []
+                start_index = 0
+                for index, byte in enumerate(content):
+                    if byte == 0xf7:
+                        result.append(list(content[start_index:index + 1]))
+                        start_index = index + 1
+                return result
+
+        assert reference_load_sysex() == load_sysex(filename)
+        before = timeit.timeit(reference_load_sysex, number=3)
+        after = timeit.timeit(lambda: load_sysex(filename), number=3)
+        scan = timeit.timeit(lambda: sum(len(m) for m in read_sysex(filename)), number=3)
+        print("load 1 MB: %.1f ms -> %.1f ms, scan only %.1f ms" % (before * 333, after * 333, scan * 333))
@@ -5,6 +5,8 @@
 #
 import unittest
 
+from .SysexStream import load_sysex
+
 
 #
 # Implement a customizable but generic Test Suite for testing any adaptations functionality!
@@ -57,6 +59,19 @@ class IsProgramDumpTest(AdaptationTestBase):
         data = self.synth.calculateFingerprint(self.program_dump)
 
 
+class BatchTest(AdaptationTestBase):
+    def __init__(self, synth, program_dump):
+        super().__init__(synth)
+        self.program_dump = program_dump
+
+    def runTest(self):
+        renamed = self.synth.renamePatch(self.program_dump, "newname")
+        messages = [self.program_dump, renamed]
+        self.assertEqual(self.synth.nameFromDumps(messages), [self.synth.nameFromDump(m) for m in messages])
+        self.assertEqual(self.synth.calculateFingerprints(messages),
+                         [self.synth.calculateFingerprint(m) for m in messages])
+
+
 # This is needed to dynamically create the test cases as we parametrize them with the module to test and
 # additional data like an example patch
 def create_tests(synth, program_dump=None, program_name=None):
@@ -68,16 +83,6 @@ def create_tests(synth, program_dump=None, program_name=None):
         suite.addTest(RenameTest(synth, program_dump))
     if hasattr(synth, "isSingleProgramDump") and program_dump is not None:
         suite.addTest(IsProgramDumpTest(synth, program_dump))
+    if hasattr(synth, "nameFromDumps") and hasattr(synth, "calculateFingerprints") and program_dump is not None:
+        suite.addTest(BatchTest(synth, program_dump))
     return suite
-
-
-def load_sysex(filename):
-    with open(filename, mode="rb") as midi_messages:
-        content = midi_messages.read()
-        messages = []
-        start_index = 0
-        for index, byte in enumerate(content):
-            if byte == 0xf7:
-                messages.append(list(content[start_index:index + 1]))
-                start_index = index + 1
-        return messages
@@ -1,2 +1,33 @@
+import importlib
+
 from .GenericSequential import GenericSequential
-from .TestAdaptation import create_tests, load_sysex
+
+# The helpers for tests, sysex files, profiling and worker processes are only imported when used, so loading an
+# adaptation does not pull in unittest, concurrent.futures, pickle and the like
+_lazy_names = {
+    "create_tests": "TestAdaptation",
+    "load_sysex": "SysexStream",
+    "read_sysex": "SysexStream",
+    "split_sysex": "SysexStream",
+    "iter_bank_patches": "SysexStream",
+    "Profiler": "Profiler",
+    "WorkerPool": "AdaptationWorker",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_names:
+        value = getattr(importlib.import_module("." + _lazy_names[name], __name__), name)
+        globals()[name] = value
+        return value
+    # Submodules used as attributes, e.g. sequential.TestAdaptation
+    try:
+        return importlib.import_module("." + name, __name__)
+    except ModuleNotFoundError as e:
+        if e.name != __name__ + "." + name:
+            raise
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_names))
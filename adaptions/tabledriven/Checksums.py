@@ -0,0 +1,50 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+
+#
+# Checksum kernels for the "Checksum Type" of a bank driver. Each kernel takes the bytes between the SUM marker and
+# the CHK byte of a template and returns the 7 bit checksum. They run sum() over bytes, which is done in C.
+#
+
+
+def kawai_k1_k4(data):
+    # Kawai K1 and K4: The sum of all data bytes plus 0xa5, lower 7 bits
+    return (0xa5 + sum(data)) & 0x7f
+
+
+def roland(data):
+    # Roland, and Yamaha for their bulk dumps: The two's complement of the sum, lower 7 bits
+    return -sum(data) & 0x7f
+
+
+def sum_7bit(data):
+    return sum(data) & 0x7f
+
+
+CHECKSUMS = {
+    "Kawai K1/K4": kawai_k1_k4,
+    "Roland": roland,
+    "Yamaha": roland,
+    "Sum 7 bit": sum_7bit,
+}
+
+
+def kernel(checksum_type):
+    """Return the checksum function for the given "Checksum Type", None if the type is None"""
+    if checksum_type is None:
+        return None
+    if checksum_type not in CHECKSUMS:
+        raise Exception("Unknown checksum type %s, known are %s" % (checksum_type, ", ".join(CHECKSUMS.keys())))
+    return CHECKSUMS[checksum_type]
+
+
+if __name__ == "__main__":
+    assert kawai_k1_k4(b'') == 0x25
+    assert kawai_k1_k4(bytes([0x7f] * 3)) == (0xa5 + 3 * 0x7f) & 0x7f
+    assert roland([0x40, 0x00, 0x7f]) == 0x41
+    assert (roland(b'\x01\x02\x03') + 6) & 0x7f == 0
+    assert kernel(None) is None
+    assert kernel("Yamaha") is roland
@@ -0,0 +1,157 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+
+from .Templates import CompiledTemplate, TemplateDispatcher
+
+
+class TableDrivenAdaptation:
+    """Implements the adaptation functions from a declarative description of the synth, a dict with the bank drivers
+    and their request and reply templates. See KawaiK1.py for an example.
+
+    Program numbers as seen by the Orm count through all bank drivers, the first program of a driver is the sum of
+    the entries of all drivers before it. The program number on the wire (EN#) starts at the first value of the
+    "Offsets" of the driver, so two drivers can share a request with different EN# ranges."""
+
+    def __init__(self, adaptation):
+        self.adaptation = adaptation
+        self.__drivers = adaptation["Bank Drivers"]
+        self.__device_id_offset = adaptation["Device ID"][0]
+        self.__bases = []
+        base = 0
+        for driver in self.__drivers:
+            self.__bases.append(base)
+            base += driver["# of Entries"]
+        self.single_replies = TemplateDispatcher(adaptation, "Single Reply")
+        self.bank_replies = TemplateDispatcher(adaptation, "Bank Reply")
+        self.__single_requests = [CompiledTemplate(d["Single Request"], 1, 0, self.__device_id_offset)
+                                  for d in self.__drivers]
+
+    def install(self, module):
+        for function_name in ["name", "createDeviceDetectMessage", "needsChannelSpecificDetection",
+                              "deviceDetectWaitMilliseconds", "generalMessageDelay", "channelIfValidDeviceResponse",
+                              "numberOfBanks", "numberOfPatchesPerBank", "createProgramDumpRequest",
+                              "isSingleProgramDump", "convertToProgramDump", "nameFromDump", "numberFromDump",
+                              "createBankDumpRequest", "isPartOfBankDump", "isBankDumpFinished",
+                              "extractPatchesFromBank", "friendlyBankName"]:
+            setattr(module, function_name, getattr(self, function_name))
+        return self
+
+    def name(self):
+        return self.adaptation["Manufacturer Name"] + " " + self.adaptation["Model"]
+
+    def createDeviceDetectMessage(self, channel):
+        if self.adaptation["Scan with Universal Device Inquiry"]:
+            raise Exception("Universal Device Inquiry not implemented yet")
+        else:
+            return self.insertDeviceID(channel, self.adaptation["Scan request"])
+
+    def needsChannelSpecificDetection(self):
+        return True
+
+    def deviceDetectWaitMilliseconds(self):
+        return self.adaptation["Default Timeout"]
+
+    def generalMessageDelay(self):
+        return self.adaptation["Default Send Pause"]
+
+    def channelIfValidDeviceResponse(self, message):
+        if self.ignoreDeviceID(message) == self.adaptation["Scan reply"]:
+            return message[self.__device_id_offset] & 0x0f
+        return -1
+
+    def numberOfBanks(self):
+        return len(self.__drivers)
+
+    def numberOfPatchesPerBank(self):
+        # Ouch, that is not necessarily the same for all banks
+        return self.__drivers[0]["# of Entries"]
+
+    def createProgramDumpRequest(self, channel, program_no):
+        b = self.bankNoForProgramNo(program_no)
+        return list(self.__single_requests[b].build(self.wireProgramNo(b, program_no), [],
+                                                    self.deviceID(channel)))
+
+    def isSingleProgramDump(self, message):
+        return self.single_replies.match(message) is not None
+
+    def convertToProgramDump(self, channel, message, program_no):
+        matched = self.single_replies.match(message)
+        if matched is not None:
+            _, template, data = matched
+            # The target program decides the driver, e.g. internal or external memory
+            b = self.bankNoForProgramNo(program_no)
+            target = self.single_replies.templates[b]
+            return list(target.build(self.wireProgramNo(b, program_no), [template.data(data)], self.deviceID(channel)))
+        raise Exception("Can only convert single program dumps!")
+
+    def nameFromDump(self, message):
+        matched = self.single_replies.match(message)
+        if matched is not None:
+            b, template, data = matched
+            data_type = self.adaptation["Data Types"][self.__drivers[b]["Data Type"]]
+            name_offset = data_type["Name Offset"]
+            name = template.data(data)[name_offset:name_offset + data_type["Name Size"]]
+            # Ignoring character set conversion for now
+            return name.decode("latin-1")
+        raise Exception("Not implemented yet")
+
+    def numberFromDump(self, message):
+        matched = self.single_replies.match(message)
+        if matched is not None:
+            b, template, data = matched
+            return self.__bases[b] + template.program(data) - self.__drivers[b]["Offsets"][0]
+        raise Exception("Only single program dumps have program numbers")
+
+    def createBankDumpRequest(self, channel, bank):
+        return self.insertDeviceID(channel, self.__drivers[bank]["Bank Request"])
+
+    def isPartOfBankDump(self, message):
+        return self.bank_replies.match(message) is not None
+
+    def isBankDumpFinished(self, messages):
+        for message in messages:
+            if self.isPartOfBankDump(message):
+                return True
+        return False
+
+    def extractPatchesFromBank(self, message):
+        result = []
+        matched = self.bank_replies.match(message)
+        if matched is not None:
+            b, template, data = matched
+            errors = template.checksum_errors(data)
+            if errors:
+                raise Exception("Bank dump of %s has checksum errors in entries %s" % (self.friendlyBankName(b), errors))
+            single_template = self.single_replies.templates[b]
+            for i in range(template.entries):
+                # Keep the index in the bank and checksum 0, as the fingerprint is calculated from the whole message
+                # and must not change for the patches already in the database
+                single_dump = single_template.build(i, [template.data(data, i)], checksums=False)
+                result.append(bytes(single_dump))
+        return result
+
+    def friendlyBankName(self, bank):
+        return self.__drivers[bank]["Bank Name"]
+
+    def bankNoForProgramNo(self, program_number):
+        for b in range(len(self.__drivers) - 1, -1, -1):
+            if program_number >= self.__bases[b]:
+                return b
+        return 0
+
+    def wireProgramNo(self, bank, program_number):
+        """The EN# sent to the synth for the Orm's program number"""
+        return program_number - self.__bases[bank] + self.__drivers[bank]["Offsets"][0]
+
+    def deviceID(self, channel):
+        # TODO not sure what to do with the device ID min and max values. Is this for display?
+        return (channel & 0x0f) if channel != -1 else 0
+
+    def insertDeviceID(self, channel, message):
+        return message[0:self.__device_id_offset] + [self.deviceID(channel)] + message[self.__device_id_offset + 1:]
+
+    def ignoreDeviceID(self, message):
+        return message[0:self.__device_id_offset] + [0] + message[self.__device_id_offset + 1:]
@@ -0,0 +1,154 @@
+#
+#   Copyright (c) 2021 Christof Ruch. All rights reserved.
+#
+#   Dual licensed: Distributed under Affero GPL license by default, an MIT license is available for purchase
+#
+from .Checksums import kernel
+
+
+class CompiledTemplate:
+    """A request or reply template from the bank drivers, resolved once into fixed offsets. The pseudo bytes become
+    positions: EN# is one byte program number, SIN a block of single data, CHK one checksum byte, SUM marks where the
+    checksum summation starts and takes no space. A [ ... ] group is unrolled to the number of entries of the bank
+    driver."""
+
+    def __init__(self, template, entries, single_size, device_id_offset, checksum=None):
+        self.entries = entries
+        self.single_size = single_size
+        self.checksum = checksum
+        self.program_offsets = []
+        self.data_offsets = []
+        self.checksum_offsets = []
+        self.sum_offsets = []
+        # (start, end) of the bytes each checksum byte covers
+        self.checksum_ranges = []
+        # Runs of fixed bytes to compare as (offset, bytes), leaving out the device ID
+        self.fixed = []
+        self.header_length = None
+        self.device_id_offset = device_id_offset
+        skeleton = bytearray()
+        for token in CompiledTemplate.unroll(template, entries):
+            offset = len(skeleton)
+            if type(token) is str:
+                if self.header_length is None:
+                    self.header_length = offset
+                if token == "EN#":
+                    self.program_offsets.append(offset)
+                    skeleton.append(0)
+                elif token == "SIN":
+                    self.data_offsets.append(offset)
+                    skeleton.extend(bytes(single_size))
+                elif token == "CHK":
+                    if not self.sum_offsets:
+                        raise Exception("Template has a CHK without a SUM before it")
+                    self.checksum_offsets.append(offset)
+                    self.checksum_ranges.append((self.sum_offsets[-1], offset))
+                    skeleton.append(0)
+                elif token == "SUM":
+                    self.sum_offsets.append(offset)
+                else:
+                    raise Exception("Unknown pseudo byte " + token)
+            else:
+                if offset != device_id_offset:
+                    if self.fixed and self.fixed[-1][0] + len(self.fixed[-1][1]) == offset:
+                        self.fixed[-1] = (self.fixed[-1][0], self.fixed[-1][1] + bytes([token]))
+                    else:
+                        self.fixed.append((offset, bytes([token])))
+                skeleton.append(token)
+        self.length = len(skeleton)
+        if self.header_length is None:
+            self.header_length = self.length
+        self.__skeleton = bytes(skeleton)
+
+    @staticmethod
+    def unroll(template, entries):
+        result = []
+        loop_start = None
+        for index, token in enumerate(template):
+            if token == "[":
+                loop_start = index + 1
+            elif token == "]":
+                result.extend(template[loop_start:index] * (entries - 1))
+                loop_start = None
+            else:
+                result.append(token)
+        return result
+
+    def matches(self, data):
+        # data is the message as bytes
+        if len(data) != self.length:
+            return False
+        for offset, fixed in self.fixed:
+            if data[offset:offset + len(fixed)] != fixed:
+                return False
+        return True
+
+    def program(self, data, entry=0):
+        return data[self.program_offsets[entry]] if self.program_offsets else -1
+
+    def data(self, data, entry=0):
+        start = self.data_offsets[entry]
+        return data[start:start + self.single_size]
+
+    def checksum_errors(self, data):
+        """Returns the indexes of the checksum bytes in data that do not match their data"""
+        if self.checksum is None:
+            return []
+        return [index for index, (start, end) in enumerate(self.checksum_ranges)
+                if data[end] != self.checksum(data[start:end])]
+
+    def build(self, program_no, data_blocks, device_id=0, checksums=True):
+        """Create the message for the given program number and data blocks, one per SIN in the template.
+        The checksums are calculated if the bank driver has a checksum type, else they are left 0. Returns a bytearray"""
+        result = bytearray(self.__skeleton)
+        if self.device_id_offset < len(result):
+            result[self.device_id_offset] = device_id
+        for offset in self.program_offsets:
+            result[offset] = program_no
+        for offset, block in zip(self.data_offsets, data_blocks):
+            result[offset:offset + self.single_size] = block
+        if checksums and self.checksum is not None:
+            for offset, (start, end) in zip(self.checksum_offsets, self.checksum_ranges):
+                result[offset] = self.checksum(result[start:end])
+        return result
+
+
+class TemplateDispatcher:
+    """Finds the bank driver for a message by looking up its header bytes, so only one template is tried. If more than
+    one bank driver uses the same header, the program number in the message decides"""
+
+    def __init__(self, adaptation, template_name):
+        self.templates = []
+        self.__device_id_offset = adaptation["Device ID"][0]
+        self.__by_header = {}
+        for b, driver in enumerate(adaptation["Bank Drivers"]):
+            if driver.get("Transmission Format", "7bit") != "7bit":
+                raise Exception("Transmission format %s is not supported" % driver["Transmission Format"])
+            entries = driver["# of Entries"] if template_name == "Bank Reply" else 1
+            template = CompiledTemplate(driver[template_name], entries,
+                                        adaptation["Data Types"][driver["Data Type"]]["Size"], self.__device_id_offset,
+                                        kernel(driver.get("Checksum Type")))
+            self.templates.append(template)
+            # The range of program numbers this driver covers on the wire
+            first = driver["Offsets"][0]
+            key = self.__header_key(driver[template_name][:template.header_length])
+            self.__by_header.setdefault(template.header_length, {}).setdefault(key, []).append(
+                (b, template, range(first, first + driver["# of Entries"])))
+
+    def __header_key(self, header):
+        key = bytearray(header)
+        if self.__device_id_offset < len(key):
+            key[self.__device_id_offset] = 0
+        return bytes(key)
+
+    def match(self, message):
+        """Returns (bank driver index, template, message as bytes) or None"""
+        data = message if isinstance(message, bytes) else bytes(message)
+        for header_length, candidates in self.__by_header.items():
+            hits = candidates.get(self.__header_key(data[:header_length]))
+            if hits is None:
+                continue
+            for b, template, programs in hits:
+                if template.matches(data) and (len(hits) == 1 or template.program(data) in programs):
+                    return b, template, data
+        return None
@@ -0,0 +1,3 @@
+from .TableDrivenAdaptation import TableDrivenAdaptation
+from .Templates import CompiledTemplate, TemplateDispatcher
+from .Checksums import CHECKSUMS